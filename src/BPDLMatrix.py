@@ -0,0 +1,69 @@
+# Bit-parallel Damerau-Levenshtein (optimal string alignment) edit distance matrix after
+# Myers and Hyyro. Instead of a row of numbers per inserted char, a row is kept as bit vectors
+# of the differences between neighbouring cells (VP: +1, VN: -1), which the next row is computed
+# from with a handful of integer operations. Same interface as DLMatrix, so keyDict can use
+# either one for the fuzzy search
+try:
+    popCount = int.bit_count
+except AttributeError:
+    def popCount(x):
+        return bin(x).count("1")
+
+
+class BPDLMatrix:
+    def __init__(self, refWord):
+        self._refWord = refWord
+        refLen = len(refWord)
+        self._refLen = refLen
+        self._mask = (1 << refLen) - 1
+        self._lastBit = 1 << (refLen - 1) if refLen > 0 else 0
+        # Bit j of _matchBits[c] is set if refWord[j] == c
+        self._matchBits = {}
+        for j in range(refLen):
+            c = refWord[j]
+            self._matchBits[c] = self._matchBits.get(c, 0) | (1 << j)
+        # One entry per row: VP, VN, D0 and the match bits of the row's char, and the
+        # last cell of the row. Row 0 is 0, 1, 2 ... so all differences are +1
+        self._rows = [(self._mask, 0, 0, 0, refLen)]
+
+    def insertChar(self, c):
+        vp, vn, prevD0, prevMatch, lastCell = self._rows[-1]
+        mask = self._mask
+        match = self._matchBits.get(c, 0)
+        # Diagonal zero differences, the transposition term marks cells where c and the
+        # previous char are swapped against refWord
+        transposed = (((~prevD0) & match) << 1) & prevMatch
+        d0 = ((((match & vp) + vp) ^ vp) | match | vn | transposed) & mask
+        hp = (vn | ~(d0 | vp)) & mask
+        hn = vp & d0
+        if hp & self._lastBit:
+            lastCell += 1
+        elif hn & self._lastBit:
+            lastCell -= 1
+        elif mask == 0:
+            lastCell += 1
+        # The first column of every row is the row number, one more than above it
+        hp = ((hp << 1) | 1) & mask
+        hn = (hn << 1) & mask
+        vp = (hn | ~(d0 | hp)) & mask
+        vn = hp & d0
+        self._rows.append((vp, vn, d0, match, lastCell))
+
+    def popChar(self):
+        self._rows.pop()
+
+    # Value of cell j of the last row: the row number plus the differences
+    # of the first j cells
+    def getEditDistAt(self, j):
+        vp, vn, d0, match, lastCell = self._rows[-1]
+        bits = (1 << j) - 1
+        return len(self._rows) - 1 + popCount(vp & bits) - popCount(vn & bits)
+
+    def getEditDistForCharsSoFar(self):
+        numChars = len(self._rows) - 1
+        return self.getEditDistAt(min(numChars, self._refLen))
+
+    def getEditDistForWord(self):
+        if len(self._rows) > 1:
+            return self._rows[-1][4]
+        return 0
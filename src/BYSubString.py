@@ -1,3 +1,7 @@
+from bisect import bisect_right
+from itertools import accumulate
+
+
 class BoyerMooreMatch:
     def preComputeDict(self):
         # Just clearer to have two loops
@@ -35,18 +39,17 @@ class BoyerMooreMatch:
         while (i <= (textLen - patternLen)):
             mismatchFound = False
             end = i + patternLen - 1
-            for j in range(patternLen - 1, 0, -1):
+            for j in range(patternLen - 1, -1, -1):
                 chari = text[end]
                 charj = self._pattern[j]
                 if (chari == charj):
                     end -= 1
                 else:
                     mismatchFound = True
+                    # Line the rightmost occurrence of the mismatched char in the
+                    # pattern up with it, or move past it if there is none
                     skip = self.getRightMostPosOfChar(chari)
-                    if skip == -1:
-                        i = i + patternLen
-                    else:
-                        i = i + max(1, (j - skip))
+                    i = i + max(1, (j - skip))
                     break
 
             if mismatchFound is False:
@@ -56,6 +59,26 @@ class BoyerMooreMatch:
         return result
 
 
+# Whether pattern occurs in each of texts, as a list of bools. Instead of
+# one match per text, the texts are packed into one string separated by 0
+# chars with the start offset of every text kept aside, and the pattern is
+# found with str.find over the whole of it; a hit is mapped back to its
+# text by bisecting the offsets and the search goes on at the next text.
+# Neither the pattern nor the texts may hold the 0 char
+def batchMatches(pattern, texts):
+    mask = [False] * len(texts)
+    if not texts:
+        return mask
+    packed = "\0".join(texts)
+    starts = list(accumulate((len(text) + 1 for text in texts), initial=0))
+    pos = packed.find(pattern)
+    while pos >= 0:
+        i = bisect_right(starts, pos) - 1
+        mask[i] = True
+        pos = packed.find(pattern, starts[i + 1])
+    return mask
+
+
 def testBoyerMoore():
     pattern = "eryx"
     byMatch = BoyerMooreMatch(pattern)
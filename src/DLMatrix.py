@@ -31,7 +31,7 @@ class DLMatrix:
         row = []
 
         if len(self._charStack) > 0:
-            prevc = self._charStack[-1:]
+            prevc = self._charStack[-1]
         else:
             prevc = -1
         self._charStack.append(c)
@@ -56,16 +56,21 @@ class DLMatrix:
 
             if prevc != -1:
                 idxj = j - 1
-                if i > 1 and idxj > 1 and c == self._refWord[idxj - 1] and prevc == self._refWord[idxj]:
+                if i > 1 and idxj > 0 and c == self._refWord[idxj - 1] and prevc == self._refWord[idxj]:
                     diminus2jminus2 = self._DLArray[i - 2][j - 2]
                     dij = min(dij, diminus2jminus2 + 1)
             row.append(dij)
         self._DLArray.append(row)
 
-    def getEditDistForCharsSoFar(self):
+    # The distances below can be read for the first refLen chars of the
+    # reference word as well: the columns of a prefix of the reference word
+    # do not depend on the chars after it
+    def getEditDistForCharsSoFar(self, refLen=None):
         arrSize = len(self._DLArray)
         if arrSize > 0:
             cols = len(self._DLArray[0])
+            if refLen is not None:
+                cols = refLen + 1
             if cols > 0:
                 numCharsOnStack = len(self._charStack)
                 idxi = numCharsOnStack
@@ -73,10 +78,12 @@ class DLMatrix:
                 return self._DLArray[idxi][idxj]
         return 0
 
-    def getEditDistForWord(self):
+    def getEditDistForWord(self, refLen=None):
         arrSize = len(self._DLArray)
         if arrSize > 1:
             cols = len(self._DLArray[arrSize - 1])
+            if refLen is not None:
+                cols = refLen + 1
             if cols >= 1:
                 return self._DLArray[arrSize - 1][cols - 1]
         return 0
@@ -0,0 +1,134 @@
+# --------------------------------------------------------------------- #
+#  DLMatrix whose rows outlive it, for searching a query again after a
+#  keystroke. The rows are kept in a dlRowCache, a trie keyed by the chars
+#  inserted before each row, so walking a path again takes its rows from
+#  the cache instead of computing them. A row made for a shorter
+#  reference word only gets its missing columns computed, which is one
+#  per row when the query grew by one char; the columns of a prefix of
+#  the reference word do not depend on the chars after it, so a row made
+#  for a longer word is read as it is
+#
+#  The cache is emptied when the first char of the reference word changes,
+#  as only the first column of its rows would still hold, and when it has
+#  grown past maxRows rows
+# --------------------------------------------------------------------- #
+
+# Default number of rows a dlRowCache keeps between searches
+maxCachedRows = 20000
+
+
+class dlRowCache:
+    def __init__(self, maxRows=maxCachedRows):
+        self._maxRows = maxRows
+        self.clear()
+
+    # Drop all the rows
+    def clear(self):
+        # The word the rows were computed for
+        self._refWord = ""
+        # Entries are [row, {char: entry of the row below}]; the root holds
+        # the first row
+        self._root = [[0], {}]
+        self._numRows = 1
+
+    def getRoot(self):
+        return self._root
+
+    # Add the entry of the row of char c below parent
+    def addEntry(self, parent, c, row):
+        entry = [row, {}]
+        parent[1][c] = entry
+        self._numRows += 1
+        return entry
+
+    # Keep the rows valid for refWord: the columns past the part refWord
+    # shares with the word they were computed for are dropped, unless
+    # refWord is a prefix of that word
+    def setRefWord(self, refWord):
+        if self._numRows > self._maxRows:
+            self.clear()
+        numShared = 0
+        while (numShared < min(len(refWord), len(self._refWord)) and
+               refWord[numShared] == self._refWord[numShared]):
+            numShared += 1
+        if numShared == len(refWord):
+            return
+        if numShared == 0:
+            self.clear()
+        elif numShared < len(self._refWord):
+            stack = [self._root]
+            while stack:
+                entry = stack.pop()
+                del entry[0][numShared + 1:]
+                stack.extend(entry[1].values())
+        self._refWord = refWord
+
+    # Number of rows kept
+    def numRows(self):
+        return self._numRows
+
+
+class incrementalDLMatrix:
+    def __init__(self, refWord, rowCache):
+        rowCache.setRefWord(refWord)
+        self._refWord = refWord
+        self._numCols = len(refWord) + 1
+        root = rowCache.getRoot()
+        firstRow = root[0]
+        while len(firstRow) < self._numCols:
+            firstRow.append(len(firstRow))
+        # Cache entries of the rows of the chars on the stack, first row
+        # included
+        self._entries = [root]
+        self._charStack = []
+        self._rowCache = rowCache
+
+    # Compute the missing columns of the row of char c, below the rows on
+    # the stack, like DLMatrix.insertChar computes a whole row
+    def extendRow(self, row, c):
+        i = len(self._entries)
+        prevRow = self._entries[-1][0]
+        refWord = self._refWord
+        if len(self._charStack) > 0:
+            prevc = self._charStack[-1]
+        else:
+            prevc = -1
+        for j in range(len(row), self._numCols):
+            cost = 0
+            if refWord[j - 1] != c:
+                cost = 1
+            dij = min(prevRow[j] + 1,
+                      row[j - 1] + 1,
+                      prevRow[j - 1] + cost)
+            if prevc != -1 and i > 1 and j > 1 and c == refWord[j - 2] and prevc == refWord[j - 1]:
+                dij = min(dij, self._entries[-2][0][j - 2] + 1)
+            row.append(dij)
+
+    def insertChar(self, c):
+        parent = self._entries[-1]
+        entry = parent[1].get(c)
+        if entry is None:
+            entry = self._rowCache.addEntry(parent, c, [len(self._entries)])
+        row = entry[0]
+        if len(row) < self._numCols:
+            self.extendRow(row, c)
+        self._entries.append(entry)
+        self._charStack.append(c)
+
+    def popChar(self):
+        self._entries.pop()
+        self._charStack.pop()
+
+    def getEditDistForCharsSoFar(self, refLen=None):
+        cols = self._numCols
+        if refLen is not None:
+            cols = refLen + 1
+        return self._entries[-1][0][min(len(self._charStack), cols - 1)]
+
+    def getEditDistForWord(self, refLen=None):
+        if len(self._entries) > 1:
+            cols = self._numCols
+            if refLen is not None:
+                cols = refLen + 1
+            return self._entries[-1][0][cols - 1]
+        return 0
@@ -5,183 +5,1285 @@
 #     - insertKey: Insert a key with an integer value
 #     - searchWord: Look for a k
 # --------------------------------------------------------------------- #
+import copy
+import heapq
+import multiprocessing
+import sys
 import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
 
-from BYSubString import BoyerMooreMatch
+from BPDLMatrix import BPDLMatrix
+from BYSubString import BoyerMooreMatch, batchMatches
 from DLMatrix import DLMatrix
-from tstNode import tstNode
+from incrementalDLMatrix import incrementalDLMatrix
+from keyTable import keyTable
+from levenshteinAutomaton import levenshteinAutomatonCache
+from ngramIndex import getGramsOfKey, ngramIndex
+from suffixArrayIndex import suffixArrayIndex
+from symSpellIndex import symSpellIndex
+from tstNode import tstNodeStore
+from tstNodePool import tstNodePool
+from tstSegmentNode import tstSegmentStore
+
+
+# Edit distance matrices the fuzzy search can be run with; the
+# "automaton" engine walks a levenshteinAutomaton instead and "symspell"
+# looks the candidates up in a symSpellIndex
+fuzzyMatrices = {"dp": DLMatrix, "bitparallel": BPDLMatrix, "automaton": DLMatrix, "symspell": DLMatrix}
+fuzzyEngines = ["dp", "bitparallel", "automaton", "symspell"]
+
+# Number of chars after the first one the first char index is built on
+firstCharWindow = 4
+# Substring candidates are checked with batchMatches from this many on, and
+# at most maxSubstringChunk of them at once
+substringBatchSize = 16
+maxSubstringChunk = 1024
+# Longest time in seconds a search goes on without letting other threads
+# have the GIL (see keyDict.pastDeadline)
+yieldInterval = 0.002
+
+
+# Build the subtrees of a shard of a parallelBulkInsert in a tstNodePool
+# of its own: one below the first char of every [lo, hi) range of
+# keyVals. Returns the pool columns, the root of every subtree and the
+# substring index postings of the keys, whose key ids start at firstKeyId
+def buildTstShard(keyVals, ranges, firstKeyId):
+    kd = keyDict(tstNodePool())
+    keyIds = range(firstKeyId, firstKeyId + len(keyVals))
+    roots = []
+    for lo, hi in ranges:
+        root = kd.buildBalancedTst(keyVals[lo:hi], keyIds[lo:hi], 1)
+        kd.computeMaxValues(root)
+        roots.append(root)
+    postings = {}
+    for i in range(len(keyVals)):
+        for gram in getGramsOfKey(keyVals[i][0]):
+            keyIds = postings.get(gram)
+            if keyIds is None:
+                keyIds = array('i')
+                postings[gram] = keyIds
+            keyIds.append(firstKeyId + i)
+    return kd.getNodeStore().getColumns(), roots, postings
+
+
+# The string itself and every string with one of its chars deleted
+def deletionNeighbourhood(s):
+    variants = {s}
+    for i in range(len(s)):
+        variants.add(s[:i] + s[i + 1:])
+    return variants
 
 
 # --------------------------------------------------------------------- #
 #  Ternary search tree implementation of the dictionary
 # --------------------------------------------------------------------- #
 class keyDict:
-    # Constructor
-    def __init__(self):
+    # Constructor; nodeStore decides how the TST nodes are kept in memory,
+    # by default one tstNode object per node
+    def __init__(self, nodeStore=None):
+        if nodeStore is None:
+            nodeStore = tstNodeStore()
+        self._nodes = nodeStore
         self._root = None
-        self._wordsWithChars = {}
+        # Whether the nodes hold segments of chars (see tstSegmentNode)
+        self._segments = hasattr(nodeStore, "getSegment")
+        # Every key gets an id in the key table, which the substring index
+        # and the other indexes over the keys refer to keys by
+        self._keyTable = keyTable()
+        self._ngrams = ngramIndex(self._keyTable)
+        # The public search functions use the explicit stack traversals
+        # below unless the recursive ones are asked for
+        self._recursive = False
+        # Prefix search returns the keys with the largest values unless
+        # asked for the first keys in lexicographic order
+        self._rankPrefixByValue = True
+        self._fuzzyEngine = "dp"
+        self._fuzzyMatrix = DLMatrix
+        self._automata = levenshteinAutomatonCache()
+        # Index for the fuzzy search from the root, None while turned off
+        self._firstCharIndex = None
+        # Deletion index, made when the "symspell" engine is turned on
+        self._symSpell = None
+        # Suffix array for the substring search, None while turned off
+        self._suffixArray = None
+        # prefix -> [key, value] of its first keys in a ranked prefix
+        # search, for the prefixes up to _hotPrefixLength chars; None while
+        # turned off
+        self._hotPrefixes = None
+        self._hotPrefixLength = 0
+        self._hotPrefixSize = 0
+        # Nodes made or copied by a version under change, None while the
+        # nodes are changed in place (see newVersion)
+        self._ownedNodes = None
+
+    def getNodeStore(self):
+        return self._nodes
+
+    def getRoot(self):
+        return self._root
+
+    def hasSegments(self):
+        return self._segments
+
+    def setRoot(self, root):
+        self._root = root
+
+    def getKeyTable(self):
+        return self._keyTable
+
+    def getNgramIndex(self):
+        return self._ngrams
+
+    # Replace the key table and the substring indexes, e.g. by those of a
+    # snapshot
+    def setKeyIndexes(self, table, ngrams, suffixArray=None):
+        self._keyTable = table
+        self._ngrams = ngrams
+        self._suffixArray = suffixArray
+
+    # A new version of the dictionary to make changes to while readers go
+    # on searching this one. The version shares the nodes of this one and
+    # changes them copy on write: a change copies the nodes from the root
+    # down to its key (see copyPathTo) and changes the copies, so the nodes
+    # reachable from the root of this one stay as they are. The key table
+    # shares its keys and copies the values, the n-gram index copies its
+    # pending lists as they change, and the other indexes only ever get
+    # entries added, which the versions before skip as their key ids are
+    # beyond their key table. A version is handed to readers once
+    # sealVersion is called; changes made before that are not seen by them
+    def newVersion(self):
+        kd = copy.copy(self)
+        kd._ownedNodes = set()
+        kd._keyTable = self._keyTable.newVersion()
+        kd._ngrams = self._ngrams.newVersion(kd._keyTable)
+        if self._suffixArray is not None:
+            kd._suffixArray = self._suffixArray.newVersion(kd._keyTable)
+        if self._hotPrefixes is not None:
+            kd._hotPrefixes = dict(self._hotPrefixes)
+        return kd
+
+    # Done changing the version; its nodes are shared from now on
+    def sealVersion(self):
+        self._ownedNodes = None
+
+    # Copy the nodes on the way from the root down to key which the version
+    # does not own yet and link the copies in place of them, so the change
+    # of key only touches nodes of this version. The copies keep the links
+    # of the nodes they copy, so the nodes below are shared
+    def copyPathTo(self, key):
+        nodes = self._nodes
+        owned = self._ownedNodes
+        keyLen = len(key)
+        idx = 0
+        node = self._root
+        parent = None
+        link = None
+        while node:
+            if node not in owned:
+                copyNode = nodes.copyNode(node)
+                owned.add(copyNode)
+                if not parent:
+                    self._root = copyNode
+                else:
+                    if link == 'L':
+                        nodes.setLeftNode(parent, copyNode)
+                    elif link == 'R':
+                        nodes.setRightNode(parent, copyNode)
+                    else:
+                        nodes.setDownNode(parent, copyNode)
+                node = copyNode
+            parent = node
+            c = nodes.getChar(node)
+            if key[idx] < c:
+                link = 'L'
+                node = nodes.getLeftNode(node)
+            elif key[idx] > c:
+                link = 'R'
+                node = nodes.getRightNode(node)
+            elif self._segments:
+                segment = nodes.getSegment(node)
+                if idx + len(segment) >= keyLen or not key.startswith(segment, idx):
+                    break
+                idx += len(segment)
+                link = 'D'
+                node = nodes.getDownNode(node)
+            elif idx < keyLen - 1:
+                idx += 1
+                link = 'D'
+                node = nodes.getDownNode(node)
+            else:
+                break
+
+    # The recursive traversals go one char per node, so they are not there
+    # for segment nodes
+    def setRecursiveTraversal(self, recursive):
+        if recursive and self._segments:
+            raise ValueError("The recursive traversals need one char per node")
+        self._recursive = recursive
+
+    def setPrefixRanking(self, byValue):
+        self._rankPrefixByValue = byValue
+
+    # Pick the fuzzy search engine, one of fuzzyEngines. The recursive
+    # engine has no automaton or deletion index and uses DLMatrix for
+    # them. Without the deletion index (see setSymSpellIndex) the
+    # "symspell" engine falls back to "dp"
+    def setFuzzyEngine(self, engine):
+        if engine not in fuzzyEngines:
+            raise ValueError("Unknown fuzzy engine: " + str(engine))
+        self._fuzzyEngine = engine
+        self._fuzzyMatrix = fuzzyMatrices[engine]
+
+    def getFuzzyEngine(self):
+        return self._fuzzyEngine
+
+    # Turn the fuzzy search from the root on or off. The fuzzy search is
+    # pinned to the node of the first char of the query, so a typo in the
+    # first char is never found. From the root, every key whose next chars
+    # look like the query is a candidate too; the first char index lists
+    # those keys by the first firstCharWindow + 1 chars they start with,
+    # keyed on the deletion neighbourhood of the window after the first
+    # char (SymSpell style). Turning it on builds the index from the keys
+    # already in the TST, later inserts keep it up to date
+    def setFuzzyFromRoot(self, enabled):
+        if not enabled:
+            self._firstCharIndex = None
+            return
+        if self._segments:
+            raise ValueError("The fuzzy search from the root needs one char per node")
+        if self._firstCharIndex is not None:
+            return
+        self._firstCharIndex = {}
+        nodeList = []
+        self.iterativeCollectAllKeysInSubTree(self._root, -1, nodeList)
+        for node in nodeList:
+            self.addToFirstCharIndex(self.getWord(node))
+
+    def getFirstCharIndex(self):
+        return self._firstCharIndex
+
+    # Turn the deletion index of the "symspell" fuzzy engine on or off. Only
+    # keys up to maxKeyLength chars are indexed, queries the index cannot
+    # answer go through the TST
+    def setSymSpellIndex(self, enabled, maxKeyLength=12):
+        if not enabled:
+            self._symSpell = None
+            return
+        table = self._keyTable
+        self._symSpell = symSpellIndex(2, maxKeyLength)
+        for keyId in range(table.numKeys()):
+            self._symSpell.addKey(table.getKey(keyId), keyId)
+
+    def getSymSpellIndex(self):
+        return self._symSpell
+
+    # Turn the suffix array substring engine on or off. It finds the keys
+    # containing a pattern anywhere, where the n-gram index leaves out
+    # matches at the start of a key, and gets the largest values without
+    # going through all the matches. Turning it on builds it from the keys
+    # so far; after inserts it is built again by sortWordsWithCharsDict
+    # or bulkInsert and the n-gram index answers until then
+    def setSuffixArrayIndex(self, enabled):
+        if not enabled:
+            self._suffixArray = None
+        elif self._suffixArray is None:
+            self._suffixArray = suffixArrayIndex(self._keyTable)
+
+    def getSuffixArrayIndex(self):
+        return self._suffixArray
+
+    # Keep the indexes over the keys up to date with an inserted key and
+    # return its key id. A key inserted again after a delete gets its old id
+    # back. The max tree of the suffix array holds upper bounds of the
+    # values, so it stays up to date when a value comes down
+    def addToKeyIndexes(self, key, val, withGrams=True):
+        if self._firstCharIndex is not None:
+            self.addToFirstCharIndex(key)
+        table = self._keyTable
+        keyId = table.getKeyId(key)
+        if keyId is not None:
+            if self._suffixArray is not None and (table.isDeleted(keyId) or val > table.getValue(keyId)):
+                self._suffixArray.markStale()
+            table.addKey(key, val)
+            self._ngrams.updateKey(keyId)
+            return keyId
+        if self._suffixArray is not None:
+            self._suffixArray.markStale()
+        keyId = table.addKey(key, val)
+        if withGrams:
+            self._ngrams.addKey(keyId)
+        if self._symSpell is not None:
+            self._symSpell.addKey(key, keyId)
+        return keyId
+
+    # Keep the indexes over the keys up to date with a deleted key. Its id
+    # stays in the key table as a tombstone: the n-gram index drops it on
+    # the next finalize and the suffix array on its next build, the other
+    # indexes keep it, and the lookups in all of them skip it until then
+    def removeFromKeyIndexes(self, key):
+        keyId = self._keyTable.getKeyId(key)
+        if keyId is None:
+            return
+        self._keyTable.deleteKey(keyId)
+        self._ngrams.markValuesChanged()
 
     # Utility functions
     # Get the node corresponding to char c from the given node
     def findFirstNodeFromTop(self, node, c):
-        rNode = None
-        if node is None:
-            return rNode
-        if node.getChar() == c:
-            rNode = node
-        elif node.getChar() < c:
-            rNode = self.findFirstNodeFromTop(node.getRightNode(), c)
-        elif node.getChar() > c:
-            rNode = self.findFirstNodeFromTop(node.getLeftNode(), c)
-        return rNode
-
-    def addToWordsWithCharsDict(self, substr, key, val):
-        if self._wordsWithChars.get(substr) is None:
-            tmp = []
-            self._wordsWithChars[substr] = tmp
-        (self._wordsWithChars[substr]).append([key, val])
+        nodes = self._nodes
+        while node:
+            nodeChar = nodes.getChar(node)
+            if nodeChar == c:
+                return node
+            elif nodeChar < c:
+                node = nodes.getRightNode(node)
+            else:
+                node = nodes.getLeftNode(node)
+        return None
+
+    def addToFirstCharIndex(self, key):
+        if len(key) < 2:
+            return
+        prefix = key[:firstCharWindow + 1]
+        for variant in deletionNeighbourhood(key[1:firstCharWindow + 1]):
+            prefixes = self._firstCharIndex.get(variant)
+            if prefixes is None:
+                prefixes = set()
+                self._firstCharIndex[variant] = prefixes
+            prefixes.add(prefix)
+
+    # Key prefixes from the first char index which may be within edit
+    # distance 2 of key with its first char wrong, missing or doubled: the
+    # window after the first char of such a key lines up with the query
+    # shifted by 0, -1 or +1. A prefix shorter than firstCharWindow + 1 is a
+    # whole key. Prefixes starting with the first char of key are left to the
+    # pinned search
+    def getFirstCharCandidates(self, key):
+        candidates = set()
+        for window in (key[1:firstCharWindow + 1], key[:firstCharWindow], key[2:firstCharWindow + 2]):
+            for variant in deletionNeighbourhood(window):
+                prefixes = self._firstCharIndex.get(variant)
+                if prefixes is not None:
+                    candidates.update(prefixes)
+        return sorted(prefix for prefix in candidates if prefix[0] != key[0])
 
+    # Rank the keys of the substring index by value, so the substring search
+    # returns the keys with the largest values first. Keys inserted since
+    # the last call are found all the same, they are just checked one by one.
+    # A stale suffix array is built again
     def sortWordsWithCharsDict(self):
-        for key in self._wordsWithChars:
-            tmp = self._wordsWithChars[key]
-            sorted(tmp, key=lambda tmp: tmp[1])
+        self._ngrams.finalize()
+        if self._suffixArray is not None and self._suffixArray.isStale():
+            self._suffixArray.build()
 
-    # Given a leaf node, get the word corresponding to the leaf node
-    # by going up the tree
+    # Given the node of a key, get the key from the key table by the key id
+    # the node holds
     def getWord(self, node):
-        if node is None:
+        if not node:
             return
-        word = node.getChar()
-        prevNode = node
-        parentNode = node.getParentNode()
-        while parentNode is not None:
-            parentChar = parentNode.getChar()
-            if parentNode.getDownNode() == prevNode:
-                word = parentChar + word
-            prevNode = parentNode
-            parentNode = parentNode.getParentNode()
-        return word
+        return self._keyTable.getKey(self._nodes.getKeyId(node))
 
     # Collect all the keys from a TST node's subtree, node inclusive recursively
     def collectAllKeysInSubTree(self, node, numWords, nodeList):
-        if node is None:
+        if not node:
             return
         if len(nodeList) == numWords:
             return
-        if node.getLeftNode() is not None:
-            self.collectAllKeysInSubTree(node.getLeftNode(), numWords, nodeList)
-        if node.hasWord():
+        nodes = self._nodes
+        if nodes.getLeftNode(node):
+            self.collectAllKeysInSubTree(nodes.getLeftNode(node), numWords, nodeList)
+        if nodes.hasWord(node):
             nodeList.append(node)
-        if node.getDownNode() is not None:
-            self.collectAllKeysInSubTree(node.getDownNode(), numWords, nodeList)
-        if node.getRightNode() is not None:
-            self.collectAllKeysInSubTree(node.getRightNode(), numWords, nodeList)
+        if nodes.getDownNode(node):
+            self.collectAllKeysInSubTree(nodes.getDownNode(node), numWords, nodeList)
+        if nodes.getRightNode(node):
+            self.collectAllKeysInSubTree(nodes.getRightNode(node), numWords, nodeList)
 
     # Recursively insert a key into the dictionary's TST
-    def recursiveInsert(self, node, key, val, keyLen, idx):
+    def recursiveInsert(self, node, key, val, keyLen, idx, keyId):
         leafNode = None
-        if node is None:
-            node = tstNode(key[idx])
+        nodes = self._nodes
+        if not node:
+            node = nodes.newNode(key[idx])
 
         w = key[idx];
-        if w < node.getChar():
-            rNode, leafNode = self.recursiveInsert(node.getLeftNode(), key, val, keyLen, idx)
-            node.setLeftNode(rNode)
-            rNode.setParentNode(node)
-        elif w > node.getChar():
-            rNode, leafNode = self.recursiveInsert(node.getRightNode(), key, val, keyLen, idx)
-            node.setRightNode(rNode)
-            rNode.setParentNode(node)
+        if w < nodes.getChar(node):
+            rNode, leafNode = self.recursiveInsert(nodes.getLeftNode(node), key, val, keyLen, idx, keyId)
+            nodes.setLeftNode(node, rNode)
+        elif w > nodes.getChar(node):
+            rNode, leafNode = self.recursiveInsert(nodes.getRightNode(node), key, val, keyLen, idx, keyId)
+            nodes.setRightNode(node, rNode)
         elif idx < keyLen - 1:
-            if keyLen > 2 and idx > 1:
-                prevChar = key[idx - 1]
-                substr = prevChar + key[idx]
-                self.addToWordsWithCharsDict(substr, key, val)
-                if keyLen > 3 and idx > 2:
-                    prev2Char = key[idx - 2]
-                    substr = prev2Char + prevChar + key[idx]
-                    self.addToWordsWithCharsDict(substr, key, val)
-
-            rNode, leafNode = self.recursiveInsert(node.getDownNode(), key, val, keyLen, idx + 1)
-            node.setDownNode(rNode)
-            rNode.setParentNode(node)
+            rNode, leafNode = self.recursiveInsert(nodes.getDownNode(node), key, val, keyLen, idx + 1, keyId)
+            nodes.setDownNode(node, rNode)
         else:
-            node.setValue(val)
-            node.markHasWord()
-            node.setWordLength(keyLen)
+            nodes.setValue(node, val)
+            nodes.markHasWord(node)
+            nodes.setWordLength(node, keyLen)
+            nodes.setKeyId(node, keyId)
 
             leafNode = node
+        if nodes.getMaxValue(node) < val:
+            nodes.setMaxValue(node, val)
         return node, leafNode
 
     # Recursively search for an exact matching key in the TST
     def recursiveSearch(self, node, key, keyLen, idx):
-        if node is None:
+        if not node:
             return None
 
-        c = node.getChar()
+        c = self._nodes.getChar(node)
         if c > key[idx]:
-            return self.recursiveSearch(node.getLeftNode(), key, keyLen, idx)
+            return self.recursiveSearch(self._nodes.getLeftNode(node), key, keyLen, idx)
         elif c < key[idx]:
-            return self.recursiveSearch(node.getRightNode(), key, keyLen, idx)
+            return self.recursiveSearch(self._nodes.getRightNode(node), key, keyLen, idx)
         elif idx < keyLen - 1:
-            return self.recursiveSearch(node.getDownNode(), key, keyLen, (idx + 1))
+            return self.recursiveSearch(self._nodes.getDownNode(node), key, keyLen, (idx + 1))
         else:
             return node
 
     # Recursively search all the keys with a prefix and return a list of nodes
     # on the TST which correspond to those keys
     def recursiveSearchAllKeysWithPrefix(self, node, prefix, prefixLen, idx, numWords, nodeList):
-        if node is None:
+        if not node:
             return
-        c = node.getChar()
+        nodes = self._nodes
+        c = nodes.getChar(node)
         if c < prefix[idx]:
-            self.recursiveSearchAllKeysWithPrefix(node.getRightNode(), prefix, prefixLen, idx, numWords, nodeList)
+            self.recursiveSearchAllKeysWithPrefix(nodes.getRightNode(node), prefix, prefixLen, idx, numWords, nodeList)
         elif c > prefix[idx]:
-            self.recursiveSearchAllKeysWithPrefix(node.getLeftNode(), prefix, prefixLen, idx, numWords, nodeList)
+            self.recursiveSearchAllKeysWithPrefix(nodes.getLeftNode(node), prefix, prefixLen, idx, numWords, nodeList)
         elif idx < prefixLen - 1:
-            self.recursiveSearchAllKeysWithPrefix(node.getDownNode(), prefix, prefixLen, idx + 1, numWords, nodeList)
+            self.recursiveSearchAllKeysWithPrefix(nodes.getDownNode(node), prefix, prefixLen, idx + 1, numWords, nodeList)
         else:
-            if node.hasWord() is True:
+            if nodes.hasWord(node) is True:
                 nodeList.append(node)
                 if len(nodeList) == numWords:
                     return
-            self.collectAllKeysInSubTree(node.getDownNode(), numWords, nodeList)
+            self.collectAllKeysInSubTree(nodes.getDownNode(node), numWords, nodeList)
 
     # Recursively search all the keys using a fuzzy search by considering True Damerau Levenshtein
     # edit distances on the TST which correspond to those keys
     # Build the edit distances as the TST is traversed
-    def recursiveSearchFuzzy(self, node, editDist, thisDLMat, nodeList, strSoFar):
-        if node is None:
+    def recursiveSearchFuzzy(self, node, editDist, thisDLMat, nodeList):
+        if not node:
             return
+        nodes = self._nodes
         # Process stuff for left sub-tree
-        leftNode = node.getLeftNode()
-        if leftNode is not None:
-            self.recursiveSearchFuzzy(leftNode, editDist, thisDLMat, nodeList, strSoFar)
+        leftNode = nodes.getLeftNode(node)
+        if leftNode:
+            self.recursiveSearchFuzzy(leftNode, editDist, thisDLMat, nodeList)
 
         # Process stuff sub-tree under the current node
-        nodeChar = node.getChar()
-        strSoFar = strSoFar + nodeChar
+        nodeChar = nodes.getChar(node)
         thisDLMat.insertChar(nodeChar)
-        if node.hasWord() is True:
+        if nodes.hasWord(node) is True:
             editDistForWord = thisDLMat.getEditDistForWord()
             if editDistForWord > 0 and editDistForWord <= editDist:
                 nodeList.append([node, editDistForWord])
         editDistAfterAddingChar = thisDLMat.getEditDistForCharsSoFar()
-        downNode = node.getDownNode()
-        if editDistAfterAddingChar <= editDist and downNode is not None:
-            self.recursiveSearchFuzzy(downNode, editDist, thisDLMat, nodeList, strSoFar)
+        downNode = nodes.getDownNode(node)
+        if editDistAfterAddingChar <= editDist and downNode:
+            self.recursiveSearchFuzzy(downNode, editDist, thisDLMat, nodeList)
         thisDLMat.popChar()
-        strSoFar = strSoFar[:-1]
 
         # Process stuff for right sub-tree
-        rightNode = node.getRightNode()
-        if rightNode is not None:
-            self.recursiveSearchFuzzy(rightNode, editDist, thisDLMat, nodeList, strSoFar)
+        rightNode = nodes.getRightNode(node)
+        if rightNode:
+            self.recursiveSearchFuzzy(rightNode, editDist, thisDLMat, nodeList)
+
+    # --------------------------------------------------------------------- #
+    #  Explicit stack versions of the recursive traversals above. They give
+    #  identical results, but do not run into the recursion limit on long
+    #  keys or long sibling chains and save the per call overhead
+    # --------------------------------------------------------------------- #
+    # Iteratively insert a key into the dictionary's TST and return the leaf
+    # node. The nodes made are owned by a version under change
+    def iterativeInsert(self, key, val, keyId):
+        if self._segments:
+            return self.segmentInsert(key, val, keyId)
+        nodes = self._nodes
+        owned = self._ownedNodes
+        keyLen = len(key)
+        idx = 0
+        if owned is not None:
+            self.copyPathTo(key)
+        if not self._root:
+            self._root = nodes.newNode(key[0])
+            if owned is not None:
+                owned.add(self._root)
+        node = self._root
+        path = []
+        while True:
+            path.append(node)
+            w = key[idx]
+            c = nodes.getChar(node)
+            if w < c:
+                nextNode = nodes.getLeftNode(node)
+                if not nextNode:
+                    nextNode = nodes.newNode(w)
+                    nodes.setLeftNode(node, nextNode)
+                    if owned is not None:
+                        owned.add(nextNode)
+            elif w > c:
+                nextNode = nodes.getRightNode(node)
+                if not nextNode:
+                    nextNode = nodes.newNode(w)
+                    nodes.setRightNode(node, nextNode)
+                    if owned is not None:
+                        owned.add(nextNode)
+            elif idx < keyLen - 1:
+                idx += 1
+                nextNode = nodes.getDownNode(node)
+                if not nextNode:
+                    nextNode = nodes.newNode(key[idx])
+                    nodes.setDownNode(node, nextNode)
+                    if owned is not None:
+                        owned.add(nextNode)
+            else:
+                nodes.setValue(node, val)
+                nodes.markHasWord(node)
+                nodes.setWordLength(node, keyLen)
+                nodes.setKeyId(node, keyId)
+                for pathNode in path:
+                    if nodes.getMaxValue(pathNode) < val:
+                        nodes.setMaxValue(pathNode, val)
+                return node
+            node = nextNode
+
+    # Iteratively search for an exact matching key in the TST
+    def iterativeSearch(self, node, key, keyLen, idx):
+        if self._segments:
+            return self.segmentSearch(node, key, keyLen, idx)
+        nodes = self._nodes
+        while node:
+            c = nodes.getChar(node)
+            if c > key[idx]:
+                node = nodes.getLeftNode(node)
+            elif c < key[idx]:
+                node = nodes.getRightNode(node)
+            elif idx < keyLen - 1:
+                node = nodes.getDownNode(node)
+                idx += 1
+            else:
+                return node
+        return None
+
+    # Collect all the keys from a TST node's subtree, node inclusive, in the
+    # same order as collectAllKeysInSubTree. The stack only ever holds nodes
+    # whose left subtree has been dealt with: popping a node emits it, then
+    # the left spine of its right subtree goes on the stack followed by the
+    # left spine of its down subtree, so the down subtree comes out first
+    def iterativeCollectAllKeysInSubTree(self, node, numWords, nodeList):
+        if len(nodeList) == numWords:
+            return
+        nodes = self._nodes
+        stack = []
+        while node:
+            stack.append(node)
+            node = nodes.getLeftNode(node)
+        while stack:
+            node = stack.pop()
+            if nodes.hasWord(node):
+                nodeList.append(node)
+                if len(nodeList) == numWords:
+                    return
+            child = nodes.getRightNode(node)
+            while child:
+                stack.append(child)
+                child = nodes.getLeftNode(child)
+            child = nodes.getDownNode(node)
+            while child:
+                stack.append(child)
+                child = nodes.getLeftNode(child)
+
+    # Iteratively search all the keys with a prefix and return a list of nodes
+    # on the TST which correspond to those keys
+    def iterativeSearchAllKeysWithPrefix(self, node, prefix, prefixLen, idx, numWords, nodeList):
+        node = self.iterativeSearch(node, prefix, prefixLen, idx)
+        if not node:
+            return
+        if self._nodes.hasWord(node) is True:
+            nodeList.append(node)
+            if len(nodeList) == numWords:
+                return
+        self.iterativeCollectAllKeysInSubTree(self._nodes.getDownNode(node), numWords, nodeList)
+
+    # Iterative version of recursiveSearchFuzzy. A None on the stack stands for
+    # "the down subtree of the last inserted char is done", which is when the
+    # char is popped off the matrix again. Only a node whose down subtree is
+    # searched leaves one; the char of any other node is popped right away
+    def iterativeSearchFuzzy(self, node, editDist, thisDLMat, nodeList):
+        nodes = self._nodes
+        stack = []
+        while node:
+            stack.append(node)
+            node = nodes.getLeftNode(node)
+        while stack:
+            node = stack.pop()
+            if node is None:
+                thisDLMat.popChar()
+                continue
+            child = nodes.getRightNode(node)
+            while child:
+                stack.append(child)
+                child = nodes.getLeftNode(child)
+
+            thisDLMat.insertChar(nodes.getChar(node))
+            if nodes.hasWord(node) is True:
+                editDistForWord = thisDLMat.getEditDistForWord()
+                if editDistForWord > 0 and editDistForWord <= editDist:
+                    nodeList.append([node, editDistForWord])
+            child = nodes.getDownNode(node)
+            if child and thisDLMat.getEditDistForCharsSoFar() <= editDist:
+                stack.append(None)
+                while child:
+                    stack.append(child)
+                    child = nodes.getLeftNode(child)
+            else:
+                thisDLMat.popChar()
+
+    # --------------------------------------------------------------------- #
+    #  Versions of the traversals above for segment nodes (see
+    #  tstSegmentNode), where a node stands for a chain of chars
+    # --------------------------------------------------------------------- #
+    # Search for key[idx:] from node and return the node whose segment it
+    # ends in, None if no key goes through it. The key need not end with
+    # the segment: the node is the one of the key if it has a word as long
+    # as the key, and the one all the keys starting with it are under if
+    # the key is a prefix
+    def segmentSearch(self, node, key, keyLen, idx):
+        nodes = self._nodes
+        while node:
+            segment = nodes.getSegment(node)
+            c = segment[0]
+            if c > key[idx]:
+                node = nodes.getLeftNode(node)
+            elif c < key[idx]:
+                node = nodes.getRightNode(node)
+            elif idx + len(segment) < keyLen:
+                if not key.startswith(segment, idx):
+                    return None
+                idx += len(segment)
+                node = nodes.getDownNode(node)
+            elif segment.startswith(key[idx:]):
+                return node
+            else:
+                return None
+        return None
+
+    # findPath for segment nodes
+    def segmentFindPath(self, key):
+        nodes = self._nodes
+        keyLen = len(key)
+        idx = 0
+        node = self._root
+        path = []
+        while node and keyLen > 0:
+            path.append(node)
+            segment = nodes.getSegment(node)
+            if key[idx] < segment[0]:
+                node = nodes.getLeftNode(node)
+            elif key[idx] > segment[0]:
+                node = nodes.getRightNode(node)
+            elif not key.startswith(segment, idx):
+                return None
+            elif idx + len(segment) < keyLen:
+                idx += len(segment)
+                node = nodes.getDownNode(node)
+            elif nodes.hasWord(node):
+                return path
+            else:
+                return None
+        return None
+
+    # Split the segment of node after its first n chars: a new node below
+    # it takes the rest of them with the word, the value, the key id and
+    # the down link of node
+    def splitSegment(self, node, n):
+        nodes = self._nodes
+        owned = self._ownedNodes
+        segment = nodes.getSegment(node)
+        tail = nodes.newSegmentNode(segment[n:])
+        if owned is not None:
+            owned.add(tail)
+        maxVal = 0
+        if nodes.hasWord(node):
+            maxVal = nodes.getValue(node)
+            nodes.setValue(tail, maxVal)
+            nodes.markHasWord(tail)
+            nodes.setWordLength(tail, nodes.getWordLength(node))
+            nodes.setKeyId(tail, nodes.getKeyId(node))
+            nodes.unmarkHasWord(node)
+            nodes.setValue(node, 0)
+            nodes.setWordLength(node, 0)
+        down = nodes.getDownNode(node)
+        if down:
+            nodes.setDownNode(tail, down)
+            maxVal = max(maxVal, nodes.getMaxValue(down))
+        nodes.setMaxValue(tail, maxVal)
+        nodes.setSegment(node, segment[:n])
+        nodes.setDownNode(node, tail)
+
+    # Insert a key into a TST of segment nodes and return its node. A key
+    # ending or branching off inside a segment splits it there, and the
+    # chars of a key past the nodes there are go into one new node
+    def segmentInsert(self, key, val, keyId):
+        nodes = self._nodes
+        owned = self._ownedNodes
+        keyLen = len(key)
+        idx = 0
+        if owned is not None:
+            self.copyPathTo(key)
+        node = self._root
+        parent = None
+        link = None
+        path = []
+        while node:
+            path.append(node)
+            segment = nodes.getSegment(node)
+            w = key[idx]
+            c = segment[0]
+            if w < c:
+                parent = node
+                link = 'L'
+                node = nodes.getLeftNode(node)
+                continue
+            if w > c:
+                parent = node
+                link = 'R'
+                node = nodes.getRightNode(node)
+                continue
+            n = 1
+            while n < len(segment) and idx + n < keyLen and key[idx + n] == segment[n]:
+                n += 1
+            if n < len(segment):
+                self.splitSegment(node, n)
+            idx += n
+            if idx == keyLen:
+                break
+            parent = node
+            link = 'D'
+            node = nodes.getDownNode(node)
+        if not node:
+            node = nodes.newSegmentNode(key[idx:])
+            if owned is not None:
+                owned.add(node)
+            if not parent:
+                self._root = node
+            else:
+                if link == 'L':
+                    nodes.setLeftNode(parent, node)
+                elif link == 'R':
+                    nodes.setRightNode(parent, node)
+                else:
+                    nodes.setDownNode(parent, node)
+            path.append(node)
+        nodes.setValue(node, val)
+        nodes.markHasWord(node)
+        nodes.setWordLength(node, keyLen)
+        nodes.setKeyId(node, keyId)
+        for pathNode in path:
+            if nodes.getMaxValue(pathNode) < val:
+                nodes.setMaxValue(pathNode, val)
+        return node
 
-    # Insert a key into the dictionary's TST
+    # Merge the chains of one char nodes made by buildBalancedTst into
+    # segments: a node without a word takes in its down node while that one
+    # has no left or right siblings
+    def mergeSegments(self):
+        nodes = self._nodes
+        stack = []
+        if self._root:
+            stack.append(self._root)
+        while stack:
+            node = stack.pop()
+            while not nodes.hasWord(node):
+                down = nodes.getDownNode(node)
+                if not down or nodes.getLeftNode(down) or nodes.getRightNode(down):
+                    break
+                nodes.setSegment(node, nodes.getSegment(node) + nodes.getSegment(down))
+                if nodes.hasWord(down):
+                    nodes.setValue(node, nodes.getValue(down))
+                    nodes.markHasWord(node)
+                    nodes.setWordLength(node, nodes.getWordLength(down))
+                    nodes.setKeyId(node, nodes.getKeyId(down))
+                nodes.setDownNode(node, nodes.getDownNode(down))
+            for child in (nodes.getLeftNode(node), nodes.getRightNode(node), nodes.getDownNode(node)):
+                if child:
+                    stack.append(child)
+
+    # The fuzzy search below the first char node for segment nodes: the
+    # rest of the segment of beginNode goes into the matrix first, then its
+    # word is checked (unless it is the one char key, which the search
+    # below the first char node never finds) and the nodes below it
+    # searched
+    def segmentSearchFuzzyFrom(self, beginNode, editDist, thisDLMat, numWords, keyValList, visitedKeys, budget):
+        nodes = self._nodes
+        segment = nodes.getSegment(beginNode)
+        thisDLMat.insertChar(segment[0])
+        for c in segment[1:]:
+            if thisDLMat.getEditDistForCharsSoFar() > editDist:
+                return
+            thisDLMat.insertChar(c)
+        if len(segment) > 1:
+            if nodes.hasWord(beginNode) is True and 0 < thisDLMat.getEditDistForWord() <= editDist:
+                key = self.getWord(beginNode)
+                if visitedKeys.get(key) is None:
+                    keyValList.append([key, nodes.getValue(beginNode)])
+                    if len(keyValList) == numWords:
+                        return
+            if thisDLMat.getEditDistForCharsSoFar() > editDist:
+                return
+        self.segmentSearchFuzzy(nodes.getDownNode(beginNode), editDist, thisDLMat, numWords, keyValList,
+                                visitedKeys, budget)
+
+    # boundedSearchFuzzy for segment nodes. The chars of a segment go into
+    # the matrix one by one, the path being pruned after any of them as it
+    # would be after a node of its own, and come off together once the down
+    # subtree is done. The budget counts nodes, i.e. segments
+    def segmentSearchFuzzy(self, node, editDist, thisDLMat, numWords, keyValList, visitedKeys, budget):
+        nodes = self._nodes
+        maxNodes = budget["maxNodes"]
+        nodesExpanded = budget["nodesExpanded"]
+        stack = []
+        # Number of chars to pop off the matrix for every None on the stack
+        numChars = []
+        while node:
+            stack.append(node)
+            node = nodes.getLeftNode(node)
+        while stack:
+            node = stack.pop()
+            if node is None:
+                for i in range(numChars.pop()):
+                    thisDLMat.popChar()
+                continue
+            if maxNodes is not None and nodesExpanded >= maxNodes:
+                budget["complete"] = False
+                break
+            if nodesExpanded % 64 == 0 and self.pastDeadline(budget):
+                break
+            nodesExpanded += 1
+            child = nodes.getRightNode(node)
+            while child:
+                stack.append(child)
+                child = nodes.getLeftNode(child)
+
+            segment = nodes.getSegment(node)
+            numInserted = 0
+            for c in segment:
+                if numInserted > 0 and thisDLMat.getEditDistForCharsSoFar() > editDist:
+                    break
+                thisDLMat.insertChar(c)
+                numInserted += 1
+            stack.append(None)
+            numChars.append(numInserted)
+            if numInserted < len(segment):
+                continue
+            if nodes.hasWord(node) is True and 0 < thisDLMat.getEditDistForWord() <= editDist:
+                key = self.getWord(node)
+                if visitedKeys.get(key) is None:
+                    keyValList.append([key, nodes.getValue(node)])
+                    if len(keyValList) == numWords:
+                        break
+            if thisDLMat.getEditDistForCharsSoFar() <= editDist:
+                child = nodes.getDownNode(node)
+                while child:
+                    stack.append(child)
+                    child = nodes.getLeftNode(child)
+        budget["nodesExpanded"] = nodesExpanded
+
+    # Set the subtree max value of every node from scratch. Children come
+    # before their parents in reverse depth first order. Only the subtree
+    # of node is done if one is given, and only its first maxDepth levels
+    # of chars, taking the max values below them as they are, if maxDepth
+    # is given
+    def computeMaxValues(self, node=None, maxDepth=None):
+        nodes = self._nodes
+        if node is None:
+            node = self._root
+        order = []
+        stack = []
+        if node:
+            stack.append((node, 0))
+        while stack:
+            node, depth = stack.pop()
+            order.append(node)
+            for child in (nodes.getLeftNode(node), nodes.getRightNode(node)):
+                if child:
+                    stack.append((child, depth))
+            child = nodes.getDownNode(node)
+            if child and (maxDepth is None or depth + 1 < maxDepth):
+                stack.append((child, depth + 1))
+        for node in reversed(order):
+            maxVal = 0
+            if nodes.hasWord(node):
+                maxVal = nodes.getValue(node)
+            for child in (nodes.getLeftNode(node), nodes.getDownNode(node), nodes.getRightNode(node)):
+                if child and nodes.getMaxValue(child) > maxVal:
+                    maxVal = nodes.getMaxValue(child)
+            nodes.setMaxValue(node, maxVal)
+
+    # Find the numWords keys with the largest values under a prefix. The heap
+    # holds subtrees keyed by their max value and words keyed by their own
+    # value, so a word popped off the heap is larger than anything left and
+    # only the subtrees which can still beat the k-th result get opened.
+    # Returns the number of nodes expanded
+    def bestFirstSearchAllKeysWithPrefix(self, node, prefix, prefixLen, numWords, nodeList, idx=0):
+        node = self.iterativeSearch(node, prefix, prefixLen, idx)
+        if not node or len(nodeList) >= numWords:
+            return 0
+        nodes = self._nodes
+        # Entries are [-value, tie breaker, node, is a word]
+        heap = []
+        seq = 0
+        if nodes.hasWord(node):
+            heap.append((-nodes.getValue(node), seq, node, True))
+            seq += 1
+        downNode = nodes.getDownNode(node)
+        if downNode:
+            heap.append((-nodes.getMaxValue(downNode), seq, downNode, False))
+            seq += 1
+        heapq.heapify(heap)
+
+        numExpanded = 0
+        while heap:
+            negVal, tieBreaker, node, isWord = heapq.heappop(heap)
+            if isWord:
+                nodeList.append(node)
+                if len(nodeList) == numWords:
+                    break
+                continue
+            numExpanded += 1
+            if nodes.hasWord(node):
+                heapq.heappush(heap, (-nodes.getValue(node), seq, node, True))
+                seq += 1
+            for child in (nodes.getLeftNode(node), nodes.getDownNode(node), nodes.getRightNode(node)):
+                if child:
+                    heapq.heappush(heap, (-nodes.getMaxValue(child), seq, child, False))
+                    seq += 1
+        return numExpanded
+
+    # Insert a key into the dictionary's TST. A version under change always
+    # inserts iteratively, which copies the path first
     def insertKey(self, key, val):
         # insertion is never unsuccessful as we create nodes
-        self._root, leafNode = self.recursiveInsert(self._root, key, int(val), len(key), 0)
+        keyId = self.addToKeyIndexes(key, int(val))
+        if self._recursive and self._ownedNodes is None:
+            self._root, leafNode = self.recursiveInsert(self._root, key, int(val), len(key), 0, keyId)
+        else:
+            self.iterativeInsert(key, int(val), keyId)
+        self.updateHotPrefixes(key, int(val))
+
+    # Nodes from the root down to the node of key along the left, right
+    # and down links, i.e. the nodes whose max values cover key; None if
+    # key is not in the dictionary
+    def findPath(self, key):
+        if self._segments:
+            return self.segmentFindPath(key)
+        nodes = self._nodes
+        keyLen = len(key)
+        idx = 0
+        node = self._root
+        path = []
+        while node and keyLen > 0:
+            path.append(node)
+            c = nodes.getChar(node)
+            if key[idx] < c:
+                node = nodes.getLeftNode(node)
+            elif key[idx] > c:
+                node = nodes.getRightNode(node)
+            elif idx < keyLen - 1:
+                idx += 1
+                node = nodes.getDownNode(node)
+            elif nodes.hasWord(node):
+                return path
+            else:
+                return None
+        return None
+
+    # Set the max values of the nodes of path again, bottom up, after the
+    # value of its last node changed. Going up stops at a node whose max
+    # value stays the same, as the ones above it do too
+    def refreshMaxValues(self, path):
+        nodes = self._nodes
+        for node in reversed(path):
+            maxVal = 0
+            if nodes.hasWord(node):
+                maxVal = nodes.getValue(node)
+            for child in (nodes.getLeftNode(node), nodes.getDownNode(node), nodes.getRightNode(node)):
+                if child and nodes.getMaxValue(child) > maxVal:
+                    maxVal = nodes.getMaxValue(child)
+            if maxVal == nodes.getMaxValue(node):
+                break
+            nodes.setMaxValue(node, maxVal)
+
+    # Delete a key; returns False if it is not in the dictionary. Its node
+    # stays in the TST without a word until the next compact, and the max
+    # values above it are set again, so the ranked searches do not open
+    # subtrees for its value any more
+    def deleteKey(self, key):
+        path = self.findPath(key)
+        if path is None:
+            return False
+        if self._ownedNodes is not None:
+            self.copyPathTo(key)
+            path = self.findPath(key)
+        nodes = self._nodes
+        node = path[-1]
+        nodes.unmarkHasWord(node)
+        nodes.setValue(node, 0)
+        nodes.setWordLength(node, 0)
+        self.refreshMaxValues(path)
+        self.removeFromKeyIndexes(key)
+        self.updateHotPrefixes(key, None)
+        return True
+
+    # Change the value of a key; returns False if it is not in the
+    # dictionary. Unlike inserting the key again, the max values above it
+    # come down when the value does
+    def updateValue(self, key, val):
+        path = self.findPath(key)
+        if path is None:
+            return False
+        if self._ownedNodes is not None:
+            self.copyPathTo(key)
+            path = self.findPath(key)
+        val = int(val)
+        self._nodes.setValue(path[-1], val)
+        self.refreshMaxValues(path)
+        self.addToKeyIndexes(key, val)
+        self.updateHotPrefixes(key, val)
+        return True
+
+    # Build the dictionary again from its live keys with bulkInsert: the
+    # nodes and index entries left behind by deleted keys go away and the
+    # max values and rankings are exact again. A dictionary opened from a
+    # snapshot becomes writable. The indexes turned on stay on. Returns
+    # the build statistics
+    def compact(self):
+        table = self._keyTable
+        keyVals = [(table.getKey(keyId), table.getValue(keyId)) for keyId in range(table.numKeys())
+                   if not table.isDeleted(keyId)]
+        if isinstance(self._nodes, tstNodePool):
+            self._nodes = tstNodePool()
+        elif self._segments:
+            self._nodes = tstSegmentStore()
+        else:
+            self._nodes = tstNodeStore()
+        self._root = None
+        self._keyTable = keyTable()
+        self._ngrams = ngramIndex(self._keyTable)
+        if self._firstCharIndex is not None:
+            self._firstCharIndex = {}
+        if self._symSpell is not None:
+            self._symSpell = symSpellIndex(2, self._symSpell.getMaxKeyLength())
+        if self._suffixArray is not None:
+            self._suffixArray = suffixArrayIndex(self._keyTable)
+        if self._ownedNodes is not None:
+            self._ownedNodes = set()
+        return self.bulkInsert(keyVals)
+
+    # Build the TST for all the keys of an empty dictionary at once and
+    # return its root. keyVals holds unique keys in sorted order. Every set
+    # of siblings is made into a balanced binary tree by taking the char of
+    # the median key of the range as the node and the keys before and after
+    # it as the left and right subtrees, so each node is created exactly
+    # once and no search from the root is needed. keyIds holds the key id of
+    # every key of keyVals. With depth given, keyVals
+    # share their first depth chars and the subtree below them is built.
+    # With cutDepth given, the chars from cutDepth on are not built but
+    # their ranges of keys are added to cuts as (node, lo, hi), node being
+    # the one to hang their subtree under
+    def buildBalancedTst(self, keyVals, keyIds, depth=0, cutDepth=None, cuts=None):
+        nodes = self._nodes
+        root = None
+        # [lo, hi) range of keys sharing the first "depth" chars, the node to
+        # hang the new node under and which link of that node to use
+        stack = [(0, len(keyVals), depth, None, 'D')]
+        while stack:
+            lo, hi, depth, parent, link = stack.pop()
+            mid = (lo + hi) // 2
+            c = keyVals[mid][0][depth]
+            groupLo = mid
+            while groupLo > lo and keyVals[groupLo - 1][0][depth] == c:
+                groupLo -= 1
+            groupHi = mid + 1
+            while groupHi < hi and keyVals[groupHi][0][depth] == c:
+                groupHi += 1
+
+            node = nodes.newNode(c)
+            if not parent:
+                root = node
+            else:
+                if link == 'L':
+                    nodes.setLeftNode(parent, node)
+                elif link == 'R':
+                    nodes.setRightNode(parent, node)
+                else:
+                    nodes.setDownNode(parent, node)
+
+            if groupHi < hi:
+                stack.append((groupHi, hi, depth, node, 'R'))
+            if lo < groupLo:
+                stack.append((lo, groupLo, depth, node, 'L'))
+
+            # Being sorted, a key ending at this node comes first in its group
+            key, val = keyVals[groupLo]
+            if len(key) == depth + 1:
+                nodes.setValue(node, val)
+                nodes.markHasWord(node)
+                nodes.setWordLength(node, depth + 1)
+                nodes.setKeyId(node, keyIds[groupLo])
+                groupLo += 1
+            if groupLo < groupHi and depth + 1 == cutDepth:
+                cuts.append((node, groupLo, groupHi))
+            elif groupLo < groupHi:
+                stack.append((groupLo, groupHi, depth + 1, node, 'D'))
+        return root
+
+    # Insert many keys at once. The keys are sorted and de-duplicated (the
+    # last value of a key wins, as with repeated insertKey calls), added to
+    # the key indexes and the TST is built balanced: in one go into an empty
+    # dictionary, otherwise by inserting the median key of every range
+    # first. The substring indexes are ranked and built at the end. Returns
+    # the build statistics
+    def bulkInsert(self, keyValPairs):
+        start_time = time.time()
+        uniqueKeyVals = {}
+        for key, val in keyValPairs:
+            if len(key) > 0:
+                uniqueKeyVals[key] = int(val)
+        keyVals = sorted(uniqueKeyVals.items())
+
+        keyIds = [self.addToKeyIndexes(key, val) for key, val in keyVals]
+
+        if not self._root and len(keyVals) > 0:
+            self._root = self.buildBalancedTst(keyVals, keyIds)
+            if self._segments:
+                self.mergeSegments()
+            self.computeMaxValues()
+        else:
+            stack = [(0, len(keyVals))]
+            while stack:
+                lo, hi = stack.pop()
+                if lo >= hi:
+                    continue
+                mid = (lo + hi) // 2
+                key, val = keyVals[mid]
+                if self._recursive and self._ownedNodes is None:
+                    self._root, leafNode = self.recursiveInsert(self._root, key, val, len(key), 0, keyIds[mid])
+                else:
+                    self.iterativeInsert(key, val, keyIds[mid])
+                stack.append((mid + 1, hi))
+                stack.append((lo, mid))
+        self.sortWordsWithCharsDict()
+        if self._hotPrefixes is not None:
+            self.setHotPrefixTable(self._hotPrefixLength, self._hotPrefixSize - 1)
+        end_time = time.time()
+
+        stats = self.getDepthStats()
+        stats["buildTime"] = end_time - start_time
+        return stats
+
+    # bulkInsert over numWorkers processes, for an empty dictionary with a
+    # tstNodePool. The keys are split by first char: the top level of the
+    # TST is built here, the subtrees below the first chars and their
+    # substring index postings in a process pool, each shard a run of first
+    # chars with about the same number of keys. The shards come back as
+    # flat pool columns, which are appended to the pool with their node ids
+    # moved and hung under their first chars. Falls back to bulkInsert for
+    # other dictionaries. Returns the build statistics, with the time spent
+    # in the process pool
+    def parallelBulkInsert(self, keyValPairs, numWorkers):
+        if numWorkers <= 1 or self._root or self._keyTable.numKeys() > 0 or not hasattr(self._nodes, "appendNodes"):
+            return self.bulkInsert(keyValPairs)
+        start_time = time.time()
+        uniqueKeyVals = {}
+        for key, val in keyValPairs:
+            if len(key) > 0:
+                uniqueKeyVals[key] = int(val)
+        keyVals = sorted(uniqueKeyVals.items())
+        if len(keyVals) == 0:
+            return self.bulkInsert(keyValPairs)
+
+        # The key table is empty, so the keys get their ids in sorted order
+        cuts = []
+        self._root = self.buildBalancedTst(keyVals, range(len(keyVals)), 0, 1, cuts)
+        # Runs of cuts, i.e. of first chars, of about equal numbers of keys
+        cuts.sort(key=lambda cut: cut[1])
+        shards = []
+        shardSize = len(keyVals) / numWorkers
+        for cut in cuts:
+            if not shards or (cut[2] - shards[-1][0][1] > shardSize and len(shards) < numWorkers):
+                shards.append([])
+            shards[-1].append(cut)
+        shardKeyVals = []
+        shardRanges = []
+        shardFirstKeyIds = []
+        for shard in shards:
+            lo = shard[0][1]
+            shardKeyVals.append(keyVals[lo:shard[-1][2]])
+            shardRanges.append([(cut[1] - lo, cut[2] - lo) for cut in shard])
+            shardFirstKeyIds.append(lo)
+
+        shard_start_time = time.time()
+        if "fork" in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context("fork")
+        else:
+            context = multiprocessing.get_context()
+        with ProcessPoolExecutor(max_workers=numWorkers, mp_context=context) as executor:
+            results = list(executor.map(buildTstShard, shardKeyVals, shardRanges, shardFirstKeyIds))
+        shard_end_time = time.time()
+
+        nodes = self._nodes
+        for shard, (columns, roots, postings) in zip(shards, results):
+            offset = nodes.appendNodes(columns)
+            for cut, root in zip(shard, roots):
+                nodes.setDownNode(cut[0], root + offset)
+            for gram, keyIds in postings.items():
+                self._ngrams.addPostings(gram, keyIds)
+        self.computeMaxValues(self._root, 1)
+        for key, val in keyVals:
+            self.addToKeyIndexes(key, val, False)
+        self.sortWordsWithCharsDict()
+        if self._hotPrefixes is not None:
+            self.setHotPrefixTable(self._hotPrefixLength, self._hotPrefixSize - 1)
+        end_time = time.time()
+
+        stats = self.getDepthStats()
+        stats["buildTime"] = end_time - start_time
+        stats["shardTime"] = shard_end_time - shard_start_time
+        stats["numShards"] = len(shards)
+        return stats
+
+    # Depth statistics of the TST: the number of nodes and keys, the depth
+    # of the deepest node and the average depth of the nodes ending a key,
+    # i.e. the number of nodes visited by an exact search
+    def getDepthStats(self):
+        nodes = self._nodes
+        numNodes = 0
+        numKeys = 0
+        maxDepth = 0
+        totalKeyDepth = 0
+        stack = []
+        if self._root:
+            stack.append((self._root, 1))
+        while stack:
+            node, depth = stack.pop()
+            numNodes += 1
+            maxDepth = max(maxDepth, depth)
+            if nodes.hasWord(node):
+                numKeys += 1
+                totalKeyDepth += depth
+            for child in (nodes.getLeftNode(node), nodes.getDownNode(node), nodes.getRightNode(node)):
+                if child:
+                    stack.append((child, depth + 1))
+        avgKeyDepth = 0
+        if numKeys > 0:
+            avgKeyDepth = totalKeyDepth / numKeys
+        return {"numNodes": numNodes, "numKeys": numKeys, "maxDepth": maxDepth, "avgKeyDepth": avgKeyDepth}
 
     # Search if a key exists in the TST and return the integer value
     # of the key if it exists along with a result which indicates if the
@@ -189,63 +1291,233 @@ class keyDict:
     def searchKey(self, key):
         result = False
         val = 0
-        if self._root is None:
+        if not self._root:
             return result, val
 
-        node = self.recursiveSearch(self._root, key, len(key), 0)
+        if self._recursive:
+            node = self.recursiveSearch(self._root, key, len(key), 0)
+        else:
+            node = self.iterativeSearch(self._root, key, len(key), 0)
 
-        if node is not None and node.hasWord() is True:
-            val = node.getValue()
+        # A key can end inside the segment of a segment node
+        if node and self._nodes.hasWord(node) is True and self._nodes.getWordLength(node) == len(key):
+            val = self._nodes.getValue(node)
             result = True
 
         return result, val
 
-    # Search for keys with "prefix" in the TST and return them in a list
-    def searchAllKeysWithPrefix(self, prefix, keyList, numWords, visitedKeys):
+    # Search for keys with "prefix" in the TST and return them in a list,
+    # largest values first. The search for the prefix starts from the root,
+    # or from node for prefix[idx] when the first idx chars are known. A
+    # segment node does not start at a known char, so with segments the
+    # search always starts from the root
+    def searchAllKeysWithPrefix(self, prefix, keyList, numWords, visitedKeys, node=None, idx=0):
+        if node is None or self._segments:
+            node = self._root
+            idx = 0
         nodeList = []
+        keyVals = None
         # Pass numWords + 1 in case the prefix has a word already in the TST
-        self.recursiveSearchAllKeysWithPrefix(self._root, prefix, len(prefix), 0, (numWords + 1), nodeList)
+        if (self._rankPrefixByValue and self._hotPrefixes is not None and len(prefix) <= self._hotPrefixLength and
+                numWords + 1 <= self._hotPrefixSize):
+            keyVals = self._hotPrefixes.get(prefix, [])[:numWords + 1]
+        elif self._rankPrefixByValue:
+            self.bestFirstSearchAllKeysWithPrefix(node, prefix, len(prefix), (numWords + 1), nodeList, idx)
+        elif self._recursive:
+            self.recursiveSearchAllKeysWithPrefix(node, prefix, len(prefix), idx, (numWords + 1), nodeList)
+        else:
+            self.iterativeSearchAllKeysWithPrefix(node, prefix, len(prefix), idx, (numWords + 1), nodeList)
+        if keyVals is None:
+            keyVals = ([self.getWord(node), self._nodes.getValue(node)] for node in nodeList)
 
         numInserted = 0
-        for node in nodeList:
-            key = self.getWord(node)
+        for key, val in keyVals:
             if visitedKeys.get(key) is None:
-                val = node.getValue()
                 keyList.append([key, val])
                 visitedKeys[key] = True
                 numInserted += 1
                 if numInserted == numWords:
                     break
 
-    # Returns a list of keys whose edit distance according to True Damerau-Levenshtein is within
-    # "editDist"; Keep max edit distance as 2
-    def searchKeyFuzzy(self, key, maxEditDist, numWords, keyList, visitedKeys):
-        if self._root is None:
+    # Precompute the ranked prefix search of every prefix of up to
+    # maxPrefixLength chars in the TST, numWords keys each, so the prefix
+    # search of a short query is a table lookup. Short prefixes have the
+    # largest subtrees and are asked for the most. insertKey keeps the
+    # table up to date; maxPrefixLength 0 turns it off
+    def setHotPrefixTable(self, maxPrefixLength, numWords=25):
+        if maxPrefixLength <= 0:
+            self._hotPrefixes = None
             return
-        if numWords == 0:
+        self._hotPrefixLength = maxPrefixLength
+        # One more, like searchAllKeysWithPrefix asks for
+        self._hotPrefixSize = numWords + 1
+        self._hotPrefixes = {}
+        nodes = self._nodes
+        stack = []
+        if self._root:
+            stack.append((self._root, ""))
+        while stack:
+            node, path = stack.pop()
+            for child in (nodes.getLeftNode(node), nodes.getRightNode(node)):
+                if child:
+                    stack.append((child, path))
+            if self._segments:
+                # Every prefix ending inside the segment
+                segment = nodes.getSegment(node)
+                for i in range(1, min(len(segment), maxPrefixLength - len(path))):
+                    self.computeHotPrefix(path + segment[:i])
+                prefix = path + segment[:maxPrefixLength - len(path)]
+            else:
+                prefix = path + nodes.getChar(node)
+            self.computeHotPrefix(prefix)
+            if len(prefix) < maxPrefixLength and nodes.getDownNode(node):
+                stack.append((nodes.getDownNode(node), prefix))
+
+    def computeHotPrefix(self, prefix):
+        nodeList = []
+        self.bestFirstSearchAllKeysWithPrefix(self._root, prefix, len(prefix), self._hotPrefixSize, nodeList)
+        self._hotPrefixes[prefix] = [[self.getWord(node), self._nodes.getValue(node)] for node in nodeList]
+
+    # Search the short prefixes of an inserted key again where it can change
+    # the results: where it is or can get into the first keys. A key with a
+    # value below the last one listed leaves the order of the others alone,
+    # as the search never gets to the nodes whose max value it raised. val
+    # is None for a deleted key, which only changes the prefixes listing it
+    def updateHotPrefixes(self, key, val):
+        if self._hotPrefixes is None:
             return
+        for i in range(1, min(len(key), self._hotPrefixLength) + 1):
+            prefix = key[:i]
+            keyVals = self._hotPrefixes.get(prefix)
+            if keyVals is not None and any(keyVal[0] == key for keyVal in keyVals):
+                self.computeHotPrefix(prefix)
+            elif val is not None and (keyVals is None or len(keyVals) < self._hotPrefixSize or
+                                      val >= keyVals[-1][1]):
+                self.computeHotPrefix(prefix)
+
+    # Number of prefixes and keys in the hot prefix table and an estimate
+    # of its bytes, None while it is off
+    def getHotPrefixStats(self):
+        if self._hotPrefixes is None:
+            return None
+        numKeys = 0
+        numBytes = sys.getsizeof(self._hotPrefixes)
+        for prefix, keyVals in self._hotPrefixes.items():
+            numKeys += len(keyVals)
+            numBytes += sys.getsizeof(prefix) + sys.getsizeof(keyVals)
+            for keyVal in keyVals:
+                numBytes += sys.getsizeof(keyVal) + sys.getsizeof(keyVal[0]) + sys.getsizeof(keyVal[1])
+        return {"numPrefixes": len(self._hotPrefixes), "numKeys": numKeys, "numBytes": numBytes}
+
+    # Find the TST node of every prefix, None for the ones not in the TST.
+    # The descent for a prefix goes on from the node of the part it shares
+    # with the prefix before it, so sorted prefixes share most of the work
+    # With segment nodes, which can hold several chars of a prefix, every
+    # prefix is searched for from the root and its node is the one it ends
+    # in (see segmentSearch)
+    def findPrefixNodes(self, prefixes):
+        if self._segments:
+            return [self.segmentSearch(self._root, prefix, len(prefix), 0) if prefix else None
+                    for prefix in prefixes]
+        nodes = self._nodes
+        prefixNodes = []
+        path = ""
+        pathNodes = []
+        for prefix in prefixes:
+            numShared = 0
+            while numShared < min(len(path), len(prefix)) and path[numShared] == prefix[numShared]:
+                numShared += 1
+            path = path[:numShared]
+            del pathNodes[numShared:]
+            while len(path) < len(prefix):
+                if pathNodes:
+                    node = self.findFirstNodeFromTop(nodes.getDownNode(pathNodes[-1]), prefix[len(path)])
+                else:
+                    node = self.findFirstNodeFromTop(self._root, prefix[len(path)])
+                if not node:
+                    break
+                path += prefix[len(path)]
+                pathNodes.append(node)
+            if prefix and path == prefix:
+                prefixNodes.append(pathNodes[-1])
+            else:
+                prefixNodes.append(None)
+        return prefixNodes
+
+    # Whether the deadline of a fuzzy search budget has passed; if so the
+    # search is marked incomplete and timed out, as against one stopped by
+    # its node budget. The searches call it every 64 nodes, which is also
+    # where they let other threads have the GIL once every yieldInterval
+    # seconds, so a search on an executor thread does not hold up the event
+    # loop of findKeysAsync
+    def pastDeadline(self, budget):
+        now = time.time()
+        if now - budget.get("lastYield", 0) > yieldInterval:
+            time.sleep(0)
+            budget["lastYield"] = now
+        deadline = budget["deadline"]
+        if deadline is None or now <= deadline:
+            return False
+        budget["complete"] = False
+        budget["timedOut"] = True
+        return True
+
+    # Returns a list of keys whose edit distance according to True Damerau-Levenshtein is within
+    # "editDist"; Keep max edit distance as 2. Keys at edit distance 1 come before keys at
+    # distance 2, each sorted by value. The search can be bounded by the number of TST nodes
+    # to expand (maxNodes) and by a time.time() deadline, in which case the keys found so far
+    # are returned. engine picks the fuzzy engine for this query only. With a dlRowCache the
+    # "dp" engine takes the rows computed for earlier queries from it. Returns the search
+    # statistics: the nodes expanded, the largest edit distance searched, whether the
+    # search ran to completion and whether it was stopped by the deadline
+    def searchKeyFuzzy(self, key, maxEditDist, numWords, keyList, visitedKeys, maxNodes=None, deadline=None,
+                       engine=None, rowCache=None):
+        stats = {"nodesExpanded": 0, "editDist": 0, "complete": True, "timedOut": False}
+        if not self._root:
+            return stats
+        if numWords == 0:
+            return stats
         if len(key) < 2:
-            return
+            return stats
+        if engine is None:
+            engine = self._fuzzyEngine
+        elif engine not in fuzzyEngines:
+            raise ValueError("Unknown fuzzy engine: " + str(engine))
 
-        thisDLMatrix = DLMatrix(key)
         beginNode = self.findFirstNodeFromTop(self._root, key[0])
-        thisDLMatrix.insertChar(beginNode.getChar())
-        strSoFar = beginNode.getChar()
+        nodes = self._nodes
+        if not self._recursive:
+            budget = {"maxNodes": maxNodes, "deadline": deadline, "nodesExpanded": 0, "complete": True,
+                      "timedOut": False}
+            if engine == "symspell" and self._symSpell is not None and self._symSpell.canSearch(key, maxEditDist):
+                self.symSpellSearchFuzzy(key, maxEditDist, numWords, keyList, visitedKeys, budget, stats)
+            else:
+                self.searchKeyFuzzyByDistance(key, beginNode, maxEditDist, numWords, keyList, visitedKeys, budget,
+                                              stats, engine, rowCache)
+            stats["nodesExpanded"] = budget["nodesExpanded"]
+            stats["complete"] = budget["complete"]
+            stats["timedOut"] = budget["timedOut"]
+            return stats
+        if not beginNode:
+            return stats
+
+        # The recursive engine collects every key within maxEditDist before picking the results,
+        # only ever under the first char node
+        thisDLMatrix = fuzzyMatrices[engine](key)
+        thisDLMatrix.insertChar(nodes.getChar(beginNode))
 
         nodeList = []
-        start_time = time.time()
-        self.recursiveSearchFuzzy(beginNode.getDownNode(), maxEditDist, thisDLMatrix, nodeList, strSoFar)
-        end_time = time.time()
-        # print("Time taken for recursive fuzzy search only: ", kvUtils.getTimeAsString(start_time, end_time))
+        self.recursiveSearchFuzzy(nodes.getDownNode(beginNode), maxEditDist, thisDLMatrix, nodeList)
+        stats["editDist"] = maxEditDist
         editDist1 = []
         editDist2 = []
         for i in range(len(nodeList)):
             node = nodeList[i][0]
             editDist = nodeList[i][1]
             if editDist == 1:
-                editDist1.append([node, node.getValue()])
+                editDist1.append([node, nodes.getValue(node)])
             elif editDist == 2:
-                editDist2.append([node, node.getValue()])
+                editDist2.append([node, nodes.getValue(node)])
             if len(editDist1) == 25:
                 break
 
@@ -266,62 +1538,536 @@ class keyDict:
                 keyList.append([key, val])
                 if i == numWords:
                     break
+        return stats
 
-    def searchSubstringKeys(self, pattern, keyList, numWords, visitedKeys):
-        # Pop keys from the priority queue and run the Boyer
-        patternLen = len(pattern)
-        if patternLen == 1 or patternLen == 0:
+    # Edit distance matrix for the fuzzy search of key with engine. The rows
+    # of the "dp" engine come from rowCache if there is one
+    def newFuzzyMatrix(self, key, engine, rowCache=None):
+        if rowCache is not None and engine == "dp":
+            return incrementalDLMatrix(key, rowCache)
+        return fuzzyMatrices[engine](key)
+
+    # Whether searchKeyFuzzyGroup gives the same keys as searchKeyFuzzy
+    # with the given engine: it only does the iterative "dp" search under
+    # the first char node
+    def canSearchFuzzyGroup(self, engine=None):
+        if engine is None:
+            engine = self._fuzzyEngine
+        return not self._recursive and engine == "dp" and self._firstCharIndex is None and not self._segments
+
+    # searchKeyFuzzy for a chain of keys each a prefix of the next, like the
+    # queries of a typeahead burst, with one TST walk per edit distance for
+    # all of them. The DLMatrix is made for the longest key and every key
+    # reads its distances from its own first columns, which are those of
+    # its own DLMatrix. Each key gets the keys and statistics searchKeyFuzzy
+    # would give it when canSearchFuzzyGroup is True, with its own budget
+    # of maxNodes. Returns the statistics of every key
+    def searchKeyFuzzyGroup(self, keys, maxEditDist, numWordsList, keyLists, visitedKeysList, maxNodes=None,
+                            deadline=None):
+        statsList = []
+        queries = []
+        for i in range(len(keys)):
+            stats = {"nodesExpanded": 0, "editDist": 0, "complete": True, "timedOut": False}
+            statsList.append(stats)
+            if numWordsList[i] == 0 or len(keys[i]) < 2:
+                continue
+            queries.append({"len": len(keys[i]), "numWords": numWordsList[i], "numAdded": 0,
+                            "keyList": keyLists[i], "visitedKeys": visitedKeysList[i], "stats": stats,
+                            "budget": {"maxNodes": maxNodes, "deadline": deadline, "nodesExpanded": 0,
+                                       "complete": True, "timedOut": False}})
+        if not self._root or not queries:
+            return statsList
+        beginNode = self.findFirstNodeFromTop(self._root, keys[-1][0])
+        if not beginNode:
+            return statsList
+
+        nodes = self._nodes
+        for editDist in range(1, maxEditDist + 1):
+            searching = []
+            for query in queries:
+                if query["numAdded"] < query["numWords"] and query["budget"]["complete"] is True:
+                    query["stats"]["editDist"] = editDist
+                    query["keyValList"] = []
+                    query["passNumWords"] = query["numWords"] - query["numAdded"]
+                    query["done"] = False
+                    searching.append(query)
+            if not searching:
+                break
+            thisDLMatrix = DLMatrix(keys[-1])
+            thisDLMatrix.insertChar(nodes.getChar(beginNode))
+            self.groupSearchFuzzy(nodes.getDownNode(beginNode), editDist, thisDLMatrix, searching)
+            for query in searching:
+                keyValList = query["keyValList"]
+                keyValList.sort(key=lambda keyVal: -keyVal[1])
+                for keyVal in keyValList:
+                    query["visitedKeys"][keyVal[0]] = True
+                    query["keyList"].append(keyVal)
+                query["numAdded"] += len(keyValList)
+        for query in queries:
+            query["stats"]["nodesExpanded"] = query["budget"]["nodesExpanded"]
+            query["stats"]["complete"] = query["budget"]["complete"]
+            query["stats"]["timedOut"] = query["budget"]["timedOut"]
+        return statsList
+
+    # Iterative deepening over the edit distance: search distance 1 first and
+    # only go on to distance 2 if that did not give numWords keys. With the
+    # fuzzy search from the root on, every pass goes on to the candidates of
+    # the first char index once the keys under the first char node are done
+    def searchKeyFuzzyByDistance(self, key, beginNode, maxEditDist, numWords, keyList, visitedKeys, budget, stats,
+                                 engine, rowCache=None):
+        candidates = []
+        if self._firstCharIndex is not None:
+            candidates = self.getFirstCharCandidates(key)
+        if not beginNode and len(candidates) == 0:
             return
+        nodes = self._nodes
+        numAdded = 0
+        for editDist in range(1, maxEditDist + 1):
+            stats["editDist"] = editDist
+            keyValList = []
+            if beginNode and self._segments:
+                # The automaton engine walks segments with the DLMatrix rows
+                thisDLMatrix = self.newFuzzyMatrix(key, "dp" if engine == "automaton" else engine, rowCache)
+                self.segmentSearchFuzzyFrom(beginNode, editDist, thisDLMatrix, numWords - numAdded, keyValList,
+                                            visitedKeys, budget)
+            elif beginNode and engine == "automaton":
+                automaton = self._automata.get(key, editDist)
+                state = automaton.step(automaton.getStartState(), nodes.getChar(beginNode))
+                self.automatonSearchFuzzy(nodes.getDownNode(beginNode), editDist, automaton, state,
+                                          numWords - numAdded, keyValList, visitedKeys, budget)
+            elif beginNode:
+                thisDLMatrix = self.newFuzzyMatrix(key, engine, rowCache)
+                thisDLMatrix.insertChar(nodes.getChar(beginNode))
+                self.boundedSearchFuzzy(nodes.getDownNode(beginNode), editDist, thisDLMatrix, numWords - numAdded,
+                                        keyValList, visitedKeys, budget)
+            if len(candidates) > 0 and len(keyValList) < numWords - numAdded and budget["complete"] is True:
+                self.searchFuzzyFromCandidates(key, candidates, editDist, numWords - numAdded, keyValList,
+                                               visitedKeys, budget, engine, rowCache)
+            keyValList.sort(key=lambda keyVal: -keyVal[1])
+            for keyVal in keyValList:
+                visitedKeys[keyVal[0]] = True
+                keyList.append(keyVal)
+            numAdded += len(keyValList)
+            if numAdded >= numWords or budget["complete"] is False:
+                break
 
-        begin2Chars = pattern[0:2]
-        keysWithSubstrList = []
-        if (patternLen == 2):
-            keysWithSubstrList = self._wordsWithChars.get(begin2Chars)
+    # Fuzzy search the keys starting with the prefixes from the first char
+    # index. The prefixes are sorted, so going from one to the next only the
+    # chars after the part they share are taken off the path and the edit
+    # distance rows and added again. The key ending at a prefix counts as
+    # well, and only prefixes as long as the index window have keys below
+    # them that are not candidates themselves
+    def searchFuzzyFromCandidates(self, key, candidates, editDist, numWords, keyValList, visitedKeys, budget,
+                                  engine, rowCache=None):
+        nodes = self._nodes
+        useAutomaton = engine == "automaton"
+        if useAutomaton:
+            automaton = self._automata.get(key, editDist)
+            states = [automaton.getStartState()]
         else:
-            begin3Chars = pattern[0:3]
-            keysWithSubstrList = self._wordsWithChars.get(begin3Chars)
+            thisDLMatrix = self.newFuzzyMatrix(key, engine, rowCache)
+        path = ""
+        pathNodes = []
+        for prefix in candidates:
+            if len(keyValList) >= numWords or budget["complete"] is False:
+                break
+            numShared = 0
+            while numShared < min(len(path), len(prefix)) and path[numShared] == prefix[numShared]:
+                numShared += 1
+            while len(path) > numShared:
+                path = path[:-1]
+                pathNodes.pop()
+                if useAutomaton:
+                    states.pop()
+                else:
+                    thisDLMatrix.popChar()
+            while len(path) < len(prefix):
+                # Pruned like the fuzzy search prunes the subtree below a node
+                if path and useAutomaton and automaton.getEditDistForCharsSoFar(states[-1]) > editDist:
+                    break
+                if path and not useAutomaton and thisDLMatrix.getEditDistForCharsSoFar() > editDist:
+                    break
+                c = prefix[len(path)]
+                if pathNodes:
+                    node = self.findFirstNodeFromTop(nodes.getDownNode(pathNodes[-1]), c)
+                else:
+                    node = self.findFirstNodeFromTop(self._root, c)
+                if not node:
+                    break
+                path += c
+                pathNodes.append(node)
+                if useAutomaton:
+                    states.append(automaton.step(states[-1], c))
+                else:
+                    thisDLMatrix.insertChar(c)
+                budget["nodesExpanded"] += 1
+            if path != prefix:
+                continue
 
-        if keysWithSubstrList is None:
-            return
+            node = pathNodes[-1]
+            if useAutomaton:
+                wordDist = automaton.getEditDistForWord(states[-1])
+                charsSoFarDist = automaton.getEditDistForCharsSoFar(states[-1])
+            else:
+                wordDist = thisDLMatrix.getEditDistForWord()
+                charsSoFarDist = thisDLMatrix.getEditDistForCharsSoFar()
+            if nodes.hasWord(node) is True and 0 < wordDist <= editDist and visitedKeys.get(prefix) is None:
+                keyValList.append([prefix, nodes.getValue(node)])
+                if len(keyValList) == numWords:
+                    break
+            if len(prefix) <= firstCharWindow or charsSoFarDist > editDist:
+                continue
+            if useAutomaton:
+                self.automatonSearchFuzzy(nodes.getDownNode(node), editDist, automaton, states[-1], numWords,
+                                          keyValList, visitedKeys, budget)
+            else:
+                self.boundedSearchFuzzy(nodes.getDownNode(node), editDist, thisDLMatrix, numWords, keyValList,
+                                        visitedKeys, budget)
 
-        byMatch = BoyerMooreMatch(pattern)
-        patternLen = len(pattern)
-        numAddedWords = 0
-        for i in range(len(keysWithSubstrList)):
-            keyValPair = keysWithSubstrList[i]
-            key = keyValPair[0]
-            if len(key) < patternLen:
+    # Fuzzy search with the deletion index, in the same order as
+    # searchKeyFuzzyByDistance: the candidates within distance 1 of the
+    # deletion variants of key first, then those within 2. Candidates are
+    # checked with a DLMatrix in sorted order, so neighbouring candidates
+    # share the rows of their common prefix. Unless the fuzzy search from the
+    # root is on, only keys with the first char of key count, and with it
+    # only keys with another first char whose prefix is one of the first
+    # char index candidates. A candidate is a match only if the TST engines
+    # would reach it: keys of one char are left out, as the TST search
+    # starts below the first char node, and so are keys on whose path the
+    # diagonal cell of some row before the last goes over the distance,
+    # which is where the TST search prunes. When a pass has more matches than
+    # are wanted, the ones with the largest values are kept, where the TST
+    # engines keep the first ones they walk. The budget counts the
+    # candidates checked
+    def symSpellSearchFuzzy(self, key, maxEditDist, numWords, keyList, visitedKeys, budget, stats):
+        table = self._keyTable
+        prefixes = None
+        if self._firstCharIndex is not None:
+            prefixes = set(self.getFirstCharCandidates(key))
+        maxNodes = budget["maxNodes"]
+        nodesExpanded = budget["nodesExpanded"]
+        # key id -> edit distance of the candidates checked in earlier passes,
+        # and the largest diagonal cell on their path
+        checked = {}
+        numAdded = 0
+        for editDist in range(1, maxEditDist + 1):
+            stats["editDist"] = editDist
+            keyValList = []
+            candidates = []
+            for keyId in self._symSpell.getCandidates(key, editDist):
+                if table.isDeleted(keyId):
+                    continue
+                candidate = table.getKey(keyId)
+                if len(candidate) < 2:
+                    continue
+                if candidate[0] != key[0] and (prefixes is None or candidate[:firstCharWindow + 1] not in prefixes):
+                    continue
+                if visitedKeys.get(candidate) is not None:
+                    continue
+                dists = checked.get(keyId)
+                if dists is None:
+                    candidates.append((candidate, keyId))
+                elif 0 < dists[0] <= editDist and dists[1] <= editDist:
+                    keyValList.append([candidate, table.getValue(keyId)])
+            candidates.sort()
+
+            thisDLMatrix = DLMatrix(key)
+            path = ""
+            # Largest diagonal cell of the rows of path up to each char
+            maxDiagonals = []
+            for candidate, keyId in candidates:
+                if maxNodes is not None and nodesExpanded >= maxNodes:
+                    budget["complete"] = False
+                    break
+                if nodesExpanded % 64 == 0 and self.pastDeadline(budget):
+                    break
+                nodesExpanded += 1
+                numShared = 0
+                while numShared < min(len(path), len(candidate)) and path[numShared] == candidate[numShared]:
+                    numShared += 1
+                for i in range(len(path) - numShared):
+                    thisDLMatrix.popChar()
+                    maxDiagonals.pop()
+                for c in candidate[numShared:]:
+                    thisDLMatrix.insertChar(c)
+                    diagonal = thisDLMatrix.getEditDistForCharsSoFar()
+                    if maxDiagonals and maxDiagonals[-1] > diagonal:
+                        diagonal = maxDiagonals[-1]
+                    maxDiagonals.append(diagonal)
+                path = candidate
+                dist = thisDLMatrix.getEditDistForWord()
+                checked[keyId] = (dist, maxDiagonals[-2])
+                if 0 < dist <= editDist and maxDiagonals[-2] <= editDist:
+                    keyValList.append([candidate, table.getValue(keyId)])
+
+            keyValList.sort(key=lambda keyVal: -keyVal[1])
+            for keyVal in keyValList[:numWords - numAdded]:
+                visitedKeys[keyVal[0]] = True
+                keyList.append(keyVal)
+                numAdded += 1
+            if numAdded >= numWords or budget["complete"] is False:
+                break
+        budget["nodesExpanded"] = nodesExpanded
+
+    # Depth first fuzzy search collecting up to numWords new keys within
+    # editDist, pruning subtrees beyond editDist like iterativeSearchFuzzy.
+    # The keys closer than editDist were found by the earlier passes unless
+    # their path was pruned there; the pruning looks at the diagonal cell
+    # only, which a shifted char keeps above the distance of the whole key.
+    # Stops early once numWords keys are found or the budget is used up
+    def boundedSearchFuzzy(self, node, editDist, thisDLMat, numWords, keyValList, visitedKeys, budget):
+        nodes = self._nodes
+        maxNodes = budget["maxNodes"]
+        nodesExpanded = budget["nodesExpanded"]
+        stack = []
+        while node:
+            stack.append(node)
+            node = nodes.getLeftNode(node)
+        while stack:
+            node = stack.pop()
+            if node is None:
+                thisDLMat.popChar()
                 continue
+            if maxNodes is not None and nodesExpanded >= maxNodes:
+                budget["complete"] = False
+                break
+            if nodesExpanded % 64 == 0 and self.pastDeadline(budget):
+                break
+            nodesExpanded += 1
+            child = nodes.getRightNode(node)
+            while child:
+                stack.append(child)
+                child = nodes.getLeftNode(child)
+
+            thisDLMat.insertChar(nodes.getChar(node))
+            if nodes.hasWord(node) is True and 0 < thisDLMat.getEditDistForWord() <= editDist:
+                key = self.getWord(node)
+                if visitedKeys.get(key) is None:
+                    keyValList.append([key, nodes.getValue(node)])
+                    if len(keyValList) == numWords:
+                        break
+            stack.append(None)
+            if thisDLMat.getEditDistForCharsSoFar() <= editDist:
+                child = nodes.getDownNode(node)
+                while child:
+                    stack.append(child)
+                    child = nodes.getLeftNode(child)
+        budget["nodesExpanded"] = nodesExpanded
 
-            val = keyValPair[1]
-            if visitedKeys.get(key) is not None:
+    # boundedSearchFuzzy for the queries of searchKeyFuzzyGroup at once. Every
+    # node on the stack carries the queries whose search has not pruned its
+    # path, so each query sees the nodes boundedSearchFuzzy would show it in
+    # the same order, and is done once it has its keys or its budget is
+    # used up
+    def groupSearchFuzzy(self, node, editDist, thisDLMat, queries):
+        nodes = self._nodes
+        stack = []
+        while node:
+            stack.append((node, queries))
+            node = nodes.getLeftNode(node)
+        while stack:
+            entry = stack.pop()
+            if entry is None:
+                thisDLMat.popChar()
                 continue
-            if byMatch.matches(key):
-                keyList.append([key, val])
+            node, active = entry
+            live = []
+            for query in active:
+                if query["done"]:
+                    continue
+                budget = query["budget"]
+                maxNodes = budget["maxNodes"]
+                if maxNodes is not None and budget["nodesExpanded"] >= maxNodes:
+                    budget["complete"] = False
+                    query["done"] = True
+                    continue
+                if budget["nodesExpanded"] % 64 == 0 and self.pastDeadline(budget):
+                    query["done"] = True
+                    continue
+                budget["nodesExpanded"] += 1
+                live.append(query)
+            if not live:
+                continue
+            child = nodes.getRightNode(node)
+            while child:
+                stack.append((child, active))
+                child = nodes.getLeftNode(child)
+
+            thisDLMat.insertChar(nodes.getChar(node))
+            key = None
+            if nodes.hasWord(node) is True:
+                for query in live:
+                    if 0 < thisDLMat.getEditDistForWord(query["len"]) <= editDist:
+                        if key is None:
+                            key = self.getWord(node)
+                        if query["visitedKeys"].get(key) is None:
+                            query["keyValList"].append([key, nodes.getValue(node)])
+                            if len(query["keyValList"]) == query["passNumWords"]:
+                                query["done"] = True
+            stack.append(None)
+            down = []
+            for query in live:
+                if not query["done"] and thisDLMat.getEditDistForCharsSoFar(query["len"]) <= editDist:
+                    down.append(query)
+            if down:
+                child = nodes.getDownNode(node)
+                while child:
+                    stack.append((child, down))
+                    child = nodes.getLeftNode(child)
+
+    # boundedSearchFuzzy intersecting the TST with a levenshteinAutomaton. The
+    # stack holds every node with the automaton state of its parent, so no
+    # row has to be popped and every edge costs one transition lookup
+    def automatonSearchFuzzy(self, node, editDist, automaton, state, numWords, keyValList, visitedKeys, budget):
+        nodes = self._nodes
+        maxNodes = budget["maxNodes"]
+        nodesExpanded = budget["nodesExpanded"]
+        step = automaton.step
+        stack = []
+        while node:
+            stack.append((node, state))
+            node = nodes.getLeftNode(node)
+        while stack:
+            node, parentState = stack.pop()
+            if maxNodes is not None and nodesExpanded >= maxNodes:
+                budget["complete"] = False
+                break
+            if nodesExpanded % 64 == 0 and self.pastDeadline(budget):
+                break
+            nodesExpanded += 1
+            child = nodes.getRightNode(node)
+            while child:
+                stack.append((child, parentState))
+                child = nodes.getLeftNode(child)
+
+            state = step(parentState, nodes.getChar(node))
+            if nodes.hasWord(node) is True and 0 < automaton.getEditDistForWord(state) <= editDist:
+                key = self.getWord(node)
+                if visitedKeys.get(key) is None:
+                    keyValList.append([key, nodes.getValue(node)])
+                    if len(keyValList) == numWords:
+                        break
+            if automaton.getEditDistForCharsSoFar(state) <= editDist:
+                child = nodes.getDownNode(node)
+                while child:
+                    stack.append((child, state))
+                    child = nodes.getLeftNode(child)
+        budget["nodesExpanded"] = nodesExpanded
+
+    # Find the keys containing pattern, largest values first. With an up to
+    # date suffix array these come straight out of it. Otherwise the
+    # candidates are the keys having every trigram of the pattern (the
+    # bigram if that is all it is) in the n-gram index, and they are checked
+    # against the pattern. suffixRange is the range of the pattern in the
+    # suffix array if it is known already. Returns False if the search
+    # stopped at deadline (seconds since the epoch), True otherwise
+    def searchSubstringKeys(self, pattern, keyList, numWords, visitedKeys, suffixRange=None, deadline=None):
+        patternLen = len(pattern)
+        if patternLen == 1 or patternLen == 0:
+            return True
+        if self._suffixArray is not None and not self._suffixArray.isStale():
+            numAddedWords = 0
+            numKeys = 0
+            lastYield = time.time()
+            for keyId in self._suffixArray.iterateTopKeys(pattern, suffixRange):
+                numKeys += 1
+                if numKeys % 64 == 0:
+                    # Let other threads run, like the fuzzy search does
+                    now = time.time()
+                    if now - lastYield > yieldInterval:
+                        time.sleep(0)
+                        lastYield = now
+                    if deadline is not None and now > deadline:
+                        return False
+                if self._keyTable.isDeleted(keyId):
+                    continue
+                key = self._keyTable.getKey(keyId)
+                if visitedKeys.get(key) is not None:
+                    continue
+                keyList.append([key, self._keyTable.getValue(keyId)])
                 visitedKeys[key] = True
                 numAddedWords += 1
                 if numAddedWords == numWords:
                     break
+            return True
+
+        table = self._keyTable
+        rankedKeyVals = ([table.getKey(keyId), table.getValue(keyId)]
+                         for keyId in self._ngrams.iterateRankedCandidates(pattern) if not table.isDeleted(keyId))
+        pendingKeyVals = [[table.getKey(keyId), table.getValue(keyId)]
+                          for keyId in self._ngrams.getPendingCandidates(pattern) if not table.isDeleted(keyId)]
+        pendingKeyVals.sort(key=lambda keyVal: -keyVal[1])
+
+        # The candidates are checked in chunks: a chunk of at least
+        # substringBatchSize keys at once with batchMatches, a smaller one
+        # key by key with a BoyerMooreMatch
+        candidates = heapq.merge(rankedKeyVals, pendingKeyVals, key=lambda keyVal: -keyVal[1])
+        byMatch = None
+        numAddedWords = 0
+        lastYield = time.time()
+        while numAddedWords < numWords:
+            now = time.time()
+            if now - lastYield > yieldInterval:
+                time.sleep(0)
+                lastYield = now
+            if deadline is not None and now > deadline:
+                return False
+            chunkSize = min(max(numWords - numAddedWords, substringBatchSize), maxSubstringChunk)
+            chunk = []
+            for keyValPair in candidates:
+                key = keyValPair[0]
+                if len(key) < patternLen or visitedKeys.get(key) is not None:
+                    continue
+                chunk.append(keyValPair)
+                if len(chunk) == chunkSize:
+                    break
+            if not chunk:
+                break
+
+            if len(chunk) >= substringBatchSize:
+                mask = batchMatches(pattern, [keyValPair[0] for keyValPair in chunk])
+            else:
+                if byMatch is None:
+                    byMatch = BoyerMooreMatch(pattern)
+                mask = [byMatch.matches(keyValPair[0]) for keyValPair in chunk]
+            for i in range(len(chunk)):
+                if mask[i]:
+                    key = chunk[i][0]
+                    keyList.append([key, chunk[i][1]])
+                    visitedKeys[key] = True
+                    numAddedWords += 1
+                    if numAddedWords == numWords:
+                        break
+            if len(chunk) < chunkSize:
+                break
+        return True
 
     # TST display functions
+    # Print a node: its char, its id in a tstNodePool or the address of the
+    # node object, whether a key ends at it and its value
     def visit(self, curNode):
-        if curNode is None:
+        if not curNode:
             return
         else:
-            print(curNode.getChar() + " " + str(hex(id(curNode))) + " " + str(curNode.hasWord()) + " " + str(
-                curNode.getNumWords()))
+            nodes = self._nodes
+            if isinstance(nodes, tstNodePool):
+                nodeId = str(curNode)
+            else:
+                nodeId = str(hex(id(curNode)))
+            print(nodes.getChar(curNode) + " " + nodeId + " " + str(nodes.hasWord(curNode)) + " " + str(
+                nodes.getValue(curNode)))
 
     def traverseTst(self, node):
-        if node is None:
+        if not node:
             return
         else:
             self.visit(node)
-            self.traverseTst(node.getLeftNode())
-            self.traverseTst(node.getDownNode())
-            self.traverseTst(node.getRightNode())
+            self.traverseTst(self._nodes.getLeftNode(node))
+            self.traverseTst(self._nodes.getDownNode(node))
+            self.traverseTst(self._nodes.getRightNode(node))
 
     def printTst(self):
-        if self._root is None:
+        if not self._root:
             return
         else:
             self.traverseTst(self._root)
@@ -0,0 +1,72 @@
+# --------------------------------------------------------------------- #
+#  Table of the keys of a dictionary and their values. Every key gets a
+#  small integer id when it is first added, so the indexes over the keys
+#  can hold key ids instead of their own copies of [key, val] pairs. A
+#  deleted key keeps its id as a tombstone, which the indexes skip, and
+#  gets it back if it is added again. A new version of the table (see
+#  newVersion) shares the keys of the table it comes from and adds its
+#  own after them, so the ids beyond the values of a version are not its
+#  keys
+# --------------------------------------------------------------------- #
+import copy
+from array import array
+
+
+class keyTable:
+    def __init__(self):
+        self._keys = []
+        self._vals = array('q')
+        self._keyIds = {}
+        # Ids of the deleted keys
+        self._deleted = set()
+
+    # A table to change while this one is read: the keys are shared, the
+    # values and the deleted ids copied
+    def newVersion(self):
+        table = copy.copy(self)
+        table._vals = array('q', self._vals)
+        table._deleted = set(self._deleted)
+        return table
+
+    # Add a key, or update its value if it is there already, and return
+    # its id
+    def addKey(self, key, val):
+        keyId = self.getKeyId(key)
+        if keyId is None:
+            keyId = len(self._vals)
+            # Keys past the values were added by a version never handed on
+            del self._keys[keyId:]
+            self._keyIds[key] = keyId
+            self._keys.append(key)
+            self._vals.append(val)
+        else:
+            self._vals[keyId] = val
+            self._deleted.discard(keyId)
+        return keyId
+
+    def deleteKey(self, keyId):
+        self._deleted.add(keyId)
+
+    def isDeleted(self, keyId):
+        return keyId >= len(self._vals) or keyId in self._deleted
+
+    def numDeleted(self):
+        return len(self._deleted)
+
+    def getKeyId(self, key):
+        keyId = self._keyIds.get(key)
+        if keyId is None or keyId >= len(self._vals) or self._keys[keyId] != key:
+            return None
+        return keyId
+
+    def getKey(self, keyId):
+        return self._keys[keyId]
+
+    def getValue(self, keyId):
+        return self._vals[keyId]
+
+    def setValue(self, keyId, val):
+        self._vals[keyId] = val
+
+    def numKeys(self):
+        return len(self._vals)
@@ -1,6 +1,18 @@
+import asyncio
+import contextlib
+import os
+import threading
 import time
 
 from keyDict import keyDict
+from kvLog import kvLog
+from kvSnapshot import kvSnapshot
+from kvUtils import kvUtils
+from queryResultCache import queryResultCache
+from tstNodePool import tstNodePool
+from tstSegmentNode import tstSegmentStore
+from tsvReader import tsvReader
+from typeaheadSession import typeaheadSession
 
 
 # --------------------------------------------------------------------- #
@@ -20,21 +32,351 @@ def getTimeAsString(start_time, end_time):
 #  Top level API for the string key and integer value store
 # --------------------------------------------------------------------- #
 class keyValueStore:
-    def __init__(self):
-        self._keyDict = keyDict()
+    # With compactNodes set, the TST nodes are kept in a tstNodePool
+    # (parallel typed arrays) instead of one tstNode object per node. With
+    # segmentNodes set, chains of nodes with one child each are kept as one
+    # node holding their chars (see tstSegmentNode), which saves nodes and
+    # hops on long keys
+    def __init__(self, compactNodes=False, segmentNodes=False):
+        if compactNodes and segmentNodes:
+            raise ValueError("The node pool has one char per node")
+        if compactNodes:
+            self._keyDict = keyDict(tstNodePool())
+        elif segmentNodes:
+            self._keyDict = keyDict(tstSegmentStore())
+        else:
+            self._keyDict = keyDict()
         self._numResults = 25
+        self._fuzzyMaxNodes = None
+        self._fuzzyMaxTime = None
+        self._resultCache = None
+        # Executor findKeysAsync runs the searches on, None for the default
+        # one of the event loop
+        self._asyncExecutor = None
+        # Write-ahead log of the changes, None while there is none
+        self._log = None
+        # With versions on, a change is made to a new version of the
+        # dictionary, which is then published in its place (see writing)
+        self._versioned = False
+        # Changes are made one at a time; the result cache is shared by
+        # the reading threads
+        self._writeLock = threading.Lock()
+        self._cacheLock = threading.Lock()
 
     def setNumResults(self, numResults):
         self._numResults = numResults
 
+    # Turn versions on or off. With versions on, findKeys can be called
+    # from many threads while another one changes the store: a change is
+    # made to a new version of the dictionary (see keyDict.newVersion) and
+    # published by replacing self._keyDict once it is complete, and every
+    # search takes the version published when it starts and reads only
+    # that one, so it never sees half of a change nor waits for a writer.
+    # Each change copies a path of nodes and the value column of the key
+    # table; applyChanges publishes many changes in one version. Without
+    # versions the dictionary is changed in place and must not be searched
+    # meanwhile
+    def setVersioned(self, enabled):
+        self._versioned = enabled
+
+    # The published version of the dictionary
+    def getKeyDict(self):
+        return self._keyDict
+
+    # Context of a change: yields the dictionary to change, a new version
+    # with versions on, which is published when the block ends. A block
+    # ending in an exception publishes nothing. Writers take turns
+    @contextlib.contextmanager
+    def writing(self):
+        with self._writeLock:
+            if not self._versioned:
+                yield self._keyDict
+                return
+            kd = self._keyDict.newVersion()
+            yield kd
+            kd.sealVersion()
+            self._keyDict = kd
+
+    # Pick the engine of the fuzzy search: "dp" for the DLMatrix rows,
+    # "bitparallel" for BPDLMatrix, "automaton" for a cached
+    # levenshteinAutomaton per query or "symspell" for the deletion index
+    def setFuzzyEngine(self, engine):
+        with self.writing() as kd:
+            kd.setFuzzyEngine(engine)
+        self.clearResultCache()
+
+    # Build (or drop) the deletion index the "symspell" fuzzy engine looks
+    # candidates up in; keys longer than maxKeyLength are not indexed
+    def setSymSpellIndex(self, enabled, maxKeyLength=12):
+        with self.writing() as kd:
+            kd.setSymSpellIndex(enabled, maxKeyLength)
+        self.clearResultCache()
+
+    # Turn the suffix array substring engine on or off. It is built along
+    # with the dictionary and saved with it
+    def setSuffixArrayIndex(self, enabled):
+        with self.writing() as kd:
+            kd.setSuffixArrayIndex(enabled)
+        self.clearResultCache()
+
+    # Bound the fuzzy search of every query by the number of TST nodes it may
+    # expand and/or the number of seconds it may take; None means unbounded
+    def setFuzzyBudget(self, maxNodes=None, maxTime=None):
+        self._fuzzyMaxNodes = maxNodes
+        self._fuzzyMaxTime = maxTime
+        self.clearResultCache()
+
+    # Let the fuzzy search find keys with a different first char, backed by
+    # an index over the first chars of all keys (see keyDict.setFuzzyFromRoot)
+    def setFuzzyFromRoot(self, enabled):
+        with self.writing() as kd:
+            kd.setFuzzyFromRoot(enabled)
+        self.clearResultCache()
+
+    # Keep the ranked prefix search results of every prefix of up to
+    # maxPrefixLength chars in a table kept up to date on insert (see
+    # keyDict.setHotPrefixTable); 0 turns it off
+    def setHotPrefixTable(self, maxPrefixLength):
+        with self.writing() as kd:
+            kd.setHotPrefixTable(maxPrefixLength, self._numResults)
+
+    # Size of the hot prefix table, None while it is off
+    def getHotPrefixStats(self):
+        return self._keyDict.getHotPrefixStats()
+
+    # Cache the results of findKeys, up to maxEntries queries and roughly
+    # maxBytes of results, dropping the least recently used ones first
+    def setResultCache(self, enabled, maxEntries=10000, maxBytes=16 << 20):
+        if enabled:
+            self._resultCache = queryResultCache(maxEntries, maxBytes)
+        else:
+            self._resultCache = None
+
+    # Counters of the result cache, None without one
+    def getResultCacheStats(self):
+        if self._resultCache is None:
+            return None
+        with self._cacheLock:
+            return self._resultCache.getStats()
+
+    # Drop all cached results, for changes that can affect any query
+    def clearResultCache(self):
+        if self._resultCache is not None:
+            with self._cacheLock:
+                self._resultCache.clear()
+
+    # Drop the cached results of the queries a changed key matches (see
+    # queryResultCache.invalidateKey)
+    def invalidateCachedKey(self, key, substringChanged):
+        if self._resultCache is not None:
+            with self._cacheLock:
+                self._resultCache.invalidateKey(key, substringChanged)
+
+    # Check an (op, key, value) change before it is logged and applied and
+    # return it, with the value converted to an int like keyDict.insertKey
+    # does. Raises ValueError for an unknown op, a key that is not a
+    # non-empty string or a value that int() cannot convert
+    @staticmethod
+    def checkChange(op, key, value=None):
+        if op not in ("I", "U", "D"):
+            raise ValueError("Unknown change: " + str(op))
+        if not isinstance(key, str) or len(key) == 0:
+            raise ValueError("Cannot change an empty or non-string key: " + repr(key))
+        if op == "D":
+            return op, key, None
+        if isinstance(value, bool):
+            raise ValueError("Cannot set a value that is not an integer: " + repr(value))
+        try:
+            return op, key, int(value)
+        except (TypeError, ValueError):
+            raise ValueError("Cannot set a value that is not an integer: " + repr(value)) from None
+
+    # Apply a change, as logged by kvLog: op "I" inserts key with value,
+    # "U" updates its value and "D" deletes it. Returns whether the key was
+    # changed and whether it changed an up to date suffix array
+    def applyChange(self, kd, op, key, value=None):
+        suffixArray = kd.getSuffixArrayIndex()
+        substringChanged = suffixArray is not None and not suffixArray.isStale()
+        if op == "I":
+            kd.insertKey(key, value)
+            return True, substringChanged
+        if op == "U":
+            return kd.updateValue(key, value), substringChanged
+        if op == "D":
+            return kd.deleteKey(key), substringChanged
+        raise ValueError("Unknown change: " + str(op))
+
+    # Insert a key, or update its value. Only the cached results of the
+    # queries the key matches are dropped
     def insertKey(self, key, value):
-        self._keyDict.insertKey(key, value)
+        self.applyChanges([("I", key, value)])
+
+    # Change the value of a key (see keyDict.updateValue); returns False if
+    # the key is not in the store
+    def updateValue(self, key, value):
+        return self.applyChanges([("U", key, value)]) == 1
+
+    # Delete a key (see keyDict.deleteKey); returns False if the key is not
+    # in the store
+    def deleteKey(self, key):
+        return self.applyChanges([("D", key)]) == 1
+
+    # Apply a list of (op, key, value) changes (see applyChange; no value
+    # for "D") in order. They are logged with one write before they are
+    # applied, and with versions on they are published together, so a
+    # search sees all of them or none. Every change is checked (see
+    # checkChange) before any is logged; if applying one raises all the
+    # same, the records of the changes the store does not have are taken
+    # off the log again. Returns the number of changes that found their key
+    def applyChanges(self, changes):
+        records = []
+        for change in changes:
+            value = None
+            if len(change) > 2:
+                value = change[2]
+            records.append(self.checkChange(change[0], change[1], value))
+        changed = []
+        with self.writing() as kd:
+            if self._log is not None:
+                self._log.appendRecords(records)
+            numApplied = 0
+            try:
+                for op, key, value in records:
+                    found, substringChanged = self.applyChange(kd, op, key, value)
+                    if found:
+                        changed.append((key, substringChanged))
+                    numApplied += 1
+            except Exception:
+                # A new version is not published, so with versions on the
+                # store has none of the changes
+                if self._log is not None:
+                    self._log.dropRecords(records if self._versioned else records[numApplied:])
+                raise
+        for key, substringChanged in changed:
+            self.invalidateCachedKey(key, substringChanged)
+        return len(changed)
+
+    # Write every change to a write-ahead log at path before applying it
+    # (see kvLog). The changes already in the log are applied first, which
+    # recovers a store from its last snapshot and the log; a store opened
+    # read-only from a snapshot is made writable with a compact first. Bulk
+    # loads are not logged, so compact into a snapshot after one. A record
+    # that cannot be applied, e.g. one of an empty key, is reported and
+    # skipped. Returns the number of changes replayed, None if the log
+    # cannot be read
+    def openLog(self, path, syncWrites=False):
+        self.closeLog()
+        log = kvLog(path, syncWrites)
+        error = None
+        numSkipped = 0
+        with self.writing() as kd:
+            nodes = kd.getNodeStore()
+            if hasattr(nodes, "isReadOnly") and nodes.isReadOnly():
+                kd.compact()
+            try:
+                for op, key, value in log.replay():
+                    try:
+                        self.applyChange(kd, *self.checkChange(op, key, value))
+                    except Exception as e:
+                        print("Skipping log record " + repr((op, key, value)) + " in " + path + ": " + str(e))
+                        numSkipped += 1
+                log.open()
+            except IOError:
+                error = "Cannot open filename: " + path
+            except ValueError as e:
+                error = str(e)
+            kd.sortWordsWithCharsDict()
+        self.clearResultCache()
+        if error is not None:
+            print(error)
+            return None
+        self._log = log
+        return log.numRecords() - numSkipped
 
-    def findKeys(self, key, keyList):
+    def closeLog(self):
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+    # Number of changes in the log and its size in bytes, None without a log
+    def getLogStats(self):
+        if self._log is None:
+            return None
+        return {"numRecords": self._log.numRecords(), "numBytes": self._log.getSize(),
+                "numDeleted": self._keyDict.getKeyTable().numDeleted()}
+
+    # Build the dictionary again from its live keys (see keyDict.compact).
+    # With snapshotPath it is then saved there, through a temporary file
+    # renamed over it, and the log is emptied as the snapshot holds its
+    # changes. Returns the build statistics
+    def compact(self, snapshotPath=None):
+        with self.writing() as kd:
+            stats = kd.compact()
+            if snapshotPath is not None:
+                tmpPath = snapshotPath + ".tmp"
+                kvSnapshot.save(kd, tmpPath)
+                os.replace(tmpPath, snapshotPath)
+                if self._log is not None:
+                    self._log.truncate()
+        self.clearResultCache()
+        return stats
+
+    # Find the keys for a query and add them to keyList. fuzzyEngine picks
+    # the fuzzy engine for this query only. Returns the query statistics:
+    # those of the fuzzy search if it was run and whether the substring
+    # search was run. With the result cache on, the keys come from it if
+    # the query was asked before. Results cut short by the time budget are
+    # not cached, as the next search may have the time to finish; those
+    # cut short by the node budget are, as it always stops at the same place
+    def findKeys(self, key, keyList, fuzzyEngine=None):
+        kd = self._keyDict
+        if self._resultCache is None:
+            return self.searchKeyDict(kd, key, keyList, fuzzyEngine)
+        cacheKey = (key, self._numResults, fuzzyEngine)
+        with self._cacheLock:
+            cached = self._resultCache.get(cacheKey)
+        if cached is not None:
+            keyList.extend([keyVal[0], keyVal[1]] for keyVal in cached[0])
+            return dict(cached[1])
+        start = len(keyList)
+        queryStats = self.searchKeyDict(kd, key, keyList, fuzzyEngine)
+        with self._cacheLock:
+            # Not if a change was published meanwhile, whose invalidation
+            # may have come before
+            if kd is self._keyDict and not self.isTimedOut(queryStats):
+                self._resultCache.put(cacheKey, [[keyVal[0], keyVal[1]] for keyVal in keyList[start:]], queryStats)
+        return queryStats
+
+    # Whether the time budget or a deadline stopped a phase of a search, from
+    # its query statistics
+    @staticmethod
+    def isTimedOut(queryStats):
+        phases = queryStats["phases"]
+        if "timeout" in phases.values() or phases["substring"] == "partial":
+            return True
+        return phases["fuzzy"] == "partial" and queryStats["fuzzy"]["timedOut"]
+
+    # The four phases of findKeys: exact match, prefix, fuzzy and substring
+    # search. numResults overrides the number of keys wanted and deadline
+    # (seconds since the epoch) stops the fuzzy and substring phases, with
+    # the keys found so far kept in keyList. queryStats["phases"] tells how
+    # each phase went: "done", "skipped" when enough keys were found before
+    # it, "partial" when it stopped early (at deadline or on the fuzzy
+    # budget) and "timeout" when deadline passed before it began
+    def searchKeys(self, key, keyList, fuzzyEngine=None, numResults=None, deadline=None):
+        return self.searchKeyDict(self._keyDict, key, keyList, fuzzyEngine, numResults, deadline)
+
+    # searchKeys in the version kd of the dictionary
+    def searchKeyDict(self, kd, key, keyList, fuzzyEngine=None, numResults=None, deadline=None):
+        queryStats = {"fuzzy": None, "substring": False}
+        phases = {"exact": "done", "prefix": "done", "fuzzy": "skipped", "substring": "skipped"}
+        queryStats["phases"] = phases
         visitedKeys = {}
         numWords = self._numResults
+        if numResults is not None:
+            numWords = numResults
         # First, find the exact match of the key
-        result, val = self._keyDict.searchKey(key)
+        result, val = kd.searchKey(key)
         if result is True:
             visitedKeys[key] = True
             keyList.append([key, val])
@@ -43,7 +385,7 @@ class keyValueStore:
         # If the keyList is empty, query all keys which
         # have the prefix as key
         start_time = time.time()
-        self._keyDict.searchAllKeysWithPrefix(key, keyList, numWords, visitedKeys)
+        kd.searchAllKeysWithPrefix(key, keyList, numWords, visitedKeys)
         end_time = time.time()
         # print(" Total time for prefix search of \"" + key + "\" is :" + kvUtils.getTimeAsString(start_time, end_time))
 
@@ -51,31 +393,211 @@ class keyValueStore:
         # a fuzzy search
         if len(keyList) < numWords:
             start_time = time.time()
-            self._keyDict.searchKeyFuzzy(key, 2, numWords - len(keyList), keyList, visitedKeys)
+            if deadline is not None and start_time > deadline:
+                phases["fuzzy"] = "timeout"
+            else:
+                fuzzyDeadline = deadline
+                if self._fuzzyMaxTime is not None:
+                    fuzzyDeadline = start_time + self._fuzzyMaxTime
+                    if deadline is not None:
+                        fuzzyDeadline = min(fuzzyDeadline, deadline)
+                queryStats["fuzzy"] = kd.searchKeyFuzzy(key, 2, numWords - len(keyList), keyList, visitedKeys,
+                                                        self._fuzzyMaxNodes, fuzzyDeadline, fuzzyEngine)
+                if queryStats["fuzzy"]["complete"] is False:
+                    phases["fuzzy"] = "partial"
+                else:
+                    phases["fuzzy"] = "done"
             end_time = time.time()
             # print(" Total time for fuzzy search of \"" + key + "\" is :" + kvUtils.getTimeAsString(start_time, end_time))
 
         if len(keyList) < numWords:
             start_time = time.time()
-            self._keyDict.searchSubstringKeys(key, keyList, numWords - len(keyList), visitedKeys)
+            if deadline is not None and start_time > deadline:
+                phases["substring"] = "timeout"
+            else:
+                queryStats["substring"] = True
+                if kd.searchSubstringKeys(key, keyList, numWords - len(keyList), visitedKeys, deadline=deadline):
+                    phases["substring"] = "done"
+                else:
+                    phases["substring"] = "partial"
             end_time = time.time()
             # print(" Total time for substring search of \"" + key + "\" is :" + kvUtils.getTimeAsString(start_time, end_time))
 
-    def readTsvFile(self, filename):
+        return queryStats
+
+    # asyncio front end of findKeys: await kvStore.findKeysAsync(query).
+    # The search runs on an executor thread (see setAsyncExecutor), so the
+    # event loop goes on serving other coroutines meanwhile, and stops at
+    # timeout seconds from the call; the keys found by then are returned
+    # (exact and prefix matches first, then fuzzy and substring ones). The
+    # response is {"keys": key list, "phases": the phases of searchKeys,
+    # "complete": False if a phase was cut short}. The result cache is not
+    # used, its entries being those of complete searches
+    async def findKeysAsync(self, key, numResults=None, timeout=None, fuzzyEngine=None):
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        keyList = []
+        loop = asyncio.get_running_loop()
+        queryStats = await loop.run_in_executor(self._asyncExecutor, self.searchKeys, key, keyList, fuzzyEngine,
+                                                numResults, deadline)
+        phases = queryStats["phases"]
+        complete = all(status == "done" or status == "skipped" for status in phases.values())
+        return {"keys": keyList, "phases": phases, "complete": complete}
+
+    # findKeys for many queries at once; returns the key list of every
+    # query. Each distinct query is answered once, the TST descents of the
+    # queries in sorted order go on from the prefix they share with the one
+    # before, and chains of queries each a prefix of the next, such as
+    # "pa", "pat", "path", are fuzzy searched together when the engine
+    # allows it (see keyDict.searchKeyFuzzyGroup)
+    def findKeysBatch(self, queries, fuzzyEngine=None):
+        kd = self._keyDict
+        nodes = kd.getNodeStore()
+        distinctQueries = sorted(set(queries))
+        prefixNodes = kd.findPrefixNodes(distinctQueries)
+        keyLists = {}
+        visitedKeysOf = {}
+        numWordsOf = {}
+        for query, node in zip(distinctQueries, prefixNodes):
+            keyList = []
+            visitedKeys = {}
+            numWords = self._numResults
+            if node is not None:
+                if nodes.hasWord(node) is True and nodes.getWordLength(node) == len(query):
+                    visitedKeys[query] = True
+                    keyList.append([query, nodes.getValue(node)])
+                    numWords -= 1
+                kd.searchAllKeysWithPrefix(query, keyList, numWords, visitedKeys, node, len(query) - 1)
+            keyLists[query] = keyList
+            visitedKeysOf[query] = visitedKeys
+            numWordsOf[query] = numWords
+
+        fuzzyQueries = [query for query in distinctQueries if len(keyLists[query]) < numWordsOf[query]]
+        if kd.canSearchFuzzyGroup(fuzzyEngine):
+            chains = []
+            for query in fuzzyQueries:
+                if len(query) >= 2 and chains and query.startswith(chains[-1][-1]):
+                    chains[-1].append(query)
+                else:
+                    chains.append([query])
+        else:
+            chains = [[query] for query in fuzzyQueries]
+        for chain in chains:
+            deadline = None
+            if self._fuzzyMaxTime is not None:
+                deadline = time.time() + self._fuzzyMaxTime
+            if len(chain) == 1:
+                query = chain[0]
+                kd.searchKeyFuzzy(query, 2, numWordsOf[query] - len(keyLists[query]), keyLists[query],
+                                  visitedKeysOf[query], self._fuzzyMaxNodes, deadline, fuzzyEngine)
+            else:
+                kd.searchKeyFuzzyGroup(chain, 2, [numWordsOf[query] - len(keyLists[query]) for query in chain],
+                                       [keyLists[query] for query in chain],
+                                       [visitedKeysOf[query] for query in chain], self._fuzzyMaxNodes, deadline)
+
+        for query in distinctQueries:
+            keyList = keyLists[query]
+            if len(keyList) < numWordsOf[query]:
+                kd.searchSubstringKeys(query, keyList, numWordsOf[query] - len(keyList), visitedKeysOf[query])
+
+        return [list(keyLists[query]) for query in queries]
+
+    # Start a typeahead session: a query typed one char at a time with
+    # extend and backspace, each returning the keys findKeys would, with
+    # the work of the keystrokes before reused
+    def session(self, fuzzyEngine=None):
+        return typeaheadSession(self._keyDict, self._numResults, self._fuzzyMaxNodes, self._fuzzyMaxTime,
+                                fuzzyEngine, self.getKeyDict)
+
+    # Pick the concurrent.futures executor findKeysAsync runs the searches
+    # on, e.g. a ThreadPoolExecutor bounding the number of searches at a
+    # time; None for the default executor of the event loop
+    def setAsyncExecutor(self, executor):
+        self._asyncExecutor = executor
+
+    # Insert the keys of a tsv file one by one, in file order. The file is
+    # streamed by a tsvReader: "-" reads stdin and gzip input is
+    # decompressed. Returns the reading statistics (see tsvReader.getStats),
+    # None if the file cannot be read
+    def readTsvFile(self, filename, progressRows=None):
+        print("Reading: " + filename + " ...")
+        reader = tsvReader(filename, progressRows=progressRows)
+        readError = False
+        with self.writing() as kd:
+            try:
+                for key, val in reader.iterateKeyVals():
+                    kd.insertKey(key, val)
+            except (IOError, EOFError):
+                readError = True
+            kd.sortWordsWithCharsDict()
+        self.clearResultCache()
+        if readError:
+            print("Cannot read filename: " + filename)
+            return None
+
+        stats = reader.getStats()
+        self.printReadStats(stats)
+        return stats
+
+    # Read all the keys of a tsv file and build the dictionary from them in
+    # one go with keyDict.bulkInsert, which keeps the TST balanced even for
+    # sorted input. With numWorkers above 1 an empty store with compact
+    # nodes is built over that many processes (see
+    # keyDict.parallelBulkInsert). The file is streamed by a tsvReader into
+    # the builder, so only the parsed keys are held at once, not its lines.
+    # Returns the build statistics, with those of the reading under "read"
+    def buildFromTsvFile(self, filename, numWorkers=1, progressRows=None):
         print("Reading: " + filename + " ...")
-        f = None
+        reader = tsvReader(filename, progressRows=progressRows)
+        stats = None
+        with self.writing() as kd:
+            try:
+                stats = kd.parallelBulkInsert(reader.iterateKeyVals(), numWorkers)
+            except (IOError, EOFError):
+                pass
+            else:
+                kd.sortWordsWithCharsDict()
+        if stats is None:
+            print("Cannot read filename: " + filename)
+            return None
+        self.clearResultCache()
+        stats["read"] = reader.getStats()
+        self.printReadStats(stats["read"])
+        print("Built " + str(stats["numKeys"]) + " keys, " + str(stats["numNodes"]) + " nodes in " +
+              kvUtils.getTimeAsString(0, stats["buildTime"]) + ", max depth " + str(stats["maxDepth"]) +
+              ", average key depth " + "%.1f" % stats["avgKeyDepth"])
+        return stats
+
+    def printReadStats(self, stats):
+        line = ("Read " + str(stats["rows"]) + " rows in " + kvUtils.getTimeAsString(0, stats["readTime"]) + ", " +
+                "%.0f" % stats["rowsPerSec"] + " rows/s, " + str(stats["skipped"]) + " skipped, " +
+                str(stats["malformed"]) + " malformed")
+        if stats["peakMemory"] is not None:
+            line += ", peak memory " + "%.1f" % (stats["peakMemory"] / float(1 << 20)) + "MB"
+        print(line)
+
+    # Write the dictionary to a versioned binary snapshot at path
+    def save(self, path):
+        with self.writing() as kd:
+            kvSnapshot.save(kd, path)
+        # Saving ranks the substring index again, which can reorder keys of
+        # equal value
+        self.clearResultCache()
+
+    # Open a snapshot written by save. The file is memory mapped, so this
+    # is fast and processes opening the same snapshot share its pages. The
+    # returned store is read-only
+    @staticmethod
+    def open(path):
         try:
-            f = open(filename, "r")
+            kd = kvSnapshot.open(path)
         except IOError:
-            print("Cannot open filename: " + filename)
-            return
-        for line in f:
-            cols = line.split('\t')
-            if len(cols) < 2:
-                continue
-            self._keyDict.insertKey(cols[0], cols[1])
-        f.close()
-
-        self._keyDict.sortWordsWithCharsDict()
-
-        return
+            print("Cannot open filename: " + path)
+            return None
+        except ValueError as e:
+            print(str(e))
+            return None
+        kvStore = keyValueStore()
+        kvStore._keyDict = kd
+        return kvStore
@@ -0,0 +1,1099 @@
+# --------------------------------------------------------------------- #
+#  Benchmarks for the key value store. Run as:
+#     python kvBenchmarks.py <benchmark> [tsvFile] [numKeys]
+#  If the tsv file (word_search.tsv by default) cannot be opened, a
+#  synthetic dictionary of numKeys keys is generated instead
+# --------------------------------------------------------------------- #
+import asyncio
+import collections
+import gzip
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from BPDLMatrix import BPDLMatrix
+from BYSubString import BoyerMooreMatch, batchMatches
+from DLMatrix import DLMatrix
+from keyDict import keyDict
+from keyValStore import keyValueStore
+from kvServer import kvServer
+from kvUtils import kvUtils
+from tstNodePool import tstNodePool
+from tstSegmentNode import tstSegmentStore
+from tsvReader import tsvReader
+
+mainQueries = ["g", "ga", "gar", "gara", "garag", "garage", "i", "id", "idi", "idio",
+               "p", "pa", "par", "para", "e", "er", "ery", "eryx",
+               "p", "pa", "pat", "path", "pathe", "pathet", "pathetc", "pathect", "pathecti",
+               "patheti", "pathetic", "g", "gr", "grt", "grtn", "grtne", "grtnes", "grtness",
+               "graetness", "n", "ne", "nes", "ness"]
+
+
+# Read [key, value] pairs from a tsv file, or make up numKeys of them
+def loadBenchmarkKeys(filename, numKeys):
+    keyValPairs = []
+    try:
+        with open(filename, "r") as f:
+            for line in f:
+                cols = line.split('\t')
+                if len(cols) < 2:
+                    continue
+                keyValPairs.append([cols[0], int(cols[1])])
+                if len(keyValPairs) == numKeys:
+                    break
+        return keyValPairs
+    except IOError:
+        pass
+
+    rnd = random.Random(7)
+    syllables = ["a", "e", "i", "o", "u", "pa", "th", "tic", "gar", "age", "id", "io", "ne", "ss",
+                 "gr", "ea", "ry", "x", "in", "ing", "er", "s", "ma", "lo", "qu", "st", "ph"]
+    keys = set()
+    while len(keys) < numKeys:
+        numSyllables = rnd.choice([1, 2, 2, 3, 3, 4, 5])
+        keys.add("".join(rnd.choice(syllables) for i in range(numSyllables)))
+    for key in sorted(keys):
+        keyValPairs.append([key, int(10000 * rnd.paretovariate(1.1))])
+    return keyValPairs
+
+
+# Build a keyDict with the given node store and return it along with
+# the build time
+def buildKeyDict(keyValPairs, nodeStore=None):
+    start_time = time.time()
+    kd = keyDict(nodeStore)
+    for key, val in keyValPairs:
+        kd.insertKey(key, val)
+    end_time = time.time()
+    return kd, end_time - start_time
+
+
+# Build a keyDict under tracemalloc and return the bytes allocated from
+# the node modules, i.e. the memory held by the TST nodes alone
+def measureNodeMemory(keyValPairs, nodeStore=None):
+    tracemalloc.start()
+    kd, buildTime = buildKeyDict(keyValPairs, nodeStore)
+    snapshot = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    nodeFilter = [tracemalloc.Filter(True, "*tstNode.py"), tracemalloc.Filter(True, "*tstNodePool.py"),
+                  tracemalloc.Filter(True, "*tstSegmentNode.py")]
+    stats = snapshot.filter_traces(nodeFilter).statistics("filename")
+    return sum(stat.size for stat in stats)
+
+
+def toMB(numBytes):
+    return "%.1fMB" % (numBytes / (1024 * 1024))
+
+
+# Memory and build time of the object based TST against the tstNodePool
+def benchNodePool(keyValPairs):
+    kdObjects, objTime = buildKeyDict(keyValPairs)
+    kdPool, poolTime = buildKeyDict(keyValPairs, tstNodePool())
+    objMemory = measureNodeMemory(keyValPairs)
+    poolMemory = measureNodeMemory(keyValPairs, tstNodePool())
+    numNodes = kdPool.getNodeStore().numNodes()
+    print("Keys: " + str(len(keyValPairs)) + "  nodes: " + str(numNodes))
+    print("tstNode objects: build " + kvUtils.getTimeAsString(0, objTime) + "  node memory " + toMB(objMemory))
+    print("tstNodePool    : build " + kvUtils.getTimeAsString(0, poolTime) + "  node memory " + toMB(poolMemory))
+    for kd, name in [[kdObjects, "tstNode objects"], [kdPool, "tstNodePool    "]]:
+        start_time = time.time()
+        for query in mainQueries:
+            kd.searchKey(query)
+            kd.searchAllKeysWithPrefix(query, [], 25, {})
+            kd.searchKeyFuzzy(query, 2, 25, [], {})
+        end_time = time.time()
+        print(name + ": " + str(len(mainQueries)) + " queries in " + kvUtils.getTimeAsString(start_time, end_time))
+
+
+# Time the exact, prefix and fuzzy lookups of a query on a keyDict
+def timeQuery(kd, query, numRuns):
+    start_time = time.time()
+    for i in range(numRuns):
+        kd.searchKey(query)
+        kd.searchAllKeysWithPrefix(query, [], 25, {})
+        kd.searchKeyFuzzy(query, 2, 25, [], {})
+    end_time = time.time()
+    return (end_time - start_time) / numRuns
+
+
+# Time the recursive or the explicit stack traversals of a query on a
+# keyDict: the exact lookup, the first 25 keys with the query as prefix
+# and every key within edit distance 2 under the first char node, the
+# same algorithm either way. Returns the time of each
+def timeTraversals(kd, query, recursive, numRuns):
+    nodes = kd.getNodeStore()
+    root = kd.getRoot()
+    if recursive:
+        search = kd.recursiveSearch
+        searchPrefix = kd.recursiveSearchAllKeysWithPrefix
+        searchFuzzy = kd.recursiveSearchFuzzy
+    else:
+        search = kd.iterativeSearch
+        searchPrefix = kd.iterativeSearchAllKeysWithPrefix
+        searchFuzzy = kd.iterativeSearchFuzzy
+    beginNode = kd.findFirstNodeFromTop(root, query[0])
+    times = [0, 0, 0]
+    for i in range(numRuns):
+        start_time = time.time()
+        search(root, query, len(query), 0)
+        times[0] += time.time() - start_time
+        start_time = time.time()
+        searchPrefix(root, query, len(query), 0, 25, [])
+        times[1] += time.time() - start_time
+        if beginNode and len(query) > 1:
+            start_time = time.time()
+            thisDLMatrix = DLMatrix(query)
+            thisDLMatrix.insertChar(nodes.getChar(beginNode))
+            searchFuzzy(nodes.getDownNode(beginNode), 2, thisDLMatrix, [])
+            times[2] += time.time() - start_time
+    return [t / numRuns for t in times]
+
+
+# Per query latency of the recursive traversals against the explicit
+# stack ones on the main.py query set, then the totals of each lookup
+def benchTraversal(keyValPairs):
+    kd, buildTime = buildKeyDict(keyValPairs)
+    totalRecursive = [0, 0, 0]
+    totalIterative = [0, 0, 0]
+    print("query\trecursive\titerative\tspeedup")
+    for query in mainQueries:
+        recursiveTimes = timeTraversals(kd, query, True, 5)
+        iterativeTimes = timeTraversals(kd, query, False, 5)
+        for i in range(3):
+            totalRecursive[i] += recursiveTimes[i]
+            totalIterative[i] += iterativeTimes[i]
+        recursiveTime = sum(recursiveTimes)
+        iterativeTime = sum(iterativeTimes)
+        print(query + "\t" + kvUtils.getTimeAsString(0, recursiveTime) + "\t" +
+              kvUtils.getTimeAsString(0, iterativeTime) + "\t" + "%.2fx" % (recursiveTime / max(iterativeTime, 1e-9)))
+    for name, i in [["exact", 0], ["prefix", 1], ["fuzzy", 2]]:
+        print(name + "\t" + kvUtils.getTimeAsString(0, totalRecursive[i]) + "\t" +
+              kvUtils.getTimeAsString(0, totalIterative[i]) + "\t" +
+              "%.2fx" % (totalRecursive[i] / max(totalIterative[i], 1e-9)))
+    print("total\t" + kvUtils.getTimeAsString(0, sum(totalRecursive)) + "\t" +
+          kvUtils.getTimeAsString(0, sum(totalIterative)) + "\t" +
+          "%.2fx" % (sum(totalRecursive) / max(sum(totalIterative), 1e-9)))
+
+    # A key longer than the recursion limit
+    longKey = "a" * (sys.getrecursionlimit() + 100)
+    for recursive in [True, False]:
+        kd.setRecursiveTraversal(recursive)
+        try:
+            kd.insertKey(longKey, 1)
+            print("recursive=" + str(recursive) + ": long key found " + str(kd.searchKey(longKey)[0]))
+        except RecursionError:
+            print("recursive=" + str(recursive) + ": RecursionError on a " + str(len(longKey)) + " char key")
+
+
+# Build time, TST depth and query time of insertKey in file order against
+# bulkInsert
+def benchBulkLoad(keyValPairs):
+    kdSequential, sequentialTime = buildKeyDict(keyValPairs)
+    sequentialStats = kdSequential.getDepthStats()
+    kdBulk = keyDict()
+    bulkStats = kdBulk.bulkInsert(keyValPairs)
+    print("build\ttime\tmax depth\tavg key depth\tquery time")
+    for kd, name, buildTime, stats in [[kdSequential, "insertKey ", sequentialTime, sequentialStats],
+                                       [kdBulk, "bulkInsert", bulkStats["buildTime"], bulkStats]]:
+        queryTime = 0
+        for query in mainQueries:
+            queryTime += timeQuery(kd, query, 1)
+        print(name + "\t" + kvUtils.getTimeAsString(0, buildTime) + "\t" + str(stats["maxDepth"]) + "\t" +
+              "%.1f" % stats["avgKeyDepth"] + "\t" + kvUtils.getTimeAsString(0, queryTime))
+
+
+# Time to build a dictionary against opening it from a snapshot
+def benchSnapshot(keyValPairs):
+    kvStore = keyValueStore(compactNodes=True)
+    start_time = time.time()
+    for key, val in keyValPairs:
+        kvStore.insertKey(key, val)
+    end_time = time.time()
+    print("build from keys: " + kvUtils.getTimeAsString(start_time, end_time))
+
+    path = os.path.join(tempfile.mkdtemp(), "kv.snap")
+    start_time = time.time()
+    kvStore.save(path)
+    end_time = time.time()
+    print("save: " + kvUtils.getTimeAsString(start_time, end_time) + "  size " + toMB(os.path.getsize(path)))
+
+    start_time = time.time()
+    kvOpened = keyValueStore.open(path)
+    end_time = time.time()
+    print("open: " + kvUtils.getTimeAsString(start_time, end_time))
+    for query in ["pat", "pathetic", "eryx"]:
+        start_time = time.time()
+        kvOpened.findKeys(query, [])
+        end_time = time.time()
+        print("first query \"" + query + "\" on opened snapshot: " + kvUtils.getTimeAsString(start_time, end_time))
+    os.remove(path)
+
+
+# Number of nodes in the subtree below the node ending prefix
+def countPrefixSubTree(kd, prefix):
+    nodes = kd.getNodeStore()
+    node = kd.iterativeSearch(kd.getRoot(), prefix, len(prefix), 0)
+    numNodes = 0
+    stack = [nodes.getDownNode(node)] if node else []
+    while stack:
+        node = stack.pop()
+        if not node:
+            continue
+        numNodes += 1
+        stack.extend([nodes.getLeftNode(node), nodes.getDownNode(node), nodes.getRightNode(node)])
+    return numNodes
+
+
+# Best first top-k prefix search against enumerating the whole subtree and
+# sorting it by value
+def benchTopK(keyValPairs):
+    kd = keyDict()
+    kd.bulkInsert(keyValPairs)
+    print("prefix\tsubtree nodes\tenumerate+sort\tnodes expanded\tbest first")
+    for prefix in ["p", "g", "e", "a", "pa", "gr"]:
+        start_time = time.time()
+        nodeList = []
+        kd.iterativeSearchAllKeysWithPrefix(kd.getRoot(), prefix, len(prefix), 0, -1, nodeList)
+        nodeList.sort(key=lambda node: -kd.getNodeStore().getValue(node))
+        enumerated = [kd.getWord(node) for node in nodeList[:25]]
+        end_time = time.time()
+        enumerateTime = end_time - start_time
+
+        start_time = time.time()
+        nodeList = []
+        numExpanded = kd.bestFirstSearchAllKeysWithPrefix(kd.getRoot(), prefix, len(prefix), 25, nodeList)
+        bestFirst = [kd.getWord(node) for node in nodeList]
+        end_time = time.time()
+        if len(enumerated) != len(bestFirst):
+            print("Result mismatch for " + prefix)
+        print(prefix + "\t" + str(countPrefixSubTree(kd, prefix)) + "\t" +
+              kvUtils.getTimeAsString(0, enumerateTime) + "\t" + str(numExpanded) + "\t" +
+              kvUtils.getTimeAsString(start_time, end_time))
+
+
+# Fuzzy search collecting every key within distance 2 (the recursive
+# engine) against the iterative deepening one, unbounded and with a node
+# budget
+def benchBoundedFuzzy(keyValPairs):
+    kd = keyDict()
+    kd.bulkInsert(keyValPairs)
+    print("query\tcollect all\tbounded\tnodes expanded\tbudget 500 nodes\tkeys found")
+    for query in ["ga", "pa", "er", "gr", "ne", "garage", "pathetc", "grtness", "eryx"]:
+        kd.setRecursiveTraversal(True)
+        start_time = time.time()
+        kd.searchKeyFuzzy(query, 2, 25, [], {})
+        end_time = time.time()
+        collectAllTime = end_time - start_time
+        kd.setRecursiveTraversal(False)
+
+        start_time = time.time()
+        stats = kd.searchKeyFuzzy(query, 2, 25, [], {})
+        end_time = time.time()
+        boundedTime = end_time - start_time
+
+        keyList = []
+        start_time = time.time()
+        kd.searchKeyFuzzy(query, 2, 25, keyList, {}, maxNodes=500)
+        end_time = time.time()
+        print(query + "\t" + kvUtils.getTimeAsString(0, collectAllTime) + "\t" +
+              kvUtils.getTimeAsString(0, boundedTime) + "\t" + str(stats["nodesExpanded"]) + "\t" +
+              kvUtils.getTimeAsString(start_time, end_time) + "\t" + str(len(keyList)))
+
+
+# Row operations of DLMatrix against BPDLMatrix: every key is pushed char
+# by char against a query and popped again, as the fuzzy search does
+# along a TST path, then both engines run the fuzzy search end to end
+def benchBitParallel(keyValPairs):
+    keys = [key for key, val in keyValPairs[:20000]]
+    print("query\tDLMatrix rows\tBPDLMatrix rows\tDLMatrix search\tBPDLMatrix search")
+    kd = keyDict()
+    kd.bulkInsert(keyValPairs)
+    for query in ["ga", "garage", "pathetc", "grtness", "graetness"]:
+        rowTimes = []
+        for matrixClass in [DLMatrix, BPDLMatrix]:
+            start_time = time.time()
+            matrix = matrixClass(query)
+            for key in keys:
+                for c in key:
+                    matrix.insertChar(c)
+                    matrix.getEditDistForCharsSoFar()
+                matrix.getEditDistForWord()
+                for c in key:
+                    matrix.popChar()
+            end_time = time.time()
+            rowTimes.append(end_time - start_time)
+
+        searchTimes = []
+        results = []
+        for engine in ["dp", "bitparallel"]:
+            kd.setFuzzyEngine(engine)
+            keyList = []
+            start_time = time.time()
+            kd.searchKeyFuzzy(query, 2, 25, keyList, {})
+            end_time = time.time()
+            searchTimes.append(end_time - start_time)
+            results.append(keyList)
+        if results[0] != results[1]:
+            print("Result mismatch for " + query)
+        print(query + "\t" + "\t".join(kvUtils.getTimeAsString(0, t) for t in rowTimes + searchTimes))
+
+
+# Fuzzy search throughput of the three engines. The automaton is timed on
+# its first query (transitions still to be worked out) and once cached
+def benchAutomaton(keyValPairs):
+    kd = keyDict()
+    kd.bulkInsert(keyValPairs)
+    queries = ["garage", "pathetc", "grtness", "graetness", "eryx", "idiot", "parable"]
+    print("query\tdp\tbitparallel\tautomaton cold\tautomaton cached")
+    for query in queries:
+        times = []
+        for engine in ["dp", "bitparallel", "automaton"]:
+            kd.setFuzzyEngine(engine)
+            start_time = time.time()
+            kd.searchKeyFuzzy(query, 2, 25, [], {})
+            end_time = time.time()
+            times.append(end_time - start_time)
+        start_time = time.time()
+        for i in range(10):
+            kd.searchKeyFuzzy(query, 2, 25, [], {})
+        end_time = time.time()
+        times.append((end_time - start_time) / 10)
+        print(query + "\t" + "\t".join(kvUtils.getTimeAsString(0, t) for t in times))
+
+
+# Fuzzy search with a typo in the first char: recall and latency pinned to
+# the first char node against the search from the root, and the cost of
+# building the first char index
+def benchFirstChar(keyValPairs):
+    kd = keyDict()
+    kd.bulkInsert(keyValPairs)
+    rnd = random.Random(11)
+    queries = []
+    while len(queries) < 200:
+        key = rnd.choice(keyValPairs)[0]
+        if len(key) < 4:
+            continue
+        c = rnd.choice("abcdefghijklmnopqrstuvwxyz")
+        queries.append([key, rnd.choice([c + key[1:], key[1:], c + key, key[1] + key[0] + key[2:]])])
+
+    start_time = time.time()
+    kd.setFuzzyFromRoot(True)
+    end_time = time.time()
+    firstCharIndex = kd.getFirstCharIndex()
+    print("First char index: " + str(len(firstCharIndex)) + " variants, " +
+          str(sum(len(prefixes) for prefixes in firstCharIndex.values())) + " prefixes, built in " +
+          kvUtils.getTimeAsString(start_time, end_time))
+
+    print("mode\trecall\tavg latency\tavg nodes expanded")
+    for fromRoot in [False, True]:
+        kd.setFuzzyFromRoot(fromRoot)
+        numFound = 0
+        nodesExpanded = 0
+        start_time = time.time()
+        for key, query in queries:
+            keyList = []
+            stats = kd.searchKeyFuzzy(query, 2, 25, keyList, {})
+            nodesExpanded += stats["nodesExpanded"]
+            if key in [k for k, v in keyList]:
+                numFound += 1
+        end_time = time.time()
+        print(("root" if fromRoot else "pinned") + "\t" + "%.2f" % (numFound / len(queries)) + "\t" +
+              kvUtils.getTimeAsString(0, (end_time - start_time) / len(queries)) + "\t" +
+              str(nodesExpanded // len(queries)))
+
+
+# Latency of the "symspell" fuzzy engine against the recursive search for
+# deletion indexes of growing size: only keys up to maxKeyLength chars are
+# indexed and queries that could match longer keys go through the TST
+def benchSymSpell(keyValPairs):
+    kd = keyDict()
+    kd.bulkInsert(keyValPairs)
+    queries = ["ga", "pa", "er", "idi", "eryx", "garag", "garage", "pathetc", "grtness"]
+    kd.setRecursiveTraversal(True)
+    start_time = time.time()
+    for query in queries:
+        kd.searchKeyFuzzy(query, 2, 25, [], {})
+    end_time = time.time()
+    kd.setRecursiveTraversal(False)
+    print("recursiveSearchFuzzy: " + kvUtils.getTimeAsString(0, (end_time - start_time) / len(queries)) +
+          " per query")
+
+    print("maxKeyLength\tkeys indexed\tvariants\tpostings\tindex size\tbuild time\tper query\tqueries indexed")
+    for maxKeyLength in [6, 8, 10, 12]:
+        tracemalloc.start()
+        start_time = time.time()
+        kd.setSymSpellIndex(True, maxKeyLength)
+        end_time = time.time()
+        indexSize = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        buildTime = end_time - start_time
+
+        # The first queries after the build pay for cleaning up after
+        # tracemalloc, so they are run once before timing them
+        numIndexed = 0
+        for query in queries:
+            if kd.getSymSpellIndex().canSearch(query, 2):
+                numIndexed += 1
+            kd.searchKeyFuzzy(query, 2, 25, [], {}, engine="symspell")
+        start_time = time.time()
+        for query in queries:
+            kd.searchKeyFuzzy(query, 2, 25, [], {}, engine="symspell")
+        end_time = time.time()
+        stats = kd.getSymSpellIndex().getStats()
+        print(str(maxKeyLength) + "\t" + str(stats["numKeys"]) + "\t" + str(stats["numVariants"]) + "\t" +
+              str(stats["numPostings"]) + "\t" + toMB(indexSize) + "\t" + kvUtils.getTimeAsString(0, buildTime) +
+              "\t" + kvUtils.getTimeAsString(0, (end_time - start_time) / len(queries)) + "\t" +
+              str(numIndexed) + "/" + str(len(queries)))
+        kd.setSymSpellIndex(False)
+
+
+# Substring search through the n-gram index against the suffix array for
+# growing dictionaries. The n-gram index leaves out matches at the start of
+# a key, so the suffix array can find more keys
+def benchSuffixArray(keyValPairs):
+    queries = ["ga", "pa", "er", "ne", "ss", "idi", "ery", "ing", "ness", "path", "garage", "pathetic"]
+    print("keys\tsuffixes\tbuild time\tsize\tngram size\tngram per query\tsuffix array per query")
+    numKeys = len(keyValPairs) // 8
+    while numKeys > 0:
+        kd = keyDict()
+        kd.bulkInsert(keyValPairs[:numKeys])
+        start_time = time.time()
+        for query in queries:
+            kd.searchSubstringKeys(query, [], 25, {})
+        end_time = time.time()
+        ngramTime = (end_time - start_time) / len(queries)
+
+        start_time = time.time()
+        kd.setSuffixArrayIndex(True)
+        end_time = time.time()
+        buildTime = end_time - start_time
+        start_time = time.time()
+        for query in queries:
+            kd.searchSubstringKeys(query, [], 25, {})
+        end_time = time.time()
+        stats = kd.getSuffixArrayIndex().getStats()
+        print(str(numKeys) + "\t" + str(stats["numSuffixes"]) + "\t" + kvUtils.getTimeAsString(0, buildTime) +
+              "\t" + toMB(stats["numBytes"]) + "\t" + toMB(kd.getNgramIndex().getStats()["numBytes"]) + "\t" +
+              kvUtils.getTimeAsString(0, ngramTime) + "\t" +
+              kvUtils.getTimeAsString(0, (end_time - start_time) / len(queries)))
+        if numKeys == len(keyValPairs):
+            break
+        numKeys = min(2 * numKeys, len(keyValPairs))
+
+
+# Checking the substring candidates of the n-gram index one by one with a
+# BoyerMooreMatch against all at once with batchMatches
+def benchBatchVerify(keyValPairs):
+    kd = keyDict()
+    kd.bulkInsert(keyValPairs)
+    table = kd.getKeyTable()
+    print("pattern\tcandidates\tmatches\tBoyerMooreMatch\tbatchMatches")
+    for pattern in ["er", "in", "ss", "ing", "ness", "path", "ation", "pathetic"]:
+        keys = [table.getKey(keyId) for keyId in kd.getNgramIndex().iterateRankedCandidates(pattern)]
+        start_time = time.time()
+        byMatch = BoyerMooreMatch(pattern)
+        perKey = [byMatch.matches(key) for key in keys]
+        end_time = time.time()
+        perKeyTime = end_time - start_time
+        start_time = time.time()
+        mask = batchMatches(pattern, keys)
+        end_time = time.time()
+        if mask != perKey:
+            print("Result mismatch for " + pattern)
+        print(pattern + "\t" + str(len(keys)) + "\t" + str(sum(mask)) + "\t" +
+              kvUtils.getTimeAsString(0, perKeyTime) + "\t" + kvUtils.getTimeAsString(start_time, end_time))
+
+
+# Throughput of findKeysBatch against findKeys in a loop for 10k queries:
+# typeahead bursts over random keys, a few of them with a typo, and the
+# main queries repeated
+def benchBatchQueries(keyValPairs):
+    kv = keyValueStore()
+    for key, val in keyValPairs:
+        kv.insertKey(key, val)
+    rnd = random.Random(11)
+    queries = list(mainQueries)
+    while len(queries) < 10000:
+        key = rnd.choice(keyValPairs)[0]
+        if rnd.random() < 0.3:
+            i = rnd.randrange(len(key))
+            key = key[:i] + rnd.choice("aeiourst") + key[i + 1:]
+        for i in range(1, len(key) + 1):
+            queries.append(key[:i])
+    queries = queries[:10000]
+
+    start_time = time.time()
+    loopResults = []
+    for query in queries:
+        keyList = []
+        kv.findKeys(query, keyList)
+        loopResults.append(keyList)
+    end_time = time.time()
+    loopTime = end_time - start_time
+    start_time = time.time()
+    batchResults = kv.findKeysBatch(queries)
+    end_time = time.time()
+    if loopResults != batchResults:
+        print("Result mismatch")
+    print(str(len(queries)) + " queries, " + str(len(set(queries))) + " distinct")
+    print("findKeys loop: " + kvUtils.getTimeAsString(0, loopTime) + " (%.0f queries/s)" % (len(queries) / loopTime))
+    print("findKeysBatch: " + kvUtils.getTimeAsString(start_time, end_time) +
+          " (%.0f queries/s)" % (len(queries) / (end_time - start_time)))
+
+
+# Per keystroke latency of a typeahead session against a fresh findKeys
+# for every prefix, over the main queries and random keys typed out
+def benchSession(keyValPairs):
+    kv = keyValueStore()
+    for key, val in keyValPairs:
+        kv.insertKey(key, val)
+    rnd = random.Random(13)
+    words = ["garage", "idiot", "paragraph", "eryx", "pathetic", "pathectic", "greatness", "grtness"]
+    for i in range(40):
+        words.append(rnd.choice(keyValPairs)[0])
+
+    numKeystrokes = 0
+    freshTime = 0
+    sessionTime = 0
+    numMismatches = 0
+    for word in words:
+        session = kv.session()
+        for i in range(len(word)):
+            start_time = time.time()
+            keyList = []
+            kv.findKeys(word[:i + 1], keyList)
+            end_time = time.time()
+            freshTime += end_time - start_time
+            start_time = time.time()
+            sessionKeys = session.extend(word[i])
+            end_time = time.time()
+            sessionTime += end_time - start_time
+            numKeystrokes += 1
+            if sessionKeys != keyList:
+                numMismatches += 1
+    if numMismatches > 0:
+        print("Result mismatch for " + str(numMismatches) + " keystrokes")
+    print(str(numKeystrokes) + " keystrokes")
+    print("fresh findKeys: " + kvUtils.getTimeAsString(0, freshTime / numKeystrokes) + " per keystroke")
+    print("session.extend: " + kvUtils.getTimeAsString(0, sessionTime / numKeystrokes) + " per keystroke")
+
+
+# findKeys with and without the result cache on a skewed stream of
+# queries, prefixes of random keys picked with a Zipf like distribution,
+# with one insert per 100 queries
+def benchResultCache(keyValPairs):
+    rnd = random.Random(17)
+    numInitial = len(keyValPairs) * 9 // 10
+    queries = []
+    for i in range(2000):
+        key = rnd.choice(keyValPairs)[0]
+        queries.append(key[:rnd.randint(1, min(len(key), 6))])
+    weights = [1.0 / (i + 1) for i in range(len(queries))]
+    stream = rnd.choices(queries, weights, k=20000)
+
+    print("cache\tper query\thits\tmisses\tevictions\tinvalidations")
+    for enabled in [False, True]:
+        kv = keyValueStore()
+        for key, val in keyValPairs[:numInitial]:
+            kv.insertKey(key, val)
+        kv.setResultCache(enabled)
+        insertRnd = random.Random(19)
+        start_time = time.time()
+        for i in range(len(stream)):
+            if i % 100 == 99:
+                key, val = insertRnd.choice(keyValPairs[numInitial:])
+                kv.insertKey(key, val)
+            kv.findKeys(stream[i], [])
+        end_time = time.time()
+        line = ("on" if enabled else "off") + "\t" + kvUtils.getTimeAsString(0, (end_time - start_time) / len(stream))
+        stats = kv.getResultCacheStats()
+        if stats is not None:
+            line += "\t" + str(stats["hits"]) + "\t" + str(stats["misses"]) + "\t" + str(stats["evictions"]) + \
+                    "\t" + str(stats["invalidations"])
+        print(line)
+
+
+# findKeys latency of 1 to 3 char queries with hot prefix tables of
+# growing prefix length, along with their build time and size, and the
+# cost of keeping them up to date on insert
+def benchHotPrefix(keyValPairs):
+    kv = keyValueStore()
+    numInitial = len(keyValPairs) * 9 // 10
+    for key, val in keyValPairs[:numInitial]:
+        kv.insertKey(key, val)
+    rnd = random.Random(23)
+    queries = []
+    for i in range(2000):
+        key = rnd.choice(keyValPairs[:numInitial])[0]
+        queries.append(key[:rnd.randint(1, min(len(key), 3))])
+    inserts = keyValPairs[numInitial:numInitial + 2000]
+
+    print("prefix length\tprefixes\tsize\tbuild time\tper query\tper insert")
+    for maxPrefixLength in [0, 1, 2, 3]:
+        start_time = time.time()
+        kv.setHotPrefixTable(maxPrefixLength)
+        end_time = time.time()
+        buildTime = end_time - start_time
+        start_time = time.time()
+        for query in queries:
+            kv.findKeys(query, [])
+        end_time = time.time()
+        queryTime = (end_time - start_time) / len(queries)
+        start_time = time.time()
+        for key, val in inserts:
+            kv.insertKey(key, val)
+        end_time = time.time()
+        stats = kv.getHotPrefixStats()
+        if stats is None:
+            stats = {"numPrefixes": 0, "numBytes": 0}
+        print(str(maxPrefixLength) + "\t" + str(stats["numPrefixes"]) + "\t" + toMB(stats["numBytes"]) + "\t" +
+              kvUtils.getTimeAsString(0, buildTime) + "\t" + kvUtils.getTimeAsString(0, queryTime) + "\t" +
+              kvUtils.getTimeAsString(0, (end_time - start_time) / len(inserts)))
+
+
+# Load generator for the kvServer: keeps 4 queries per worker in flight
+# and reports the throughput and latency percentiles for growing numbers
+# of worker processes
+def benchServer(keyValPairs):
+    kvStore = keyValueStore(compactNodes=True)
+    for key, val in keyValPairs:
+        kvStore.insertKey(key, val)
+    path = os.path.join(tempfile.mkdtemp(), "kv.snap")
+    kvStore.save(path)
+    rnd = random.Random(29)
+    queries = list(mainQueries)
+    while len(queries) < 4000:
+        key = rnd.choice(keyValPairs)[0]
+        queries.append(key[:rnd.randint(1, len(key))])
+
+    numCores = os.cpu_count() or 1
+    workerCounts = [1]
+    while workerCounts[-1] < max(numCores, 4):
+        workerCounts.append(workerCounts[-1] * 2)
+    print(str(numCores) + " cores")
+    print("workers\tqueries/s\tp50\tp99")
+    for numWorkers in workerCounts:
+        server = kvServer(path, numWorkers)
+        server.start()
+        for query in mainQueries:
+            server.submit(query).result()
+        latencies = []
+        inFlight = collections.deque()
+        start_time = time.time()
+        for query in queries:
+            if len(inFlight) >= 4 * numWorkers:
+                inFlight.popleft().result()
+            future = server.submit(query)
+            future.add_done_callback(lambda f, t=time.time(): latencies.append(time.time() - t))
+            inFlight.append(future)
+        for future in inFlight:
+            future.result()
+        end_time = time.time()
+        server.stop()
+        latencies.sort()
+        print(str(numWorkers) + "\t" + "%.0f" % (len(queries) / (end_time - start_time)) + "\t" +
+              kvUtils.getTimeAsString(0, latencies[len(latencies) // 2]) + "\t" +
+              kvUtils.getTimeAsString(0, latencies[len(latencies) * 99 // 100]))
+
+
+# Build time of parallelBulkInsert against the number of worker processes,
+# with the time spent in the process pool; 1 worker is the plain bulkInsert
+def benchParallelBuild(keyValPairs):
+    numCores = os.cpu_count() or 1
+    workerCounts = [1]
+    while workerCounts[-1] < max(numCores, 4):
+        workerCounts.append(workerCounts[-1] * 2)
+    print(str(numCores) + " cores")
+    print("workers\tshards\tbuild time\tin the process pool")
+    for numWorkers in workerCounts:
+        kd = keyDict(tstNodePool())
+        stats = kd.parallelBulkInsert(keyValPairs, numWorkers)
+        print(str(numWorkers) + "\t" + str(stats.get("numShards", 1)) + "\t" +
+              kvUtils.getTimeAsString(0, stats["buildTime"]) + "\t" +
+              kvUtils.getTimeAsString(0, stats.get("shardTime", 0)))
+
+
+# findKeysAsync with per query timeouts: 8 queries in flight on the event
+# loop, reporting the latency percentiles, the share of complete answers
+# and the number of keys returned, along with the largest delay of a
+# ticker coroutine waking up every millisecond on the same loop
+def benchAsync(keyValPairs):
+    kv = keyValueStore()
+    for key, val in keyValPairs:
+        kv.insertKey(key, val)
+    rnd = random.Random(31)
+    queries = list(mainQueries)
+    while len(queries) < 1000:
+        key = rnd.choice(keyValPairs)[0]
+        query = list(key[:rnd.randint(1, len(key))])
+        if len(query) > 2:
+            query[rnd.randrange(len(query))] = rnd.choice("abcdefghijklmnopqrstuvwxyz")
+        queries.append("".join(query))
+
+    async def runQueries(timeout, blocking=False):
+        latencies = []
+        numComplete = 0
+        numKeys = 0
+        maxLag = 0
+        running = True
+
+        async def ticker():
+            nonlocal maxLag
+            while running:
+                start_time = time.time()
+                await asyncio.sleep(0.001)
+                maxLag = max(maxLag, time.time() - start_time - 0.001)
+
+        async def runQuery(query):
+            nonlocal numComplete, numKeys
+            start_time = time.time()
+            if blocking:
+                # The search on the event loop thread, as a baseline for
+                # the loop lag of the executor
+                keyList = []
+                phases = kv.searchKeys(query, keyList)["phases"]
+                response = {"keys": keyList,
+                            "complete": all(status == "done" or status == "skipped" for status in phases.values())}
+            else:
+                response = await kv.findKeysAsync(query, timeout=timeout)
+            latencies.append(time.time() - start_time)
+            numKeys += len(response["keys"])
+            if response["complete"]:
+                numComplete += 1
+
+        tick = asyncio.ensure_future(ticker())
+        for i in range(0, len(queries), 8):
+            await asyncio.gather(*[runQuery(query) for query in queries[i:i + 8]])
+        running = False
+        await tick
+        latencies.sort()
+        print(("blocking" if blocking else "none" if timeout is None else kvUtils.getTimeAsString(0, timeout)) + "\t" +
+              kvUtils.getTimeAsString(0, latencies[len(latencies) // 2]) + "\t" +
+              kvUtils.getTimeAsString(0, latencies[len(latencies) * 99 // 100]) + "\t" +
+              "%.1f%%" % (100.0 * numComplete / len(queries)) + "\t" + "%.1f" % (numKeys / len(queries)) + "\t" +
+              kvUtils.getTimeAsString(0, maxLag))
+
+    print("timeout\tp50\tp99\tcomplete\tkeys\tloop lag")
+    asyncio.run(runQueries(None, True))
+    for timeout in [None, 0.05, 0.01, 0.002]:
+        asyncio.run(runQueries(timeout))
+
+
+# Parsing throughput of a tsv file: the line by line split of the old
+# readTsvFile against the tsvReader on the plain and the gzip file, with
+# the peak memory traced while parsing. The line by line parser holds all
+# the rows, the tsvReader one chunk of them
+def benchIngest(keyValPairs):
+    tmpDir = tempfile.mkdtemp()
+    path = os.path.join(tmpDir, "keys.tsv")
+    with open(path, "w") as f:
+        for key, val in keyValPairs:
+            f.write(key + "\t" + str(val) + "\n")
+    with open(path, "rb") as f, gzip.open(path + ".gz", "wb") as g:
+        g.write(f.read())
+
+    def parseLineByLine(filename):
+        keyValPairs = []
+        with open(filename, "r") as f:
+            for line in f:
+                cols = line.split('\t')
+                if len(cols) < 2:
+                    continue
+                keyValPairs.append([cols[0], int(cols[1])])
+        return len(keyValPairs)
+
+    def parseStreaming(filename):
+        numKeys = 0
+        for keys, vals in tsvReader(filename).iterateBatches():
+            numKeys += len(keys)
+        return numKeys
+
+    print("parser\trows/s\tpeak memory")
+    for name, parse, filename in [("line by line", parseLineByLine, path), ("tsvReader", parseStreaming, path),
+                                  ("tsvReader gzip", parseStreaming, path + ".gz")]:
+        start_time = time.time()
+        numKeys = parse(filename)
+        end_time = time.time()
+        # Traced apart, tracemalloc slowing down the parsing
+        tracemalloc.start()
+        parse(filename)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(name + "\t" + "%.0f" % (numKeys / (end_time - start_time)) + "\t" + toMB(peak))
+
+
+# Cost of a value refresh of growing size applied as a delta, through
+# updateValue and deleteKey with the write-ahead log, against building
+# the dictionary again from all the keys; then the compact into a new
+# snapshot which empties the log
+def benchDelta(keyValPairs):
+    start_time = time.time()
+    keyDict().bulkInsert(keyValPairs)
+    end_time = time.time()
+    rebuildTime = end_time - start_time
+    print("full rebuild: " + kvUtils.getTimeAsString(0, rebuildTime))
+
+    kv = keyValueStore()
+    for key, val in keyValPairs:
+        kv.insertKey(key, val)
+    tmpDir = tempfile.mkdtemp()
+    kv.openLog(os.path.join(tmpDir, "kv.log"))
+    rnd = random.Random(37)
+    print("changes\tdelta time\tper change\tlog bytes\tvs rebuild")
+    for numChanges in [100, 1000, 10000]:
+        changes = rnd.sample(keyValPairs, min(numChanges, len(keyValPairs)))
+        start_time = time.time()
+        for i in range(len(changes)):
+            if i % 10 == 9:
+                kv.deleteKey(changes[i][0])
+            else:
+                kv.updateValue(changes[i][0], rnd.randint(1, 1000000))
+        end_time = time.time()
+        deltaTime = end_time - start_time
+        print(str(len(changes)) + "\t" + kvUtils.getTimeAsString(0, deltaTime) + "\t" +
+              kvUtils.getTimeAsString(0, deltaTime / len(changes)) + "\t" +
+              str(kv.getLogStats()["numBytes"]) + "\t" + "%.1f%%" % (100.0 * deltaTime / rebuildTime))
+    start_time = time.time()
+    kv.compact(os.path.join(tmpDir, "kv.snap"))
+    end_time = time.time()
+    print("compact into a snapshot: " + kvUtils.getTimeAsString(start_time, end_time))
+    kv.closeLog()
+
+
+# Read latency under write load with versions on. Reader threads run
+# findKeys while a writer thread applies batches of changes: every batch
+# moves a window of stressWindow keys "zzzstress..." one key on (delete
+# the first, insert one after the last) and sets them all to the batch
+# number, along with value updates of other keys. A reader searching
+# "zzzstress" must get the whole window of one batch: a different number
+# of keys, a gap or mixed values would be a torn read. At the end the
+# store is checked against one built from scratch
+stressWindow = 8
+
+
+def benchConcurrent(keyValPairs, numReaders=4, duration=3.0):
+    kv = keyValueStore()
+    kv.setVersioned(True)
+    model = dict((key, val) for key, val in keyValPairs)
+    for i in range(stressWindow):
+        model["zzzstress%06d" % i] = 0
+    kv.applyChanges([("I", key, val) for key, val in model.items()])
+    rnd = random.Random(41)
+    queries = list(mainQueries)
+    while len(queries) < 1000:
+        key = rnd.choice(keyValPairs)[0]
+        queries.append(key[:rnd.randint(1, len(key))])
+
+    def checkWindow(keyList):
+        window = sorted(keyVal for keyVal in keyList if keyVal[0].startswith("zzzstress"))
+        if len(window) != stressWindow or len(set(keyVal[1] for keyVal in window)) != 1:
+            return False
+        first = int(window[0][0][9:])
+        return all(window[i][0] == "zzzstress%06d" % (first + i) for i in range(stressWindow))
+
+    def runReaders(withWriter):
+        stop = threading.Event()
+        latencies = []
+        counts = {"tornReads": 0, "errors": 0, "batches": 0}
+        writeTimes = []
+
+        def reader(seed):
+            readerRnd = random.Random(seed)
+            while not stop.is_set():
+                query = readerRnd.choice(queries)
+                if readerRnd.random() < 0.1:
+                    query = "zzzstress"
+                keyList = []
+                start_time = time.perf_counter()
+                try:
+                    kv.findKeys(query, keyList)
+                except Exception:
+                    counts["errors"] += 1
+                    continue
+                latencies.append(time.perf_counter() - start_time)
+                if query == "zzzstress" and not checkWindow(keyList):
+                    counts["tornReads"] += 1
+
+        def writer():
+            first = 0
+            batch = 0
+            while not stop.is_set():
+                batch += 1
+                changes = [("D", "zzzstress%06d" % first)]
+                del model["zzzstress%06d" % first]
+                first += 1
+                for i in range(first, first + stressWindow):
+                    key = "zzzstress%06d" % i
+                    op = "U" if key in model else "I"
+                    changes.append((op, key, batch))
+                    model[key] = batch
+                for i in range(8):
+                    key = rnd.choice(keyValPairs)[0]
+                    val = rnd.randint(1, 1000000)
+                    changes.append(("U", key, val))
+                    model[key] = val
+                start_time = time.perf_counter()
+                kv.applyChanges(changes)
+                writeTimes.append(time.perf_counter() - start_time)
+            counts["batches"] = batch
+
+        threads = [threading.Thread(target=reader, args=(seed,)) for seed in range(numReaders)]
+        if withWriter:
+            threads.append(threading.Thread(target=writer))
+        for thread in threads:
+            thread.start()
+        time.sleep(duration)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        latencies.sort()
+        line = (("with writer" if withWriter else "readers only") + "\t" + "%.0f" % (len(latencies) / duration) +
+                "\t" + kvUtils.getTimeAsString(0, latencies[len(latencies) // 2]) + "\t" +
+                kvUtils.getTimeAsString(0, latencies[len(latencies) * 99 // 100]) + "\t" +
+                kvUtils.getTimeAsString(0, latencies[-1]) + "\t" + "%.0f" % (counts["batches"] / duration) + "\t")
+        if writeTimes:
+            writeTimes.sort()
+            line += kvUtils.getTimeAsString(0, writeTimes[len(writeTimes) // 2])
+        else:
+            line += "-"
+        print(line + "\t" + str(counts["tornReads"]) + "\t" + str(counts["errors"]))
+
+    print("run\tqueries/s\tp50\tp99\tmax\tbatches/s\tbatch time\ttorn reads\terrors")
+    runReaders(False)
+    runReaders(True)
+
+    ref = keyValueStore()
+    ref.applyChanges([("I", key, val) for key, val in model.items()])
+    numDiffs = 0
+    for query in queries[:200] + ["zzzstress"]:
+        keyList = []
+        refKeyList = []
+        kv.findKeys(query, keyList)
+        ref.findKeys(query, refKeyList)
+        # Keys of equal value can come in another order from another TST
+        if (sorted(keyList, key=lambda keyVal: (-keyVal[1], keyVal[0])) !=
+                sorted(refKeyList, key=lambda keyVal: (-keyVal[1], keyVal[0]))):
+            numDiffs += 1
+    print("queries differing from a fresh build: " + str(numDiffs))
+
+
+# Long keys made by joining three keys with "/", like paths, and queries
+# on them: prefixes of two lengths and keys with a typo
+def makeLongKeys(keyValPairs):
+    rnd = random.Random(41)
+    longKeyVals = []
+    for i in range(min(len(keyValPairs), 50000)):
+        parts = [rnd.choice(keyValPairs)[0] for j in range(3)]
+        longKeyVals.append(["/".join(parts), rnd.randint(1, 1000000)])
+    longQueries = [key[:n] for key, val in rnd.sample(longKeyVals, 20) for n in (3, 12)]
+    longQueries += [key[:-2] + "x" + key[-1] for key, val in rnd.sample(longKeyVals, 10)]
+    return longKeyVals, longQueries
+
+
+# Memory and lookup latency of one char nodes against segment nodes (see
+# tstSegmentNode), on the keys and on long keys (see makeLongKeys). Every
+# lookup phase is timed on its own, as is getWord on the nodes of the
+# prefix results
+def benchRadix(keyValPairs):
+    longKeyVals, longQueries = makeLongKeys(keyValPairs)
+    for name, pairs, queries in [["keys", keyValPairs, mainQueries], ["long keys", longKeyVals, longQueries]]:
+        print(name + ": " + str(len(pairs)) + "  avg length " +
+              "%.1f" % (sum(len(key) for key, val in pairs) / max(len(pairs), 1)))
+        print("nodes\tcount\tmemory\tbuild\texact\tprefix\tfuzzy\tgetWord")
+        for nodeName, newStore in [["char", lambda: None], ["segment", tstSegmentStore]]:
+            kd, buildTime = buildKeyDict(pairs, newStore())
+            memory = measureNodeMemory(pairs, newStore())
+            times = [0.0, 0.0, 0.0, 0.0]
+            for query in queries:
+                start_time = time.time()
+                kd.searchKey(query)
+                times[0] += time.time() - start_time
+                start_time = time.time()
+                kd.searchAllKeysWithPrefix(query, [], 25, {})
+                times[1] += time.time() - start_time
+                start_time = time.time()
+                kd.searchKeyFuzzy(query, 2, 25, [], {})
+                times[2] += time.time() - start_time
+                nodeList = []
+                kd.bestFirstSearchAllKeysWithPrefix(kd.getRoot(), query, len(query), 25, nodeList)
+                start_time = time.time()
+                for node in nodeList:
+                    kd.getWord(node)
+                times[3] += time.time() - start_time
+            print(nodeName + "\t" + str(kd.getDepthStats()["numNodes"]) + "\t" + toMB(memory) + "\t" +
+                  kvUtils.getTimeAsString(0, buildTime) + "\t" +
+                  "\t".join(kvUtils.getTimeAsString(0, t) for t in times))
+
+
+# Cost of turning result nodes into keys: getWord on the nodes of the top
+# 25 prefix results of every query, repeated numRuns times, per key and
+# per char, for every node store on the keys and on long keys
+def benchGetWord(keyValPairs, numRuns=20):
+    longKeyVals, longQueries = makeLongKeys(keyValPairs)
+    for name, pairs, queries in [["keys", keyValPairs, mainQueries], ["long keys", longKeyVals, longQueries]]:
+        print(name + ": " + str(len(pairs)))
+        print("nodes\tnode memory\tresults\tper key\tper char\tprefix search")
+        for nodeName, newStore in [["tstNode", lambda: None], ["tstNodePool", tstNodePool],
+                                   ["segment", tstSegmentStore]]:
+            kd, buildTime = buildKeyDict(pairs, newStore())
+            memory = measureNodeMemory(pairs, newStore())
+            nodeList = []
+            for query in queries:
+                queryNodes = []
+                kd.bestFirstSearchAllKeysWithPrefix(kd.getRoot(), query, len(query), 25, queryNodes)
+                nodeList.extend(queryNodes)
+            numChars = sum(len(kd.getWord(node)) for node in nodeList)
+            start_time = time.time()
+            for i in range(numRuns):
+                for node in nodeList:
+                    kd.getWord(node)
+            end_time = time.time()
+            perKey = (end_time - start_time) / (numRuns * max(len(nodeList), 1))
+            perChar = (end_time - start_time) / (numRuns * max(numChars, 1))
+            start_time = time.time()
+            for query in queries:
+                kd.searchAllKeysWithPrefix(query, [], 25, {})
+            end_time = time.time()
+            print(nodeName + "\t" + toMB(memory) + "\t" + str(len(nodeList)) + "\t" +
+                  "%.2fus" % (perKey * 1e6) + "\t" + "%.3fus" % (perChar * 1e6) + "\t" +
+                  kvUtils.getTimeAsString(start_time, end_time))
+
+
+benchmarks = {
+    "nodepool": benchNodePool,
+    "traversal": benchTraversal,
+    "bulkload": benchBulkLoad,
+    "snapshot": benchSnapshot,
+    "topk": benchTopK,
+    "fuzzy": benchBoundedFuzzy,
+    "bitparallel": benchBitParallel,
+    "automaton": benchAutomaton,
+    "firstchar": benchFirstChar,
+    "symspell": benchSymSpell,
+    "suffixarray": benchSuffixArray,
+    "batchverify": benchBatchVerify,
+    "batch": benchBatchQueries,
+    "session": benchSession,
+    "cache": benchResultCache,
+    "hotprefix": benchHotPrefix,
+    "server": benchServer,
+    "parallelbuild": benchParallelBuild,
+    "async": benchAsync,
+    "ingest": benchIngest,
+    "delta": benchDelta,
+    "concurrent": benchConcurrent,
+    "radix": benchRadix,
+    "getword": benchGetWord,
+}
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in benchmarks:
+        print("Usage: python kvBenchmarks.py <" + "|".join(benchmarks) + "> [tsvFile] [numKeys]")
+        sys.exit(1)
+    tsvFile = sys.argv[2] if len(sys.argv) > 2 else "word_search.tsv"
+    numKeys = int(sys.argv[3]) if len(sys.argv) > 3 else 200000
+    benchmarks[sys.argv[1]](loadBenchmarkKeys(tsvFile, numKeys))
@@ -0,0 +1,118 @@
+# --------------------------------------------------------------------- #
+#  Append-only write-ahead log of the changes made to a keyValueStore
+#  since its last snapshot. A change is written to the log before it is
+#  applied, one tab separated record per line:
+#     I key value    insertKey
+#     U key value    updateValue
+#     D key          deleteKey
+#  Opening a store with its log replays the records on top of the
+#  snapshot. A crash in the middle of a write leaves a partial last line,
+#  which replay skips and open cuts off. Compacting the store into a new
+#  snapshot empties the log, so it only ever holds the delta since the
+#  snapshot
+# --------------------------------------------------------------------- #
+import os
+
+
+class kvLog:
+    # With syncWrites set every record is fsynced before the change is
+    # applied; otherwise it is only flushed to the OS
+    def __init__(self, path, syncWrites=False):
+        self._path = path
+        self._syncWrites = syncWrites
+        self._file = None
+        self._numRecords = 0
+        # Size of the complete records at the start of the file
+        self._validSize = 0
+
+    def getPath(self):
+        return self._path
+
+    # Generator of the [op, key, value] records in the log, value None for
+    # deletes. A missing log has none. Raises IOError if the log cannot be
+    # read and ValueError on a malformed record
+    def replay(self):
+        self._numRecords = 0
+        self._validSize = 0
+        if not os.path.exists(self._path):
+            return
+        with open(self._path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                cols = line[:-1].decode("utf-8").split("\t")
+                if cols[0] == "D" and len(cols) == 2:
+                    record = [cols[0], cols[1], None]
+                elif cols[0] in ("I", "U") and len(cols) == 3:
+                    record = [cols[0], cols[1], int(cols[2])]
+                else:
+                    raise ValueError("Malformed log record in " + self._path + ": " + repr(line))
+                self._validSize += len(line)
+                self._numRecords += 1
+                yield record
+
+    # Open the log for appending, cutting off a partial last record left by
+    # a crash. replay first, which finds where the complete records end
+    def open(self):
+        self._file = open(self._path, "ab")
+        if self._file.tell() > self._validSize:
+            self._file.truncate(self._validSize)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def append(self, op, key, val=None):
+        self.appendRecords([(op, key, val)])
+
+    # The lines of (op, key, value) records as bytes. Raises ValueError if
+    # one cannot be logged
+    @staticmethod
+    def encodeRecords(records):
+        lines = []
+        for op, key, val in records:
+            if op not in ("I", "U", "D"):
+                raise ValueError("Cannot log the change: " + repr(op))
+            if "\t" in key or "\n" in key:
+                raise ValueError("Cannot log a key with a tab or a newline: " + repr(key))
+            record = op + "\t" + key
+            if op != "D":
+                record += "\t" + str(int(val))
+            lines.append(record + "\n")
+        return "".join(lines).encode("utf-8")
+
+    # Append (op, key, value) records with one write, flush and fsync.
+    # Raises ValueError, writing none of them, if one cannot be logged
+    def appendRecords(self, records):
+        data = kvLog.encodeRecords(records)
+        self._file.write(data)
+        self._file.flush()
+        if self._syncWrites:
+            os.fsync(self._file.fileno())
+        self._validSize += len(data)
+        self._numRecords += len(records)
+
+    # Take the last records appended off the log again, for changes that
+    # could not be applied after all
+    def dropRecords(self, records):
+        self._validSize -= len(kvLog.encodeRecords(records))
+        self._numRecords -= len(records)
+        self._file.truncate(self._validSize)
+        self._file.flush()
+        if self._syncWrites:
+            os.fsync(self._file.fileno())
+
+    # Drop all records, once a snapshot holds their changes
+    def truncate(self):
+        self._file.truncate(0)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._validSize = 0
+        self._numRecords = 0
+
+    def numRecords(self):
+        return self._numRecords
+
+    def getSize(self):
+        return self._validSize
@@ -0,0 +1,131 @@
+# --------------------------------------------------------------------- #
+#  Query serving over several processes. A keyValueStore answers one
+#  query at a time under the GIL, so the server runs numWorkers worker
+#  processes, each opening the same snapshot (see kvSnapshot.py). The
+#  snapshot is memory mapped, so the workers share its pages through the
+#  page cache instead of each holding a copy of the dictionary, and a
+#  worker starts without building anything. Forking a process holding a
+#  built keyValueStore would share its pages only until the reference
+#  counts of the TST objects are touched.
+#  Queries go to the workers through one request queue, so an idle
+#  worker takes the next one, and the answers come back on a response
+#  queue read by a thread of the server, which completes the future of
+#  each query
+# --------------------------------------------------------------------- #
+import itertools
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future
+
+from keyValStore import keyValueStore
+
+
+# Main loop of a worker process: answer (request id, query) pairs until a
+# None comes along
+def serveQueries(path, settings, requests, responses):
+    kvStore = keyValueStore.open(path)
+    if kvStore is not None:
+        kvStore.setNumResults(settings["numResults"])
+        kvStore.setFuzzyBudget(settings["fuzzyMaxNodes"], settings["fuzzyMaxTime"])
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+        requestId, query = request
+        if kvStore is None:
+            responses.put((requestId, None, "Cannot open snapshot: " + path))
+            continue
+        try:
+            keyList = []
+            kvStore.findKeys(query, keyList)
+            responses.put((requestId, keyList, None))
+        except Exception as e:
+            responses.put((requestId, None, repr(e)))
+
+
+class kvServer:
+    def __init__(self, path, numWorkers=None, numResults=25, fuzzyMaxNodes=None, fuzzyMaxTime=None):
+        self._path = path
+        if numWorkers is None:
+            numWorkers = os.cpu_count() or 1
+        self._numWorkers = numWorkers
+        self._settings = {"numResults": numResults, "fuzzyMaxNodes": fuzzyMaxNodes, "fuzzyMaxTime": fuzzyMaxTime}
+        # Fork where there is fork, the workers then start without importing
+        # anything again
+        if "fork" in multiprocessing.get_all_start_methods():
+            self._context = multiprocessing.get_context("fork")
+        else:
+            self._context = multiprocessing.get_context()
+        self._workers = []
+        self._requests = None
+        self._responses = None
+        self._router = None
+        # request id -> future of the query
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._requestIds = itertools.count()
+
+    def getNumWorkers(self):
+        return self._numWorkers
+
+    def start(self):
+        if self._workers:
+            return
+        self._requests = self._context.Queue()
+        self._responses = self._context.Queue()
+        for i in range(self._numWorkers):
+            worker = self._context.Process(target=serveQueries,
+                                           args=(self._path, self._settings, self._requests, self._responses),
+                                           daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        self._router = threading.Thread(target=self.routeResponses, daemon=True)
+        self._router.start()
+
+    # Let the workers finish the queries sent so far and stop them
+    def stop(self):
+        if not self._workers:
+            return
+        for worker in self._workers:
+            self._requests.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._responses.put(None)
+        self._router.join()
+        self._workers = []
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+        for future in pending.values():
+            future.set_exception(RuntimeError("kvServer stopped"))
+
+    def routeResponses(self):
+        while True:
+            response = self._responses.get()
+            if response is None:
+                break
+            requestId, keyList, error = response
+            with self._lock:
+                future = self._pending.pop(requestId, None)
+            if future is None:
+                continue
+            if error is not None:
+                future.set_exception(RuntimeError(error))
+            else:
+                future.set_result(keyList)
+
+    # Send a query to the workers; returns a Future of its key list
+    def submit(self, query):
+        if not self._workers:
+            raise RuntimeError("kvServer is not started")
+        future = Future()
+        requestId = next(self._requestIds)
+        with self._lock:
+            self._pending[requestId] = future
+        self._requests.put((requestId, query))
+        return future
+
+    # Add the keys for a query to keyList, like keyValueStore.findKeys
+    def findKeys(self, query, keyList):
+        keyList.extend(self.submit(query).result())
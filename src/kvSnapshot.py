@@ -0,0 +1,258 @@
+# --------------------------------------------------------------------- #
+#  Binary snapshot of a keyDict. Layout (native byte order, little
+#  endian is recorded in the header and checked on open):
+#     - header: magic, format version, byte order, number of sections
+#       and the root node id
+#     - section table: name, offset and size of every section
+#     - sections, each starting on an 8 byte boundary:
+#         node table: one section per tstNodePool column
+#         key table: keyblob/keyoffs hold the keys as utf-8 text with
+#           their offsets in key id order, keyvals their values
+#         substring index: the ngramIndex columns (see ngramIndex.py)
+#         suffix array: the suffixArrayIndex columns, if it is turned on
+#  open memory maps the file and hands out memoryviews into it, so the
+#  pages are shared between all processes opening the same snapshot and
+#  nothing is decoded until a lookup needs it
+# --------------------------------------------------------------------- #
+import mmap
+import struct
+import sys
+from array import array
+
+from keyDict import keyDict
+from ngramIndex import ngramIndex
+from suffixArrayIndex import suffixArrayIndex
+from tstNodePool import tstNodePool
+
+SNAPSHOT_MAGIC = b"KVSTSNAP"
+# The one format version open reads
+SNAPSHOT_VERSION = 4
+
+headerFormat = "<8sIIIq"
+sectionFormat = "<16sQQ"
+
+
+# --------------------------------------------------------------------- #
+#  Read-only keyTable served from the snapshot sections
+# --------------------------------------------------------------------- #
+class snapshotKeyTable:
+    def __init__(self, mm, sections):
+        self._mm = mm
+        self._keyStart = sections["keyblob.offset"]
+        self._keyOffs = sections["keyoffs"]
+        self._keyVals = sections["keyvals"]
+        # key -> key id, decoded on first use
+        self._keyIds = None
+
+    # Nothing changes in a snapshot, so all versions can share the table
+    def newVersion(self):
+        return self
+
+    def addKey(self, key, val):
+        raise TypeError("Cannot add keys to a read-only snapshot")
+
+    def setValue(self, keyId, val):
+        raise TypeError("Cannot change values in a read-only snapshot")
+
+    def deleteKey(self, keyId):
+        raise TypeError("Cannot delete keys from a read-only snapshot")
+
+    # Snapshots are written without deleted keys
+    def isDeleted(self, keyId):
+        return False
+
+    def numDeleted(self):
+        return 0
+
+    def getKeyId(self, key):
+        if self._keyIds is None:
+            self._keyIds = dict((self.getKey(keyId), keyId) for keyId in range(self.numKeys()))
+        return self._keyIds.get(key)
+
+    def getKey(self, keyId):
+        start = self._keyStart
+        return self._mm[start + self._keyOffs[keyId]:start + self._keyOffs[keyId + 1]].decode("utf-8")
+
+    def getValue(self, keyId):
+        return self._keyVals[keyId]
+
+    def numKeys(self):
+        return len(self._keyVals)
+
+
+# --------------------------------------------------------------------- #
+#  Saving and opening snapshots
+# --------------------------------------------------------------------- #
+class kvSnapshot:
+    # Flatten the nodes of the keyDict into tstNodePool columns; a pool is
+    # written out as it is, object nodes get ids in depth first order. A
+    # segment node (see tstSegmentNode) becomes a chain of one char nodes
+    # with consecutive ids: the left and right links hang off the first
+    # one, the word, the key id and the down link off the last one, so the
+    # snapshot opens as an ordinary pool
+    @staticmethod
+    def flattenNodes(kd):
+        nodes = kd.getNodeStore()
+        root = kd.getRoot()
+        if isinstance(nodes, tstNodePool):
+            return nodes.getColumns(), (root if root else 0)
+        segments = kd.hasSegments()
+
+        # id(node) -> id of its first char
+        nodeIds = {}
+        order = []
+        numIds = 0
+        stack = []
+        if root:
+            stack.append(root)
+        while stack:
+            node = stack.pop()
+            nodeIds[id(node)] = numIds + 1
+            order.append(node)
+            numIds += len(nodes.getSegment(node)) if segments else 1
+            for child in (nodes.getRightNode(node), nodes.getDownNode(node), nodes.getLeftNode(node)):
+                if child:
+                    stack.append(child)
+
+        columns = {}
+        for name, typeCode in tstNodePool.columnTypes:
+            columns[name] = array(typeCode, [0])
+
+        def nodeId(node):
+            if not node:
+                return 0
+            return nodeIds[id(node)]
+
+        for node in order:
+            firstId = nodeIds[id(node)]
+            chars = nodes.getSegment(node) if segments else nodes.getChar(node)
+            down = nodes.getDownNode(node)
+            # Max value below the first char, for the chars after it
+            chainMax = nodes.getValue(node) if nodes.hasWord(node) else 0
+            if down:
+                chainMax = max(chainMax, nodes.getMaxValue(down))
+            last = len(chars) - 1
+            for i, c in enumerate(chars):
+                columns["chars"].append(ord(c))
+                if i == 0:
+                    columns["left"].append(nodeId(nodes.getLeftNode(node)))
+                    columns["right"].append(nodeId(nodes.getRightNode(node)))
+                    columns["maxVal"].append(nodes.getMaxValue(node))
+                else:
+                    columns["left"].append(0)
+                    columns["right"].append(0)
+                    columns["maxVal"].append(chainMax)
+                if i < last:
+                    columns["down"].append(firstId + i + 1)
+                    columns["keyId"].append(0)
+                    columns["val"].append(0)
+                    columns["wordLength"].append(0)
+                    columns["hasWord"].append(0)
+                else:
+                    columns["down"].append(nodeId(down))
+                    columns["keyId"].append(nodes.getKeyId(node))
+                    columns["val"].append(nodes.getValue(node))
+                    columns["wordLength"].append(nodes.getWordLength(node))
+                    columns["hasWord"].append(1 if nodes.hasWord(node) else 0)
+        return columns, (1 if root else 0)
+
+    # Key table columns: the keys one after the other with their offsets
+    # and values, in key id order
+    @staticmethod
+    def flattenKeys(kd):
+        table = kd.getKeyTable()
+        keyBlob = bytearray()
+        keyOffs = array('Q', [0])
+        keyVals = array('q')
+        for keyId in range(table.numKeys()):
+            keyBlob += table.getKey(keyId).encode("utf-8")
+            keyOffs.append(len(keyBlob))
+            keyVals.append(table.getValue(keyId))
+        return {"keyblob": keyBlob, "keyoffs": keyOffs, "keyvals": keyVals}
+
+    # Write the keyDict to path. The substring indexes are brought up to
+    # date first, and a keyDict with deleted keys is compacted (see
+    # keyDict.compact) so their tombstones are not written
+    @staticmethod
+    def save(kd, path):
+        if kd.getKeyTable().numDeleted() > 0:
+            kd.compact()
+        columns, root = kvSnapshot.flattenNodes(kd)
+        sections = []
+        for name, typeCode in tstNodePool.columnTypes:
+            sections.append(["node." + name, columns[name]])
+        for name, data in kvSnapshot.flattenKeys(kd).items():
+            sections.append([name, data])
+        kd.sortWordsWithCharsDict()
+        for name, data in kd.getNgramIndex().getColumns().items():
+            sections.append([name, data])
+        if kd.getSuffixArrayIndex() is not None:
+            for name, data in kd.getSuffixArrayIndex().getColumns().items():
+                sections.append([name, data])
+
+        headerSize = struct.calcsize(headerFormat) + len(sections) * struct.calcsize(sectionFormat)
+        offset = (headerSize + 7) & ~7
+        table = []
+        for name, data in sections:
+            size = len(data) * (data.itemsize if hasattr(data, "itemsize") else 1)
+            table.append([name, offset, size])
+            offset = (offset + size + 7) & ~7
+
+        byteOrder = 1 if sys.byteorder == "little" else 2
+        with open(path, "wb") as f:
+            f.write(struct.pack(headerFormat, SNAPSHOT_MAGIC, SNAPSHOT_VERSION, byteOrder, len(sections), root))
+            for name, offset, size in table:
+                f.write(struct.pack(sectionFormat, name.encode("ascii"), offset, size))
+            for (name, data), (tableName, offset, size) in zip(sections, table):
+                f.write(b"\0" * (offset - f.tell()))
+                f.write(data.tobytes() if hasattr(data, "tobytes") else bytes(data))
+
+    # Memory map the snapshot at path and return a read-only keyDict on it
+    @staticmethod
+    def open(path):
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(mm) < struct.calcsize(headerFormat):
+            raise ValueError("Not a key value store snapshot: " + path)
+        magic, version, byteOrder, numSections, root = struct.unpack_from(headerFormat, mm, 0)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError("Not a key value store snapshot: " + path)
+        if version != SNAPSHOT_VERSION:
+            raise ValueError("Snapshot format version " + str(version) + " is not the supported " +
+                             str(SNAPSHOT_VERSION) + ": " + path)
+        if byteOrder != (1 if sys.byteorder == "little" else 2):
+            raise ValueError("Snapshot was written with a different byte order: " + path)
+
+        typeCodes = {"keyoffs": 'Q', "keyvals": 'q'}
+        for name, typeCode in tstNodePool.columnTypes:
+            typeCodes["node." + name] = typeCode
+        for name, typeCode in ngramIndex.columnTypes + suffixArrayIndex.columnTypes:
+            typeCodes[name] = typeCode
+        view = memoryview(mm)
+        sections = {}
+        pos = struct.calcsize(headerFormat)
+        for i in range(numSections):
+            name, offset, size = struct.unpack_from(sectionFormat, mm, pos)
+            pos += struct.calcsize(sectionFormat)
+            name = name.rstrip(b"\0").decode("ascii")
+            sections[name + ".offset"] = offset
+            if name in typeCodes:
+                sections[name] = view[offset:offset + size].cast(typeCodes[name])
+
+        columns = {}
+        for name, typeCode in tstNodePool.columnTypes:
+            columns[name] = sections["node." + name]
+        kd = keyDict(tstNodePool(columns))
+        kd.setRoot(root)
+        table = snapshotKeyTable(mm, sections)
+        ngramColumns = {}
+        for name, typeCode in ngramIndex.columnTypes:
+            ngramColumns[name] = sections[name]
+        suffixArray = None
+        if "satext" in sections:
+            suffixColumns = {}
+            for name, typeCode in suffixArrayIndex.columnTypes:
+                suffixColumns[name] = sections[name]
+            suffixArray = suffixArrayIndex(table, suffixColumns)
+        kd.setKeyIndexes(table, ngramIndex(table, ngramColumns), suffixArray)
+        return kd
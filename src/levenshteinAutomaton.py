@@ -0,0 +1,146 @@
+# --------------------------------------------------------------------- #
+#  Deterministic automaton for the Damerau-Levenshtein (optimal string
+#  alignment) distance to a fixed word, for a small maximum distance.
+#  A state stands for the DLMatrix rows reached after some chars: the
+#  last two rows with every cell capped at maxEditDist + 1 (larger
+#  values never come back under the limit), the previous char if it is
+#  in the word (for transpositions) and the number of chars read so far,
+#  capped where it stops mattering. Walking a TST edge is then a single
+#  table lookup. Transitions are worked out on first use and kept, so a
+#  cached automaton turns into a plain transition table over time; chars
+#  not in the word all behave the same and share one transition. A
+#  cached automaton is shared by the threads searching with it, so new
+#  states and transitions are added under a lock
+# --------------------------------------------------------------------- #
+import threading
+from collections import OrderedDict
+
+
+class levenshteinAutomaton:
+    # Constructor
+    def __init__(self, refWord, maxEditDist):
+        self._refWord = refWord
+        self._refLen = len(refWord)
+        self._maxEditDist = maxEditDist
+        self._cap = maxEditDist + 1
+        self._charCap = max(self._refLen, self._cap)
+        self._refChars = set(refWord)
+        # Per state: the state key, the transitions seen so far, the
+        # transition for chars not in refWord, and the same two numbers
+        # DLMatrix gives: getEditDistForWord and getEditDistForCharsSoFar
+        self._stateIds = {}
+        self._stateKeys = []
+        self._transitions = []
+        self._otherTransition = []
+        self._wordDist = []
+        self._charsSoFarDist = []
+        self._lock = threading.Lock()
+        firstRow = tuple(min(j, self._cap) for j in range(self._refLen + 1))
+        self._start = self.addState((None, firstRow, None, 0))
+
+    def addState(self, stateKey):
+        stateId = self._stateIds.get(stateKey)
+        if stateId is not None:
+            return stateId
+        stateId = len(self._stateKeys)
+        self._stateIds[stateKey] = stateId
+        self._stateKeys.append(stateKey)
+        self._transitions.append({})
+        self._otherTransition.append(None)
+        prevRow, row, prevChar, numChars = stateKey
+        self._wordDist.append(row[self._refLen] if numChars > 0 else 0)
+        self._charsSoFarDist.append(row[min(numChars, self._refLen)])
+        return stateId
+
+    # Work out the state after reading char c in state stateId, the way
+    # DLMatrix.insertChar works out the next row
+    def computeTransition(self, stateId, c):
+        prevRow, row, prevChar, numChars = self._stateKeys[stateId]
+        refWord = self._refWord
+        cap = self._cap
+        newRow = [min(numChars + 1, cap)]
+        for j in range(1, self._refLen + 1):
+            cost = 0 if refWord[j - 1] == c else 1
+            dij = min(row[j] + 1, newRow[j - 1] + 1, row[j - 1] + cost)
+            if j > 1 and prevChar is not None and c == refWord[j - 2] and prevChar == refWord[j - 1]:
+                dij = min(dij, prevRow[j - 2] + 1)
+            newRow.append(min(dij, cap))
+        if c not in self._refChars:
+            c = None
+        return self.addState((row, tuple(newRow), c, min(numChars + 1, self._charCap)))
+
+    def getStartState(self):
+        return self._start
+
+    # State after reading char c in state stateId
+    def step(self, stateId, c):
+        nextState = self._transitions[stateId].get(c)
+        if nextState is not None:
+            return nextState
+        with self._lock:
+            return self.addTransition(stateId, c)
+
+    def addTransition(self, stateId, c):
+        nextState = self._transitions[stateId].get(c)
+        if nextState is not None:
+            return nextState
+        if c in self._refChars:
+            nextState = self.computeTransition(stateId, c)
+            self._transitions[stateId][c] = nextState
+            return nextState
+        nextState = self._otherTransition[stateId]
+        if nextState is None:
+            nextState = self.computeTransition(stateId, c)
+            self._otherTransition[stateId] = nextState
+        self._transitions[stateId][c] = nextState
+        return nextState
+
+    # Edit distance of the chars read so far to refWord, capped at
+    # maxEditDist + 1
+    def getEditDistForWord(self, stateId):
+        return self._wordDist[stateId]
+
+    # The cell DLMatrix.getEditDistForCharsSoFar prunes the search on
+    def getEditDistForCharsSoFar(self, stateId):
+        return self._charsSoFarDist[stateId]
+
+    def numStates(self):
+        return len(self._stateKeys)
+
+    # Build every state reachable from the start up front
+    def compile(self):
+        chars = sorted(self._refChars) + [None]
+        todo = [self._start]
+        seen = {self._start}
+        while todo:
+            stateId = todo.pop()
+            for c in chars:
+                # Any char outside refWord stands for all of them
+                nextState = self.step(stateId, c if c is not None else "\0")
+                if nextState not in seen:
+                    seen.add(nextState)
+                    todo.append(nextState)
+        return self
+
+
+# --------------------------------------------------------------------- #
+#  Bounded cache of automata keyed on the word and the distance
+# --------------------------------------------------------------------- #
+class levenshteinAutomatonCache:
+    def __init__(self, maxEntries=1024):
+        self._maxEntries = maxEntries
+        self._automata = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, refWord, maxEditDist):
+        cacheKey = (refWord, maxEditDist)
+        with self._lock:
+            automaton = self._automata.get(cacheKey)
+            if automaton is None:
+                automaton = levenshteinAutomaton(refWord, maxEditDist)
+                self._automata[cacheKey] = automaton
+                if len(self._automata) > self._maxEntries:
+                    self._automata.popitem(last=False)
+            else:
+                self._automata.move_to_end(cacheKey)
+        return automaton
@@ -0,0 +1,310 @@
+# --------------------------------------------------------------------- #
+#  Inverted index from the bigrams and trigrams of the keys to the keys
+#  containing them, for the substring search. Keys are referred to by
+#  their id in a keyTable and every gram starting after the first char
+#  of a key is indexed. finalize ranks all keys by value (largest first)
+#  and keeps the posting list of a gram as the sorted ranks of its keys,
+#  so walking a list gives its keys in value order. The ranks are delta
+#  and varint coded in blocks of postingBlockSize; the first rank of
+#  every block is kept uncoded, so intersecting lists only decodes the
+#  blocks that can hold a rank. All the posting lists share a few flat
+#  columns, which are written to snapshots as they are:
+#     gramblob/gramoffs: the grams in sorted order as utf-8 text
+#     gramblocks: first block of every gram, gramcounts: list lengths
+#     blockheads/blockoffs: first rank and offset in postblob of every
+#       block, postblob: the varint coded rank deltas
+#     rankkeys: key id of every rank
+#  Keys added after finalize wait in plain lists of key ids until the
+#  next finalize, and so do the keys whose value changed, which would be
+#  out of order in the ranked lists. finalize also drops the deleted keys
+#  of the keyTable. A new version of the index (see newVersion) shares
+#  the columns and copies a pending list the first time it adds to it
+# --------------------------------------------------------------------- #
+import copy
+from array import array
+from bisect import bisect_right
+
+postingBlockSize = 64
+
+
+# The grams indexed for a key: bigrams and trigrams from the second char on
+def getGramsOfKey(key):
+    grams = set()
+    for i in range(1, len(key) - 1):
+        grams.add(key[i:i + 2])
+        if i + 3 <= len(key):
+            grams.add(key[i:i + 3])
+    return grams
+
+
+# The grams every key containing pattern has: the pattern itself if it is a
+# bigram, else all its trigrams
+def getGramsOfPattern(pattern):
+    if len(pattern) == 2:
+        return [pattern]
+    grams = []
+    for i in range(len(pattern) - 2):
+        gram = pattern[i:i + 3]
+        if gram not in grams:
+            grams.append(gram)
+    return grams
+
+
+def encodeVarint(n, out):
+    while n >= 0x80:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+# Ranks of a block: the first one followed by the coded deltas
+def decodeBlock(codes, first):
+    ranks = [first]
+    rank = first
+    n = 0
+    shift = 0
+    for b in codes:
+        if b & 0x80:
+            n |= (b & 0x7f) << shift
+            shift += 7
+        else:
+            rank += n | (b << shift)
+            ranks.append(rank)
+            n = 0
+            shift = 0
+    return ranks
+
+
+class ngramIndex:
+    # Names and array type codes of the columns
+    columnTypes = [("gramblob", 'B'), ("gramoffs", 'Q'), ("gramblocks", 'Q'), ("gramcounts", 'I'),
+                   ("blockheads", 'I'), ("blockoffs", 'Q'), ("postblob", 'B'), ("rankkeys", 'i')]
+
+    # Constructor; columns optionally holds the columns of a finalized
+    # index, e.g. memoryviews into a snapshot
+    def __init__(self, keys, columns=None):
+        self._keys = keys
+        if columns is None:
+            columns = {}
+            for name, typeCode in ngramIndex.columnTypes:
+                columns[name] = array(typeCode)
+            for name in ["gramoffs", "gramblocks", "blockoffs"]:
+                columns[name].append(0)
+        self.setColumns(columns)
+        # gram -> key ids added since the last finalize
+        self._pending = {}
+        # Whether keys or values changed since the last finalize
+        self._changed = False
+        # Key ids below this one were there at the last finalize
+        self._numRanked = len(self._rankKeys)
+        # Ids of the keys whose value changed since the last finalize
+        self._moved = set()
+        # Grams whose pending list a version made its own copy of, None
+        # when it owns all of them
+        self._ownPending = None
+
+    # The index for a new version of the key table (see keyTable.newVersion)
+    def newVersion(self, keys):
+        ngrams = copy.copy(self)
+        ngrams._keys = keys
+        ngrams._pending = dict(self._pending)
+        ngrams._moved = set(self._moved)
+        ngrams._ownPending = set()
+        return ngrams
+
+    # Pending list of gram to add key ids to, made if there is none
+    def getOwnPending(self, gram):
+        keyIds = self._pending.get(gram)
+        if keyIds is None:
+            keyIds = array('i')
+            self._pending[gram] = keyIds
+        elif self._ownPending is not None and gram not in self._ownPending:
+            keyIds = array('i', keyIds)
+            self._pending[gram] = keyIds
+        if self._ownPending is not None:
+            self._ownPending.add(gram)
+        return keyIds
+
+    def setColumns(self, columns):
+        self._columns = columns
+        self._gramBlob = columns["gramblob"]
+        self._gramOffs = columns["gramoffs"]
+        self._gramBlocks = columns["gramblocks"]
+        self._gramCounts = columns["gramcounts"]
+        self._blockHeads = columns["blockheads"]
+        self._blockOffs = columns["blockoffs"]
+        self._postBlob = columns["postblob"]
+        self._rankKeys = columns["rankkeys"]
+        # gram -> gram number, decoded on first use
+        self._gramIds = None
+
+    def getColumns(self):
+        return self._columns
+
+    def loadGrams(self):
+        if self._gramIds is not None:
+            return
+        gramIds = {}
+        for i in range(len(self._gramOffs) - 1):
+            gram = bytes(self._gramBlob[self._gramOffs[i]:self._gramOffs[i + 1]]).decode("utf-8")
+            gramIds[gram] = i
+        self._gramIds = gramIds
+
+    def getGramId(self, gram):
+        self.loadGrams()
+        return self._gramIds.get(gram)
+
+    def addKey(self, keyId):
+        for gram in getGramsOfKey(self._keys.getKey(keyId)):
+            self.getOwnPending(gram).append(keyId)
+        self._changed = True
+
+    # Add the key ids of keys having gram, as addKey would
+    def addPostings(self, gram, keyIds):
+        self.getOwnPending(gram).extend(keyIds)
+        self._changed = True
+
+    # A key was deleted, so the ranks are out of date
+    def markValuesChanged(self):
+        self._changed = True
+
+    # The value of a key changed, or it was added again after a delete. Its
+    # rank is out of date, so until the next finalize it is left out of the
+    # ranked lists and pending again, where it is checked by its value
+    # like a new key; the other keys keep their order
+    def updateKey(self, keyId):
+        self._changed = True
+        if keyId < self._numRanked and keyId not in self._moved:
+            self._moved.add(keyId)
+            self.addKey(keyId)
+
+    def decodeBlockOf(self, block):
+        codes = self._postBlob[self._blockOffs[block]:self._blockOffs[block + 1]]
+        return decodeBlock(codes, self._blockHeads[block])
+
+    # Ranks in the posting list of gram number gramId, in order
+    def iterateRanks(self, gramId):
+        for block in range(self._gramBlocks[gramId], self._gramBlocks[gramId + 1]):
+            for rank in self.decodeBlockOf(block):
+                yield rank
+
+    # Rank everything by value again and fold the pending lists into the
+    # posting lists. Deleted keys get no rank and leave the lists; a key
+    # added again after its delete can be in a list and pending at once
+    def finalize(self):
+        if not self._changed:
+            return
+        keys = self._keys
+        numKeys = keys.numKeys()
+        liveKeyIds = [keyId for keyId in range(numKeys) if not keys.isDeleted(keyId)]
+        rankKeys = array('i', sorted(liveKeyIds, key=lambda keyId: (-keys.getValue(keyId), keys.getKey(keyId))))
+        keyRanks = array('i', [-1]) * numKeys
+        for rank in range(len(rankKeys)):
+            keyRanks[rankKeys[rank]] = rank
+
+        self.loadGrams()
+        grams = sorted(set(self._gramIds) | set(self._pending))
+        gramBlob = bytearray()
+        gramOffs = array('Q', [0])
+        gramBlocks = array('Q', [0])
+        gramCounts = array('I')
+        blockHeads = array('I')
+        blockOffs = array('Q', [0])
+        postBlob = bytearray()
+        keptGrams = []
+        for gram in grams:
+            ranks = []
+            gramId = self._gramIds.get(gram)
+            if gramId is not None:
+                for rank in self.iterateRanks(gramId):
+                    ranks.append(keyRanks[self._rankKeys[rank]])
+            pending = self._pending.get(gram)
+            if pending is not None:
+                for keyId in pending:
+                    ranks.append(keyRanks[keyId])
+                if gramId is not None:
+                    ranks = list(set(ranks))
+            ranks.sort()
+            if ranks and ranks[0] == -1:
+                del ranks[:bisect_right(ranks, -1)]
+            if not ranks:
+                continue
+            keptGrams.append(gram)
+            for i in range(0, len(ranks), postingBlockSize):
+                blockHeads.append(ranks[i])
+                for j in range(i + 1, min(i + postingBlockSize, len(ranks))):
+                    encodeVarint(ranks[j] - ranks[j - 1], postBlob)
+                blockOffs.append(len(postBlob))
+            gramBlob += gram.encode("utf-8")
+            gramOffs.append(len(gramBlob))
+            gramBlocks.append(len(blockHeads))
+            gramCounts.append(len(ranks))
+
+        self.setColumns({"gramblob": array('B', gramBlob), "gramoffs": gramOffs, "gramblocks": gramBlocks,
+                         "gramcounts": gramCounts, "blockheads": blockHeads, "blockoffs": blockOffs,
+                         "postblob": array('B', postBlob), "rankkeys": rankKeys})
+        self._gramIds = dict((gram, i) for i, gram in enumerate(keptGrams))
+        self._pending = {}
+        self._ownPending = None
+        self._changed = False
+        self._numRanked = numKeys
+        self._moved = set()
+
+    # Key ids of the ranked keys having all the grams of pattern, largest
+    # value first. The shortest posting list is walked and every rank of it
+    # looked up in the other lists, decoding only the block it can be in
+    def iterateRankedCandidates(self, pattern):
+        gramIds = []
+        for gram in getGramsOfPattern(pattern):
+            gramId = self.getGramId(gram)
+            if gramId is None:
+                return
+            gramIds.append(gramId)
+        gramIds.sort(key=lambda gramId: self._gramCounts[gramId])
+        # Per other list: its range of blocks, the block decoded last and its ranks
+        others = []
+        for gramId in gramIds[1:]:
+            others.append([self._gramBlocks[gramId], self._gramBlocks[gramId + 1], -1, None])
+        for rank in self.iterateRanks(gramIds[0]):
+            found = True
+            for other in others:
+                firstBlock, endBlock, block, ranks = other
+                inBlock = bisect_right(self._blockHeads, rank, firstBlock, endBlock) - 1
+                if inBlock < firstBlock:
+                    found = False
+                    break
+                if inBlock != block:
+                    ranks = set(self.decodeBlockOf(inBlock))
+                    other[2] = inBlock
+                    other[3] = ranks
+                if rank not in ranks:
+                    found = False
+                    break
+            if found and self._rankKeys[rank] not in self._moved:
+                yield self._rankKeys[rank]
+
+    # Key ids added since the last finalize having all the grams of pattern
+    def getPendingCandidates(self, pattern):
+        candidates = None
+        for gram in getGramsOfPattern(pattern):
+            keyIds = self._pending.get(gram)
+            if keyIds is None:
+                return []
+            if candidates is None:
+                candidates = set(keyIds)
+            else:
+                candidates.intersection_update(keyIds)
+        if candidates is None:
+            return []
+        return list(candidates)
+
+    # Number of grams, postings and bytes of the coded posting lists
+    def getStats(self):
+        numPostings = 0
+        for count in self._gramCounts:
+            numPostings += count
+        numBytes = 0
+        for column in self._columns.values():
+            numBytes += len(column) * column.itemsize
+        return {"numGrams": len(self._gramCounts), "numPostings": numPostings, "numBytes": numBytes,
+                "numPendingGrams": len(self._pending)}
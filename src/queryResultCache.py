@@ -0,0 +1,150 @@
+# --------------------------------------------------------------------- #
+#  LRU cache of findKeys results, bounded by the number of entries and by
+#  an estimate of the bytes they hold. Entries are keyed on (query,
+#  numResults, fuzzy engine). A key inserted into the store can only
+#  change the results of the queries it matches in one of the phases of
+#  findKeys: the queries it contains (exact, prefix and substring
+#  matches) and those within edit distance 2 of it (fuzzy matches). The
+#  cache finds those without looking at every entry: the queries are
+#  indexed by themselves and by their deletion variants, like the
+#  symSpellIndex does for keys, so the substrings and the deletion
+#  variants of the inserted key are looked up
+# --------------------------------------------------------------------- #
+import sys
+from collections import OrderedDict
+
+from DLMatrix import DLMatrix
+from symSpellIndex import getDeletes
+
+# Largest edit distance of the fuzzy search
+cacheEditDist = 2
+
+
+def getEditDist(s1, s2):
+    if not s2:
+        return len(s1)
+    thisDLMatrix = DLMatrix(s1)
+    for c in s2:
+        thisDLMatrix.insertChar(c)
+    return thisDLMatrix.getEditDistForWord()
+
+
+class queryResultCache:
+    def __init__(self, maxEntries=10000, maxBytes=16 << 20):
+        self._maxEntries = maxEntries
+        self._maxBytes = maxBytes
+        # (query, numResults, engine) -> [keyList, queryStats, numBytes],
+        # least recently used first
+        self._entries = OrderedDict()
+        # query -> its cache keys
+        self._byQuery = {}
+        # deletion variant -> queries it comes from
+        self._deletes = {}
+        # Cache keys of the entries whose fuzzy search ran out of its budget
+        # and of those which went through the substring search
+        self._incomplete = set()
+        self._substring = set()
+        self._numBytes = 0
+        self._numHits = 0
+        self._numMisses = 0
+        self._numEvictions = 0
+        self._numInvalidations = 0
+
+    # The cached keyList and queryStats, None on a miss
+    def get(self, cacheKey):
+        entry = self._entries.get(cacheKey)
+        if entry is None:
+            self._numMisses += 1
+            return None
+        self._numHits += 1
+        self._entries.move_to_end(cacheKey)
+        return entry[0], entry[1]
+
+    def put(self, cacheKey, keyList, queryStats):
+        self.remove(cacheKey)
+        numBytes = sys.getsizeof(cacheKey[0]) + sys.getsizeof(keyList) + 200
+        for keyVal in keyList:
+            numBytes += sys.getsizeof(keyVal) + sys.getsizeof(keyVal[0]) + sys.getsizeof(keyVal[1])
+        if numBytes > self._maxBytes:
+            return
+        self._entries[cacheKey] = [keyList, queryStats, numBytes]
+        self._numBytes += numBytes
+        query = cacheKey[0]
+        cacheKeys = self._byQuery.get(query)
+        if cacheKeys is None:
+            cacheKeys = set()
+            self._byQuery[query] = cacheKeys
+            for variant in getDeletes(query, cacheEditDist):
+                queries = self._deletes.get(variant)
+                if queries is None:
+                    queries = set()
+                    self._deletes[variant] = queries
+                queries.add(query)
+        cacheKeys.add(cacheKey)
+        if queryStats["fuzzy"] is not None and queryStats["fuzzy"]["complete"] is False:
+            self._incomplete.add(cacheKey)
+        if queryStats["substring"] is True:
+            self._substring.add(cacheKey)
+        while len(self._entries) > self._maxEntries or self._numBytes > self._maxBytes:
+            self.remove(next(iter(self._entries)))
+            self._numEvictions += 1
+
+    def remove(self, cacheKey):
+        entry = self._entries.pop(cacheKey, None)
+        if entry is None:
+            return
+        self._numBytes -= entry[2]
+        self._incomplete.discard(cacheKey)
+        self._substring.discard(cacheKey)
+        query = cacheKey[0]
+        cacheKeys = self._byQuery[query]
+        cacheKeys.discard(cacheKey)
+        if cacheKeys:
+            return
+        del self._byQuery[query]
+        for variant in getDeletes(query, cacheEditDist):
+            queries = self._deletes[variant]
+            queries.discard(query)
+            if not queries:
+                del self._deletes[variant]
+
+    # Drop the entries key was inserted or changed under: those of the
+    # queries it contains or is within the fuzzy edit distance of. Entries
+    # whose fuzzy search ran out of its budget depend on the shape of the
+    # TST and are dropped too, as are the ones that went through the
+    # substring search with substringChanged set, e.g. when the insert made
+    # the suffix array stale
+    def invalidateKey(self, key, substringChanged=False):
+        queries = set()
+        for i in range(len(key)):
+            for j in range(i + 1, len(key) + 1):
+                if key[i:j] in self._byQuery:
+                    queries.add(key[i:j])
+        for variant in getDeletes(key, cacheEditDist):
+            for query in self._deletes.get(variant, ()):
+                if query not in queries and getEditDist(query, key) <= cacheEditDist:
+                    queries.add(query)
+        cacheKeys = list(self._incomplete)
+        if substringChanged:
+            cacheKeys.extend(self._substring)
+        for query in queries:
+            cacheKeys.extend(self._byQuery[query])
+        for cacheKey in cacheKeys:
+            if cacheKey in self._entries:
+                self.remove(cacheKey)
+                self._numInvalidations += 1
+
+    def clear(self):
+        self._entries.clear()
+        self._byQuery.clear()
+        self._deletes.clear()
+        self._incomplete.clear()
+        self._substring.clear()
+        self._numBytes = 0
+
+    # Number of entries, their estimated size and the hit, miss, eviction
+    # and invalidation counts
+    def getStats(self):
+        return {"numEntries": len(self._entries), "numBytes": self._numBytes, "hits": self._numHits,
+                "misses": self._numMisses, "evictions": self._numEvictions,
+                "invalidations": self._numInvalidations}
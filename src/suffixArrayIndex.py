@@ -0,0 +1,237 @@
+# --------------------------------------------------------------------- #
+#  Generalized suffix array over all the keys, for substring search at
+#  any offset. The keys are concatenated as utf-8 with a 0 byte after
+#  each one and the suffixes starting in a key are sorted up to the end
+#  of that key, so the suffixes beginning with a pattern form one range
+#  found with two binary searches. To get the keys with the largest
+#  values out of a large range without scanning it, the suffixes are
+#  grouped in blocks of suffixBlockSize and a max tree over the blocks
+#  holds the largest key value per block; the range is then searched
+#  best first like the prefix search does with the subtree max values.
+#  Columns, written to snapshots as they are:
+#     satext: the keys with separators, sapos: suffix start offsets in
+#     sorted order, sakeys: key id of every suffix, satree: the max tree
+#     (node i has children 2i and 2i + 1, the blocks are the leaves)
+#  The array is static; keys or values changing after the build make it
+#  stale until it is built again. Deleted keys are left out of the build
+# --------------------------------------------------------------------- #
+import copy
+import heapq
+from array import array
+
+suffixBlockSize = 32
+noValue = -(1 << 63)
+
+
+class suffixArrayIndex:
+    # Names and array type codes of the columns
+    columnTypes = [("satext", 'B'), ("sapos", 'I'), ("sakeys", 'i'), ("satree", 'q')]
+
+    # Constructor; columns optionally holds the columns of a built index,
+    # e.g. memoryviews into a snapshot
+    def __init__(self, keys, columns=None):
+        self._keys = keys
+        self._stale = False
+        if columns is None:
+            self.build()
+        else:
+            self.setColumns(columns)
+
+    def setColumns(self, columns):
+        self._columns = columns
+        self._text = columns["satext"]
+        self._pos = columns["sapos"]
+        self._keyIds = columns["sakeys"]
+        self._tree = columns["satree"]
+        self._treeSize = len(self._tree) // 2
+
+    def getColumns(self):
+        return self._columns
+
+    # The index for a new version of the key table (see keyTable.newVersion),
+    # sharing the columns until it is built again
+    def newVersion(self, keys):
+        index = copy.copy(self)
+        index._keys = keys
+        return index
+
+    def markStale(self):
+        self._stale = True
+
+    def isStale(self):
+        return self._stale
+
+    def build(self):
+        keys = self._keys
+        text = bytearray()
+        suffixStarts = array('I')
+        suffixEnds = array('I')
+        suffixKeys = array('i')
+        for keyId in range(keys.numKeys()):
+            if keys.isDeleted(keyId):
+                continue
+            keyBytes = keys.getKey(keyId).encode("utf-8")
+            start = len(text)
+            end = start + len(keyBytes)
+            for j in range(len(keyBytes)):
+                suffixStarts.append(start + j)
+                suffixEnds.append(end)
+                suffixKeys.append(keyId)
+            text += keyBytes
+            text.append(0)
+        text = bytes(text)
+
+        order = self.sortSuffixes(text, suffixStarts, suffixEnds)
+        pos = array('I', [0]) * len(order)
+        keyIds = array('i', [0]) * len(order)
+        for rank in range(len(order)):
+            i = order[rank]
+            pos[rank] = suffixStarts[i]
+            keyIds[rank] = suffixKeys[i]
+
+        numBlocks = (len(order) + suffixBlockSize - 1) // suffixBlockSize
+        treeSize = 1
+        while treeSize < numBlocks:
+            treeSize *= 2
+        tree = array('q', [noValue]) * (2 * treeSize)
+        for rank in range(len(order)):
+            leaf = treeSize + rank // suffixBlockSize
+            val = keys.getValue(keyIds[rank])
+            if val > tree[leaf]:
+                tree[leaf] = val
+        for node in range(treeSize - 1, 0, -1):
+            tree[node] = max(tree[2 * node], tree[2 * node + 1])
+
+        self.setColumns({"satext": array('B', text), "sapos": pos, "sakeys": keyIds, "satree": tree})
+        self._stale = False
+
+    # Indexes of the suffixes in sorted order, equal suffixes in index
+    # order. The suffixes are put in buckets by their first two bytes with a
+    # counting sort, and then the buckets are sorted one at a time on the
+    # rest of their suffixes, so only the suffixes of one bucket are copied
+    # out of the text at once. A suffix of one byte goes before the others
+    # starting with that byte, like a shorter string does
+    @staticmethod
+    def sortSuffixes(text, suffixStarts, suffixEnds):
+        numSuffixes = len(suffixStarts)
+        bucketOf = array('H', [0]) * numSuffixes
+        bucketStarts = [0] * 65537
+        for i in range(numSuffixes):
+            start = suffixStarts[i]
+            bucket = text[start] << 8
+            if start + 1 < suffixEnds[i]:
+                bucket |= text[start + 1]
+            bucketOf[i] = bucket
+            bucketStarts[bucket + 1] += 1
+        for bucket in range(65536):
+            bucketStarts[bucket + 1] += bucketStarts[bucket]
+
+        order = array('I', [0]) * numSuffixes
+        nextSlot = bucketStarts[:]
+        for i in range(numSuffixes):
+            bucket = bucketOf[i]
+            order[nextSlot[bucket]] = i
+            nextSlot[bucket] += 1
+        del bucketOf
+
+        for bucket in range(65536):
+            lo = bucketStarts[bucket]
+            hi = bucketStarts[bucket + 1]
+            if hi - lo > 1:
+                order[lo:hi] = array('I', sorted(order[lo:hi],
+                                                 key=lambda i: text[suffixStarts[i] + 2:suffixEnds[i]]))
+        return order
+
+    def getSuffix(self, rank, length):
+        start = self._pos[rank]
+        return bytes(self._text[start:start + length])
+
+    # [lo, hi) range of the suffixes starting with pattern. The search can
+    # be kept within the range of a prefix of pattern, as it lies in there
+    def findRange(self, pattern, lo=0, hi=None):
+        patternBytes = pattern.encode("utf-8")
+        patternLen = len(patternBytes)
+        if hi is None:
+            hi = len(self._pos)
+        end = hi
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.getSuffix(mid, patternLen) < patternBytes:
+                lo = mid + 1
+            else:
+                hi = mid
+        start = lo
+        hi = end
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.getSuffix(mid, patternLen) == patternBytes:
+                lo = mid + 1
+            else:
+                hi = mid
+        return start, lo
+
+    # Number of suffixes, i.e. of places a pattern can start at
+    def numSuffixes(self):
+        return len(self._pos)
+
+    # Key ids of the keys containing pattern, largest value first and each
+    # key once. The heap holds suffixes keyed by the value of their key and
+    # max tree nodes keyed by their max value, so only the blocks which can
+    # still hold the next largest value get opened. suffixRange is the range
+    # of pattern if it is known already
+    def iterateTopKeys(self, pattern, suffixRange=None):
+        if suffixRange is None:
+            suffixRange = self.findRange(pattern)
+        lo, hi = suffixRange
+        if lo >= hi:
+            return
+        keys = self._keys
+        tree = self._tree
+        treeSize = self._treeSize
+        # Entries are [-value, 0 for a suffix or 1 for a tree node, rank or node]
+        heap = []
+        firstBlock = (lo + suffixBlockSize - 1) // suffixBlockSize
+        endBlock = hi // suffixBlockSize
+        if firstBlock >= endBlock:
+            edges = [range(lo, hi)]
+        else:
+            edges = [range(lo, firstBlock * suffixBlockSize), range(endBlock * suffixBlockSize, hi)]
+            left = firstBlock + treeSize
+            right = endBlock + treeSize
+            while left < right:
+                if left & 1:
+                    heap.append((-tree[left], 1, left))
+                    left += 1
+                if right & 1:
+                    right -= 1
+                    heap.append((-tree[right], 1, right))
+                left //= 2
+                right //= 2
+        for ranks in edges:
+            for rank in ranks:
+                heap.append((-keys.getValue(self._keyIds[rank]), 0, rank))
+        heapq.heapify(heap)
+
+        seen = set()
+        while heap:
+            negVal, isNode, i = heapq.heappop(heap)
+            if not isNode:
+                keyId = self._keyIds[i]
+                if keyId not in seen:
+                    seen.add(keyId)
+                    yield keyId
+            elif i >= treeSize:
+                start = (i - treeSize) * suffixBlockSize
+                for rank in range(start, min(start + suffixBlockSize, len(self._pos))):
+                    heapq.heappush(heap, (-keys.getValue(self._keyIds[rank]), 0, rank))
+            else:
+                for child in (2 * i, 2 * i + 1):
+                    if tree[child] != noValue:
+                        heapq.heappush(heap, (-tree[child], 1, child))
+
+    # Number of suffixes and bytes of the columns
+    def getStats(self):
+        numBytes = 0
+        for column in self._columns.values():
+            numBytes += len(column) * column.itemsize
+        return {"numSuffixes": len(self._pos), "numBytes": numBytes}
@@ -0,0 +1,74 @@
+# --------------------------------------------------------------------- #
+#  Deletion index for the fuzzy search (SymSpell). Every key up to
+#  maxKeyLength chars is indexed under all the strings left after
+#  deleting up to maxEditDist of its chars. Two strings within edit
+#  distance d share such a deletion variant, so the candidates for a
+#  query are found with one lookup per deletion variant of the query
+#  and only those have to be checked with an edit distance matrix.
+#  Keys longer than maxKeyLength are left out to bound the memory, which
+#  is roughly numKeys * keyLength ^ maxEditDist / 2 postings; queries
+#  that could match them have to go through the TST instead
+# --------------------------------------------------------------------- #
+from array import array
+
+
+# The set of strings left after deleting up to maxEditDist chars of word,
+# word included
+def getDeletes(word, maxEditDist):
+    deletes = {word}
+    level = [word]
+    for d in range(maxEditDist):
+        nextLevel = []
+        for s in level:
+            for i in range(len(s)):
+                variant = s[:i] + s[i + 1:]
+                if variant not in deletes:
+                    deletes.add(variant)
+                    nextLevel.append(variant)
+        level = nextLevel
+    return deletes
+
+
+class symSpellIndex:
+    def __init__(self, maxEditDist=2, maxKeyLength=12):
+        self._maxEditDist = maxEditDist
+        self._maxKeyLength = maxKeyLength
+        # deletion variant -> ids of the keys it comes from
+        self._deletes = {}
+        self._numKeys = 0
+
+    def getMaxKeyLength(self):
+        return self._maxKeyLength
+
+    def addKey(self, key, keyId):
+        if len(key) > self._maxKeyLength:
+            return
+        for variant in getDeletes(key, self._maxEditDist):
+            postings = self._deletes.get(variant)
+            if postings is None:
+                postings = array('i')
+                self._deletes[variant] = postings
+            postings.append(keyId)
+        self._numKeys += 1
+
+    # Whether every key within editDist of query is in the index: keys
+    # longer than query + editDist chars are too far away anyway
+    def canSearch(self, query, editDist):
+        return editDist <= self._maxEditDist and len(query) + editDist <= self._maxKeyLength
+
+    # Ids of the keys which may be within editDist of query
+    def getCandidates(self, query, editDist):
+        candidates = set()
+        for variant in getDeletes(query, editDist):
+            postings = self._deletes.get(variant)
+            if postings is not None:
+                candidates.update(postings)
+        return candidates
+
+    # Number of keys indexed, of deletion variants and of key ids in their
+    # posting lists
+    def getStats(self):
+        numPostings = 0
+        for postings in self._deletes.values():
+            numPostings += len(postings)
+        return {"numKeys": self._numKeys, "numVariants": len(self._deletes), "numPostings": numPostings}
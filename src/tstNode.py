@@ -2,13 +2,21 @@
 #  Class for objects on the ternary search tree
 # --------------------------------------------------------------------- #
 class tstNode:
+    __slots__ = ('_char', '_numWords', '_maxWordLength', '_val', '_maxVal', '_keyId', '_linkLeft',
+                 '_linkRight', '_linkDown', '_hasWord', '_wordLength')
+
     # Constructor
     def __init__(self, nodeChar, numWords=0, maxWordLength=0):
         self._char = nodeChar
         self._numWords = numWords
         self._maxWordLength = maxWordLength
         self._val = 0
-        self._linkParent = None
+        # Largest value of any word in the subtree of this node, including
+        # the left and right siblings; an upper bound after overwrites
+        self._maxVal = 0
+        # Key table id of the word of this node, so the word is looked up
+        # instead of spelled out from the root
+        self._keyId = 0
         self._linkLeft = None
         self._linkRight = None
         self._linkDown = None
@@ -19,6 +27,9 @@ class tstNode:
     def setValue(self, val):
         self._val = val
 
+    def setMaxValue(self, maxVal):
+        self._maxVal = maxVal
+
     def setWordLength(self, wordLength):
         self._wordLength = wordLength
 
@@ -26,6 +37,10 @@ class tstNode:
     def markHasWord(self):
         self._hasWord = True
 
+    # The key word of the node was deleted
+    def unmarkHasWord(self):
+        self._hasWord = False
+
     # Set the down node of the current node
     def setDownNode(self, node):
         self._linkDown = node
@@ -38,9 +53,8 @@ class tstNode:
     def setRightNode(self, node):
         self._linkRight = node
 
-    # Set the parent node of the current node
-    def setParentNode(self, node):
-        self._linkParent = node
+    def setKeyId(self, keyId):
+        self._keyId = keyId
 
     # ------------- Get functions ----------------- #
     def getDownNode(self):
@@ -52,12 +66,15 @@ class tstNode:
     def getRightNode(self):
         return self._linkRight
 
-    def getParentNode(self):
-        return self._linkParent
+    def getKeyId(self):
+        return self._keyId
 
     def getValue(self):
         return self._val
 
+    def getMaxValue(self):
+        return self._maxVal
+
     def getWordLength(self):
         return self._wordLength
 
@@ -69,3 +86,91 @@ class tstNode:
 
     def __lt__(self, other):
         return self._val > other._val
+
+
+# --------------------------------------------------------------------- #
+#  Node store handing out tstNode objects. keyDict talks to its nodes
+#  only through a node store so that the object nodes above and the
+#  array backed tstNodePool can be used interchangeably. A missing
+#  link is returned as None
+# --------------------------------------------------------------------- #
+class tstNodeStore:
+    def __init__(self):
+        self._numNodes = 0
+
+    def newNode(self, nodeChar):
+        self._numNodes += 1
+        return tstNode(nodeChar)
+
+    # A new node with the char, value and links of node
+    def copyNode(self, node):
+        self._numNodes += 1
+        copy = tstNode(node._char, node._numWords, node._maxWordLength)
+        copy._val = node._val
+        copy._maxVal = node._maxVal
+        copy._keyId = node._keyId
+        copy._linkLeft = node._linkLeft
+        copy._linkRight = node._linkRight
+        copy._linkDown = node._linkDown
+        copy._hasWord = node._hasWord
+        copy._wordLength = node._wordLength
+        return copy
+
+    def numNodes(self):
+        return self._numNodes
+
+    # ------------- Set functions ----------------- #
+    def setValue(self, node, val):
+        node._val = val
+
+    def setMaxValue(self, node, maxVal):
+        node._maxVal = maxVal
+
+    def setWordLength(self, node, wordLength):
+        node._wordLength = wordLength
+
+    def markHasWord(self, node):
+        node._hasWord = True
+
+    def unmarkHasWord(self, node):
+        node._hasWord = False
+
+    def setDownNode(self, node, child):
+        node._linkDown = child
+
+    def setLeftNode(self, node, child):
+        node._linkLeft = child
+
+    def setRightNode(self, node, child):
+        node._linkRight = child
+
+    def setKeyId(self, node, keyId):
+        node._keyId = keyId
+
+    # ------------- Get functions ----------------- #
+    def getDownNode(self, node):
+        return node._linkDown
+
+    def getLeftNode(self, node):
+        return node._linkLeft
+
+    def getRightNode(self, node):
+        return node._linkRight
+
+    def getKeyId(self, node):
+        return node._keyId
+
+    def getValue(self, node):
+        return node._val
+
+    def getMaxValue(self, node):
+        return node._maxVal
+
+    def getWordLength(self, node):
+        return node._wordLength
+
+    def getChar(self, node):
+        return node._char
+
+    def hasWord(self, node):
+        return node._hasWord
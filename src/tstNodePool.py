@@ -0,0 +1,151 @@
+# --------------------------------------------------------------------- #
+#  Compact node store for the ternary search tree. Instead of one Python
+#  object per node, every node field lives in its own typed array
+#  (column) and a node is just an integer index into those columns.
+#  Node id 0 is reserved and stands for "no node", so a missing link is
+#  returned as 0 (falsy) where tstNodeStore returns None.
+#
+#  Per node cost is 4 + 4 * 4 + 2 * 8 + 4 + 1 = 41 bytes against well
+#  over a hundred bytes for a tstNode object
+# --------------------------------------------------------------------- #
+from array import array
+
+
+class tstNodePool:
+    # Names and array type codes of the columns
+    columnTypes = [("chars", 'I'), ("left", 'i'), ("right", 'i'), ("down", 'i'), ("keyId", 'i'),
+                   ("val", 'q'), ("maxVal", 'q'), ("wordLength", 'I'), ("hasWord", 'B')]
+
+    # Constructor; columns optionally maps the column names to existing
+    # columns. Columns which cannot grow, like memoryviews into a memory
+    # mapped snapshot, make the pool read-only
+    def __init__(self, columns=None):
+        self._readOnly = columns is not None and not hasattr(columns["chars"], "append")
+        if columns is None:
+            # Slot 0 is the null node
+            columns = {}
+            for name, typeCode in tstNodePool.columnTypes:
+                columns[name] = array(typeCode, [0])
+        self._chars = columns["chars"]
+        self._left = columns["left"]
+        self._right = columns["right"]
+        self._down = columns["down"]
+        self._keyId = columns["keyId"]
+        self._val = columns["val"]
+        self._maxVal = columns["maxVal"]
+        self._wordLength = columns["wordLength"]
+        self._hasWord = columns["hasWord"]
+
+    def getColumns(self):
+        return {"chars": self._chars, "left": self._left, "right": self._right, "down": self._down,
+                "keyId": self._keyId, "val": self._val, "maxVal": self._maxVal, "wordLength": self._wordLength,
+                "hasWord": self._hasWord}
+
+    def isReadOnly(self):
+        return self._readOnly
+
+    # Allocate a new node for nodeChar and return its id
+    def newNode(self, nodeChar):
+        if self._readOnly:
+            raise TypeError("Cannot add nodes to a read-only tstNodePool")
+        self._chars.append(ord(nodeChar))
+        self._left.append(0)
+        self._right.append(0)
+        self._down.append(0)
+        self._keyId.append(0)
+        self._val.append(0)
+        self._maxVal.append(0)
+        self._wordLength.append(0)
+        self._hasWord.append(0)
+        return len(self._chars) - 1
+
+    # Allocate a new node with the char, value and links of node and
+    # return its id
+    def copyNode(self, node):
+        if self._readOnly:
+            raise TypeError("Cannot add nodes to a read-only tstNodePool")
+        for column in (self._chars, self._left, self._right, self._down, self._keyId, self._val, self._maxVal,
+                       self._wordLength, self._hasWord):
+            column.append(column[node])
+        return len(self._chars) - 1
+
+    # Append the nodes held by the columns of another pool, e.g. one built
+    # in another process, and return the number added to their ids. Their
+    # links to each other are kept and the null node is left out
+    def appendNodes(self, columns):
+        if self._readOnly:
+            raise TypeError("Cannot add nodes to a read-only tstNodePool")
+        offset = len(self._chars) - 1
+        ownColumns = self.getColumns()
+        for name, typeCode in tstNodePool.columnTypes:
+            column = columns[name][1:]
+            if name in ("left", "right", "down"):
+                column = array(typeCode, [link + offset if link else 0 for link in column])
+            ownColumns[name].extend(column)
+        return offset
+
+    def numNodes(self):
+        return len(self._chars) - 1
+
+    # Number of bytes held by the columns
+    def getMemoryUsage(self):
+        total = 0
+        for col in self.getColumns().values():
+            total += len(col) * col.itemsize
+        return total
+
+    # ------------- Set functions ----------------- #
+    def setValue(self, node, val):
+        self._val[node] = val
+
+    def setMaxValue(self, node, maxVal):
+        self._maxVal[node] = maxVal
+
+    def setWordLength(self, node, wordLength):
+        self._wordLength[node] = wordLength
+
+    def markHasWord(self, node):
+        self._hasWord[node] = 1
+
+    def unmarkHasWord(self, node):
+        self._hasWord[node] = 0
+
+    def setDownNode(self, node, child):
+        self._down[node] = child
+
+    def setLeftNode(self, node, child):
+        self._left[node] = child
+
+    def setRightNode(self, node, child):
+        self._right[node] = child
+
+    def setKeyId(self, node, keyId):
+        self._keyId[node] = keyId
+
+    # ------------- Get functions ----------------- #
+    def getDownNode(self, node):
+        return self._down[node]
+
+    def getLeftNode(self, node):
+        return self._left[node]
+
+    def getRightNode(self, node):
+        return self._right[node]
+
+    def getKeyId(self, node):
+        return self._keyId[node]
+
+    def getValue(self, node):
+        return self._val[node]
+
+    def getMaxValue(self, node):
+        return self._maxVal[node]
+
+    def getWordLength(self, node):
+        return self._wordLength[node]
+
+    def getChar(self, node):
+        return chr(self._chars[node])
+
+    def hasWord(self, node):
+        return self._hasWord[node] == 1
@@ -0,0 +1,125 @@
+# --------------------------------------------------------------------- #
+#  Radix (path compressed) nodes for the ternary search tree. A chain of
+#  down links through nodes with no left or right siblings and no word
+#  but at its end, like the tail "hetic" of "pathetic", is one node
+#  holding the chars of the chain as a string segment. The first char of
+#  the segment is the one compared on the way down the left and right
+#  links; the word, the value and the down link belong to the last one.
+#  A TST of one char segments is an ordinary TST; keyDict searches
+#  segment nodes going through the chars of a segment where it would go
+#  down a chain of nodes, and splits a segment where a new key leaves it
+#  (see keyDict.hasSegments)
+# --------------------------------------------------------------------- #
+class tstSegmentNode:
+    __slots__ = ('_segment', '_val', '_maxVal', '_keyId', '_linkLeft', '_linkRight', '_linkDown', '_hasWord',
+                 '_wordLength')
+
+    # Constructor
+    def __init__(self, segment):
+        self._segment = segment
+        self._val = 0
+        # Largest value of any word in the subtree of this node, including
+        # the left and right siblings; an upper bound after overwrites
+        self._maxVal = 0
+        # Key table id of the word of this node
+        self._keyId = 0
+        self._linkLeft = None
+        self._linkRight = None
+        self._linkDown = None
+        self._hasWord = False
+        self._wordLength = 0
+
+
+# --------------------------------------------------------------------- #
+#  Node store handing out tstSegmentNode objects, with the node store
+#  API of tstNodeStore plus getSegment and setSegment. getChar is the
+#  first char of the segment
+# --------------------------------------------------------------------- #
+class tstSegmentStore:
+    def __init__(self):
+        self._numNodes = 0
+
+    def newNode(self, nodeChar):
+        return self.newSegmentNode(nodeChar)
+
+    def newSegmentNode(self, segment):
+        self._numNodes += 1
+        return tstSegmentNode(segment)
+
+    # A new node with the segment, value and links of node
+    def copyNode(self, node):
+        copy = self.newSegmentNode(node._segment)
+        copy._val = node._val
+        copy._maxVal = node._maxVal
+        copy._keyId = node._keyId
+        copy._linkLeft = node._linkLeft
+        copy._linkRight = node._linkRight
+        copy._linkDown = node._linkDown
+        copy._hasWord = node._hasWord
+        copy._wordLength = node._wordLength
+        return copy
+
+    def numNodes(self):
+        return self._numNodes
+
+    # ------------- Set functions ----------------- #
+    def setSegment(self, node, segment):
+        node._segment = segment
+
+    def setValue(self, node, val):
+        node._val = val
+
+    def setMaxValue(self, node, maxVal):
+        node._maxVal = maxVal
+
+    def setWordLength(self, node, wordLength):
+        node._wordLength = wordLength
+
+    def markHasWord(self, node):
+        node._hasWord = True
+
+    def unmarkHasWord(self, node):
+        node._hasWord = False
+
+    def setDownNode(self, node, child):
+        node._linkDown = child
+
+    def setLeftNode(self, node, child):
+        node._linkLeft = child
+
+    def setRightNode(self, node, child):
+        node._linkRight = child
+
+    def setKeyId(self, node, keyId):
+        node._keyId = keyId
+
+    # ------------- Get functions ----------------- #
+    def getSegment(self, node):
+        return node._segment
+
+    def getDownNode(self, node):
+        return node._linkDown
+
+    def getLeftNode(self, node):
+        return node._linkLeft
+
+    def getRightNode(self, node):
+        return node._linkRight
+
+    def getKeyId(self, node):
+        return node._keyId
+
+    def getValue(self, node):
+        return node._val
+
+    def getMaxValue(self, node):
+        return node._maxVal
+
+    def getWordLength(self, node):
+        return node._wordLength
+
+    def getChar(self, node):
+        return node._segment[0]
+
+    def hasWord(self, node):
+        return node._hasWord
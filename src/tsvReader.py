@@ -0,0 +1,173 @@
+# --------------------------------------------------------------------- #
+#  Streaming reader of key value tsv files, "-" for stdin. gzip input is
+#  recognized by its magic bytes and decompressed on the fly. The file is
+#  read in binary chunks of chunkSize bytes, cut at the last newline, and
+#  the lines of a chunk are parsed in bulk: when every line is one key
+#  and one value, the chunk is split into its key and value columns at
+#  once and the values converted with a single map(int, ...). Other
+#  chunks are parsed line by line, counting the lines without a key or a
+#  value as skipped and those with a value that is not an integer (or
+#  bytes that are not utf-8) as malformed. The keys and values come out
+#  one chunk at a time, so the file is never held in memory as a whole
+# --------------------------------------------------------------------- #
+import gzip
+import itertools
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+gzipMagic = b"\x1f\x8b"
+
+
+# Peak resident memory of the process in bytes, None where it is not known
+def getPeakMemory():
+    if resource is None:
+        return None
+    maxRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return maxRss
+    return maxRss * 1024
+
+
+class tsvReader:
+    # progressRows: print the rows read so far every progressRows rows,
+    # None for no progress lines
+    def __init__(self, filename, chunkSize=4 << 20, progressRows=None):
+        self._filename = filename
+        self._chunkSize = chunkSize
+        self._progressRows = progressRows
+        self._numRows = 0
+        self._numSkipped = 0
+        self._numMalformed = 0
+        self._numBytes = 0
+        self._startTime = None
+        self._endTime = None
+
+    # Open the input for reading bytes; raises IOError if it cannot be
+    # opened. Returns the stream to read and the one to close, None for stdin
+    def openStream(self):
+        if self._filename == "-":
+            stream = sys.stdin.buffer
+            closeStream = None
+        else:
+            stream = open(self._filename, "rb")
+            closeStream = stream
+        if stream.peek(2)[:2] == gzipMagic:
+            stream = gzip.GzipFile(fileobj=stream)
+        return stream, closeStream
+
+    # Generator of the (keys, values) columns of every chunk, the values
+    # as ints. Raises IOError if the input cannot be opened or read
+    def iterateBatches(self):
+        stream, closeStream = self.openStream()
+        self._startTime = time.time()
+        nextProgress = self._progressRows
+        try:
+            rest = b""
+            while True:
+                data = stream.read(self._chunkSize)
+                self._numBytes += len(data)
+                if not data:
+                    break
+                data = rest + data
+                cut = data.rfind(b"\n")
+                if cut < 0:
+                    rest = data
+                    continue
+                rest = data[cut + 1:]
+                keys, vals = self.parseLines(data[:cut])
+                if keys:
+                    yield keys, vals
+                if nextProgress is not None and self._numRows >= nextProgress:
+                    print("Read " + str(self._numRows) + " rows, " + "%.0f" % self.getRowsPerSec() + " rows/s")
+                    while nextProgress <= self._numRows:
+                        nextProgress += self._progressRows
+            if rest:
+                keys, vals = self.parseLines(rest)
+                if keys:
+                    yield keys, vals
+        finally:
+            self._endTime = time.time()
+            if closeStream is not None:
+                closeStream.close()
+
+    # Generator of the [key, value] pairs of the input, chunk by chunk
+    def iterateKeyVals(self):
+        for keys, vals in self.iterateBatches():
+            yield from zip(keys, vals)
+
+    # Key and value columns of the lines of a chunk, joined by newlines
+    def parseLines(self, data):
+        try:
+            text = data.decode("utf-8")
+        except UnicodeDecodeError:
+            return self.parseUndecodedLines(data)
+        lines = text.split("\n")
+        self._numRows += len(lines)
+        if set(map(str.count, lines, itertools.repeat("\t"))) == {1}:
+            # The lines are dropped before the columns are made, to hold
+            # one copy of the chunk at a time
+            del lines
+            parts = text.replace("\n", "\t").split("\t")
+            keys = parts[0::2]
+            if "" not in keys:
+                try:
+                    return keys, list(map(int, parts[1::2]))
+                except ValueError:
+                    pass
+            del parts, keys
+            lines = text.split("\n")
+        return self.parseEachLine(lines)
+
+    # The lines of a chunk having bytes which are not utf-8: each line is
+    # decoded on its own and the ones which cannot be are malformed
+    def parseUndecodedLines(self, data):
+        lines = []
+        numMalformed = 0
+        for line in data.split(b"\n"):
+            try:
+                lines.append(line.decode("utf-8"))
+            except UnicodeDecodeError:
+                numMalformed += 1
+        self._numRows += len(lines) + numMalformed
+        self._numMalformed += numMalformed
+        return self.parseEachLine(lines)
+
+    def parseEachLine(self, lines):
+        keys = []
+        vals = []
+        for line in lines:
+            cols = line.split("\t")
+            if len(cols) < 2 or len(cols[0]) == 0:
+                self._numSkipped += 1
+                continue
+            try:
+                val = int(cols[1])
+            except ValueError:
+                self._numMalformed += 1
+                continue
+            keys.append(cols[0])
+            vals.append(val)
+        return keys, vals
+
+    def getRowsPerSec(self):
+        endTime = self._endTime
+        if endTime is None:
+            endTime = time.time()
+        if self._startTime is None or endTime <= self._startTime:
+            return 0.0
+        return self._numRows / (endTime - self._startTime)
+
+    # Rows read, skipped and malformed, the uncompressed bytes read, the
+    # read time, the rows per second and the peak memory of the process
+    def getStats(self):
+        readTime = 0.0
+        if self._startTime is not None and self._endTime is not None:
+            readTime = self._endTime - self._startTime
+        return {"rows": self._numRows, "skipped": self._numSkipped, "malformed": self._numMalformed,
+                "bytes": self._numBytes, "readTime": readTime, "rowsPerSec": self.getRowsPerSec(),
+                "peakMemory": getPeakMemory()}
@@ -0,0 +1,129 @@
+# --------------------------------------------------------------------- #
+#  A query typed one char at a time. The session keeps what findKeys
+#  would compute again from scratch on every keystroke:
+#     the TST node of every prefix of the query, so a keystroke descends
+#       one level from the last one
+#     the rows of the fuzzy search (see incrementalDLMatrix), so the
+#       nodes walked again only get the column of the new char computed
+#     the suffix array range of every prefix, so the range of the query
+#       is searched for within the range of the query before it
+#  extend and backspace return the keys findKeys gives for the new query
+# --------------------------------------------------------------------- #
+import time
+
+from incrementalDLMatrix import dlRowCache
+
+
+class typeaheadSession:
+    # getKeyDict, if given, returns the version of the dictionary published
+    # by a store with versions on, which every keystroke searches
+    def __init__(self, kd, numResults, fuzzyMaxNodes=None, fuzzyMaxTime=None, fuzzyEngine=None, getKeyDict=None):
+        self._keyDict = kd
+        self._getKeyDict = getKeyDict
+        self._numResults = numResults
+        self._fuzzyMaxNodes = fuzzyMaxNodes
+        self._fuzzyMaxTime = fuzzyMaxTime
+        self._fuzzyEngine = fuzzyEngine
+        self._query = ""
+        # TST node of every prefix of the query, None for the ones not in
+        # the TST, and the root they were found from
+        self._cursor = []
+        self._root = kd.getRoot()
+        self._nodes = kd.getNodeStore()
+        # Suffix array range of every prefix and the columns of the suffix
+        # array they are ranges of
+        self._suffixRanges = []
+        self._suffixColumns = None
+        self._rowCache = dlRowCache()
+
+    def getQuery(self):
+        return self._query
+
+    # Type chars at the end of the query and return the keys for it
+    def extend(self, chars):
+        self.checkCursor()
+        kd = self._keyDict
+        nodes = kd.getNodeStore()
+        for c in chars:
+            if kd.hasSegments():
+                # A segment node holds a run of chars of the query
+                node = kd.findPrefixNodes([self._query + c])[0]
+            elif not self._query:
+                node = kd.findFirstNodeFromTop(kd.getRoot(), c)
+            elif self._cursor[-1] is None:
+                node = None
+            else:
+                node = kd.findFirstNodeFromTop(nodes.getDownNode(self._cursor[-1]), c)
+            self._query += c
+            self._cursor.append(node)
+        return self.findKeys()
+
+    # Delete the last char of the query and return the keys for what is left
+    def backspace(self):
+        if self._query:
+            self._query = self._query[:-1]
+            self._cursor.pop()
+            del self._suffixRanges[len(self._query):]
+            if not self._query:
+                # The next query need not start like this one did
+                self._rowCache.clear()
+        return self.findKeys()
+
+    # A bulk load or a compact makes a new TST, and a new version copies the
+    # nodes from the root down to its changes, so the cursor is found again
+    # in it
+    def checkCursor(self):
+        if self._getKeyDict is not None:
+            self._keyDict = self._getKeyDict()
+        kd = self._keyDict
+        if kd.getRoot() is not self._root or kd.getNodeStore() is not self._nodes:
+            self._root = kd.getRoot()
+            self._nodes = kd.getNodeStore()
+            self._cursor = kd.findPrefixNodes([self._query[:i] for i in range(1, len(self._query) + 1)])
+
+    # Suffix array range of the query, None without an up to date suffix
+    # array or for queries the substring search leaves out
+    def getSuffixRange(self):
+        suffixArray = self._keyDict.getSuffixArrayIndex()
+        if suffixArray is None or suffixArray.isStale() or len(self._query) < 2:
+            return None
+        if suffixArray.getColumns() is not self._suffixColumns:
+            self._suffixColumns = suffixArray.getColumns()
+            self._suffixRanges = []
+        while len(self._suffixRanges) < len(self._query):
+            if self._suffixRanges:
+                lo, hi = self._suffixRanges[-1]
+            else:
+                lo, hi = 0, suffixArray.numSuffixes()
+            self._suffixRanges.append(suffixArray.findRange(self._query[:len(self._suffixRanges) + 1], lo, hi))
+        return self._suffixRanges[-1]
+
+    # The keys of keyValueStore.findKeys for the query
+    def findKeys(self):
+        keyList = []
+        if not self._query:
+            return keyList
+        self.checkCursor()
+        kd = self._keyDict
+        nodes = kd.getNodeStore()
+        visitedKeys = {}
+        numWords = self._numResults
+        node = self._cursor[-1]
+        if node is not None:
+            if nodes.hasWord(node) is True and nodes.getWordLength(node) == len(self._query):
+                visitedKeys[self._query] = True
+                keyList.append([self._query, nodes.getValue(node)])
+                numWords -= 1
+            kd.searchAllKeysWithPrefix(self._query, keyList, numWords, visitedKeys, node, len(self._query) - 1)
+
+        if len(keyList) < numWords:
+            deadline = None
+            if self._fuzzyMaxTime is not None:
+                deadline = time.time() + self._fuzzyMaxTime
+            kd.searchKeyFuzzy(self._query, 2, numWords - len(keyList), keyList, visitedKeys, self._fuzzyMaxNodes,
+                              deadline, self._fuzzyEngine, self._rowCache)
+
+        if len(keyList) < numWords:
+            kd.searchSubstringKeys(self._query, keyList, numWords - len(keyList), visitedKeys,
+                                   self.getSuffixRange())
+        return keyList